@@ -40,11 +40,6 @@ bldg = cleanup_marker_tags(bldg)
 report = ph_typer_many(bldg)
 reporter(report, bldg_name, bldg)
 
-# # CSV filename
-# csv_name = "report_{}.csv".format(bldg_name)
+# # Plot the tag counts straight from the report
 # output_dir = os.path.join(os.getcwd(), 'output', bldg_name)
-# output_file = os.path.join(output_dir, csv_name)
-#
-# # Read in csv file as a dataframe
-# df = pd.read_csv(output_file)
-# plot1(df, output_dir, bldg_name)
+# plot1(report, output_dir, bldg_name)
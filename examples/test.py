@@ -4,6 +4,7 @@ import os
 import sys
 sys.path.append(os.getcwd())
 from utils.utils import *
+from utils.filters import FilterIndex
 # Instantiate a graph
 g = Graph()
 
@@ -41,34 +42,29 @@ ex_file = os.path.join(ex_dir, "ghausi-improved.json")
 # Import the json file as a dictionary.
 bldg = import_haystack_json(ex_file)
 
-# Find all equipment entities
-equips, not_equips = find_equips(bldg)
+# Index the tags of all entities once, so that the many filter
+# queries below are set operations rather than full scans
+index = FilterIndex(bldg)
 
-# Define tagset requirements for points
-sensor_tags = ['point', 'sensor']
-cmd_tags = ['point', 'cmd']
-sp_tags = ['point', 'sp']
+# Find all equipment entities
+equips = index.query('equip')
 
 # Find all point entities
-sensors, not_sensors = find_tagset(bldg, sensor_tags)
-cmds, not_cmds = find_tagset(bldg, cmd_tags)
-sps, not_sps = find_tagset(bldg, sp_tags)
+sensors = index.query('point and sensor')
+cmds = index.query('point and cmd')
+sps = index.query('point and sp')
 
-# Define tags for equipment entities
+# Find equip entities by type.
 # Quick check in the JSON file revealed these are the
-# most common equip entities
-vav_tags = ['equip', 'vav']
-ahu_tags = ['equip', 'ahu']
-fcu_tags = ['equip', 'fcu']
-meter_tags = ['equip', 'meter']
-
-vavs, equips2 = find_tagset(equips, vav_tags)
-ahus, equips2 = find_tagset(equips2, ahu_tags)
-fcus, equips2 = find_tagset(equips2, fcu_tags)
-meters, equips2 = find_tagset(equips2, meter_tags)
+# most common equip entities.  Each type excludes the ones before it.
+vavs = index.query('equip and vav')
+ahus = index.query('equip and ahu and not vav')
+fcus = index.query('equip and fcu and not vav and not ahu')
+meters = index.query('equip and meter and not vav and not ahu and not fcu')
+equips2 = index.query('equip and not vav and not ahu and not fcu and not meter')
 exhaust_fans = find_str_in_navName(equips2, 'exhaust')
 
-points, _ = find_tagset(bldg, ['point'])
+points = index.query('point')
 # chosen = vavs[0]
 # chosen_points = find_equip_points(chosen, sensors)
 
@@ -107,9 +103,8 @@ ent_keys = ent_keys.difference(set(unique_point_keys))
 ent_keys = list(ent_keys)
 cnt = 0
 for k in ent_keys:
-    a, _ = find_tagset(bldg, [k])
-    cnt += len(a)
-    print("Tag: {}\t\t\tNumber: {}".format(k, len(a)))
+    cnt += index.count(k)
+    print("Tag: {}\t\t\tNumber: {}".format(k, index.count(k)))
 
 print("Total number of Entities in the Building: {}".format(len(bldg)))
 print("")
@@ -128,3 +123,9 @@ print("Total Number of Point-Cmds: {}".format(len(cmds)))
 print("Total Number of Point-Sps: {}".format(len(sps)))
 
 print(ent_keys)
+
+# Export the building to Brick, streaming the triples to a Turtle file
+# instead of adding them to the in-memory graph g
+# from utils.export import export_haystack_json_to_brick
+# export_haystack_json_to_brick(ex_file, os.path.join(os.getcwd(), 'output', 'ghausi-improved.ttl'),
+#                               fmt='turtle', namespace=BLDG1)
@@ -0,0 +1,34 @@
+import argparse
+import json
+import os
+import sys
+sys.path.append(os.getcwd())
+from utils.utils import *
+from utils.rules import apply_rules, format_rule_counts, load_rules
+
+"""
+Retag a Haystack JSON building with a rules file (see utils/rules.py), in a
+single pass over the entities, printing the before / changed / after counts
+of every rule.
+
+Usage:
+    python scripts/apply_rules.py scripts/ghausi.rules ../brick-examples/haystack/ghausi.json --dry-run
+    python scripts/apply_rules.py scripts/ghausi.rules ghausi.json --output ghausi-improved.json
+"""
+
+parser = argparse.ArgumentParser(description="Retag a Haystack JSON building with a rules file")
+parser.add_argument('rules', help="Rules file")
+parser.add_argument('file', help="Haystack JSON file")
+parser.add_argument('--output', default=None, help="Where to write the retagged building")
+parser.add_argument('--dry-run', action='store_true', help="Only print the counts, do not retag")
+args = parser.parse_args()
+
+bldg = import_haystack_json(args.file)
+results = apply_rules(bldg, load_rules(args.rules), dry_run=args.dry_run)
+for line in format_rule_counts(results):
+    print(line)
+
+if not args.dry_run and args.output:
+    with open(args.output, 'w') as f:
+        json.dump({"rows": bldg}, f)
+    print("Retagged building written to {}".format(args.output))
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+sys.path.append(os.getcwd())
+from utils.batch import batch_report
+from utils.sinks import SINKS
+
+"""
+Report on a whole portfolio of Haystack sites in one run.
+
+Every site file in the directory (or matching the glob) gets the same
+output/<site>/report_<site>.json / .csv as examples/reporter.py (or, with
+--format jsonl / binary, a streamed report_<site>.jsonl / .bgr plus
+report_<site>.general.json), and the portfolio roll up
+(portfolio_summary.csv / .md, portfolio_tags.csv) is written to the output
+directory.
+
+Usage:
+    python scripts/batch_report.py ../brick-examples/haystack
+    python scripts/batch_report.py "exports/*/site_*.json" --workers 8 --output portfolio
+    python scripts/batch_report.py ../brick-examples/haystack --format jsonl
+    python scripts/batch_report.py ../brick-examples/haystack --plots --plot-top 50
+
+With --plots the tag count plots of every site are drawn too (see
+utils/plotting.py), skipping those whose counts did not change since the
+last run.
+"""
+
+parser = argparse.ArgumentParser(description="Report on a portfolio of Haystack JSON site files")
+parser.add_argument('path', help="Directory of site files, or a glob pattern")
+parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all CPUs)")
+parser.add_argument('--output', default=os.path.join(os.getcwd(), 'output'), help="Output directory")
+parser.add_argument('--format', default='pretty', choices=sorted(SINKS), help="Per site report format")
+parser.add_argument('--plots', action='store_true', help="Also plot the tag counts of every site")
+parser.add_argument('--plot-top', type=int, default=None, help="Only plot the top N tags of each tag category")
+parser.add_argument('--plot-fast', action='store_true', help="Draw smaller plots directly with matplotlib")
+args = parser.parse_args()
+
+summaries, _ = batch_report(args.path, args.output, args.workers, fmt=args.format)
+for s in summaries:
+    print("{}\tTotal: {}\tValid: {}\tNo first class: {}\tMultiple first class: {}".format(
+        s['site_name'], s['total'], s['valid'], s['no_fc_entity'], s['mult_fc_entities']))
+print("Portfolio summary written to {}".format(args.output))
+
+if args.plots:
+    import pandas as pd
+    from utils.plotting import plot_portfolio
+    reports = {}
+    for s in summaries:
+        f_name = os.path.join(args.output, s['site_name'], 'report_{}.csv'.format(s['site_name']))
+        reports[s['site_name']] = pd.read_csv(f_name, keep_default_na=False)
+    rendered = plot_portfolio(reports, args.output, args.workers or os.cpu_count(), top_n=args.plot_top,
+                              fast=args.plot_fast)
+    print("{} plots rendered".format(len(rendered)))
@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+sys.path.append(os.getcwd())
+from utils.benchmark import BENCHMARKS, find_regressions, load_results, print_result, run_benchmarks, write_results
+
+"""
+Benchmark the report pipeline (ontology loading, import_haystack_json,
+cleanup_marker_tags, find_tagset, ph_typer_many, count_tags_by_entity and
+reporter) on synthetic buildings, and write the timings as JSON so that
+runs can be compared for regressions.
+
+Usage:
+    python scripts/benchmark.py --sizes 1000 100000 --output bench.json
+    python scripts/benchmark.py --sizes 1000000 --benchmarks ph_typer_many --repeat 1
+    python scripts/benchmark.py --baseline bench.json --output new.json
+"""
+
+parser = argparse.ArgumentParser(description="Benchmark the report pipeline on synthetic buildings")
+parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                    help="Building sizes, in entities")
+parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=None,
+                    help="Benchmarks to run (default: all)")
+parser.add_argument('--repeat', type=int, default=3, help="Runs of each benchmark, the fastest is compared")
+parser.add_argument('--custom-ratio', type=float, default=0.1, help="Share of entities with custom tags")
+parser.add_argument('--points-per-equip', type=int, default=8, help="Mean points per equip")
+parser.add_argument('--equips-per-floor', type=int, default=20, help="Equips per floor")
+parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic buildings")
+parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+parser.add_argument('--baseline', default=None, help="Results JSON to check for regressions against")
+parser.add_argument('--threshold', type=float, default=1.25,
+                    help="Slowdown over the baseline reported as a regression")
+args = parser.parse_args()
+
+results = run_benchmarks(args.sizes, args.benchmarks, args.repeat, {
+    'custom_ratio': args.custom_ratio,
+    'points_per_equip': args.points_per_equip,
+    'equips_per_floor': args.equips_per_floor,
+    'seed': args.seed,
+}, progress=print_result)
+if args.output:
+    write_results(results, args.output)
+    print("Results written to {}".format(args.output))
+
+if args.baseline:
+    regressions = find_regressions(load_results(args.baseline), results, args.threshold)
+    for name, n, before, after, ratio in regressions:
+        print("REGRESSION {} ({} entities): {:.4f}s -> {:.4f}s ({:.2f}x)".format(name, n, before, after, ratio))
+    if regressions:
+        exit(1)
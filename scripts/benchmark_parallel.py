@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+sys.path.append(os.getcwd())
+from utils.utils import *
+
+"""
+Time ph_typer_many with an increasing number of worker processes, on a
+building made by repeating a Haystack export (pes.json by default) many
+times with fresh ids.
+
+Usage:
+    python scripts/benchmark_parallel.py [file_name] [copies] [max_workers]
+"""
+
+file_to_analyze = sys.argv[1] if len(sys.argv) > 1 else "pes.json"
+copies = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else max(8, os.cpu_count() or 1)
+
+# Define location of brick-example/haystack
+ex_dir = os.path.join(os.getcwd(), '../brick-examples/haystack')
+ex_file = os.path.join(ex_dir, file_to_analyze)
+
+if not os.path.isfile(ex_file):
+    print("File does not exist: {}".format(ex_file))
+    exit(1)
+
+bldg = cleanup_marker_tags(import_haystack_json(ex_file))
+campus = []
+for c in range(copies):
+    for e in bldg:
+        e2 = dict(e)
+        e2['id'] = "{}-{}".format(e.get('id'), c)
+        campus.append(e2)
+
+# Load the ontology up front so it is not part of any timing
+get_default_defs().all_markers
+
+print("Entities: {}\tCPUs: {}".format(len(campus), os.cpu_count()))
+start = time.perf_counter()
+ph_typer_many(campus)
+serial = time.perf_counter() - start
+print("workers=1\t{:.2f}s\tspeedup 1.00".format(serial))
+
+workers = 2
+while workers <= max_workers:
+    start = time.perf_counter()
+    ph_typer_many(campus, workers=workers)
+    elapsed = time.perf_counter() - start
+    print("workers={}\t{:.2f}s\tspeedup {:.2f}".format(workers, elapsed, serial / elapsed))
+    workers *= 2
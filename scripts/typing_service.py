@@ -0,0 +1,33 @@
+import argparse
+import asyncio
+import os
+import sys
+sys.path.append(os.getcwd())
+from utils.service import TypingService
+
+"""
+Run the typing service: the Haystack defs are loaded once and kept warm, and
+batches of Haystack rows POSTed to /type are answered with their ph_typer
+results and general report sections (see utils/service.py).
+
+Usage:
+    python scripts/typing_service.py --port 8765
+    python scripts/typing_service.py --unix /tmp/building-graphs.sock
+
+    curl -s localhost:8765/type -d '{"rows": [{"id": "@p", "point": "m:", "sensor": "m:"}]}'
+"""
+
+parser = argparse.ArgumentParser(description="Serve Haystack typing over HTTP")
+parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+parser.add_argument('--port', type=int, default=8765, help="Port to listen on")
+parser.add_argument('--unix', default=None, help="Listen on this Unix socket instead")
+parser.add_argument('--max-batch', type=int, default=50000, help="Most rows typed in one batch")
+parser.add_argument('--batch-delay', type=float, default=0.002,
+                    help="Seconds to wait for more requests to batch together")
+args = parser.parse_args()
+
+service = TypingService(max_batch=args.max_batch, batch_delay=args.batch_delay)
+try:
+    asyncio.run(service.serve_forever(args.host, args.port, args.unix))
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The utils package is imported relative to the repo root, as in the
+# examples and scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import csv
+import json
+import os
+
+import pytest
+
+from utils.batch import batch_report, find_site_files, merge_tag_counts
+
+
+@pytest.fixture
+def sites(tmp_path):
+    site_dir = tmp_path / 'haystack'
+    site_dir.mkdir()
+    for name, n in (('alpha', 3), ('beta', 5)):
+        rows = [{'id': '@%s-site' % name, 'site': 'M', 'dis': name, 'area': 'n:10'}]
+        rows += [{'id': '@%s-vav%d' % (name, i), 'equip': 'M', 'vav': 'M', 'siteRef': '@s', 'custom': 'M'}
+                 for i in range(n)]
+        rows += [{'id': '@%s-p' % name, 'newRec': 'm:'}]
+        (site_dir / (name + '.json')).write_text(json.dumps({'rows': rows}))
+    (site_dir / 'notes.txt').write_text('')
+    return str(site_dir)
+
+
+def test_find_site_files(sites):
+    assert [os.path.basename(f) for f in find_site_files(sites)] == ['alpha.json', 'beta.json']
+    assert [os.path.basename(f) for f in find_site_files(os.path.join(sites, 'b*.json'))] == ['beta.json']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_report(sites, tmp_path, workers):
+    output = str(tmp_path / 'output')
+    summaries, counts = batch_report(sites, output, workers=workers)
+    assert [s['site_name'] for s in summaries] == ['alpha', 'beta']
+    assert [s['valid'] for s in summaries] == [4, 6]
+    assert summaries[1]['subclass_count'] == {'vav': 5}
+    assert counts['equip']['invalid_markers'] == {'custom': 8}
+    assert counts['other']['invalid_markers'] == {'newRec': 2}
+    for name in ('alpha', 'beta'):
+        assert os.path.isfile(os.path.join(output, name, 'report_%s.json' % name))
+        assert os.path.isfile(os.path.join(output, name, 'report_%s.csv' % name))
+    with open(os.path.join(output, 'portfolio_summary.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]['file_name'] == 'alpha.json'
+    assert rows[1]['fc_equip'] == '5' and rows[1]['subclass_vav'] == '5'
+    assert os.path.isfile(os.path.join(output, 'portfolio_summary.md'))
+    assert os.path.isfile(os.path.join(output, 'portfolio_tags.csv'))
+
+
+def test_no_sites(tmp_path):
+    with pytest.raises(ValueError):
+        batch_report(str(tmp_path), str(tmp_path / 'output'))
+
+
+def test_merge_tag_counts():
+    totals = merge_tag_counts({}, {'point': {'valid_markers': {'his': 2}}})
+    merge_tag_counts(totals, {'point': {'valid_markers': {'his': 1, 'sp': 1}}})
+    assert totals['point']['valid_markers'] == {'his': 3, 'sp': 1}
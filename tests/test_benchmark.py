@@ -0,0 +1,32 @@
+import pytest
+
+from utils.benchmark import find_regressions, load_results, run_benchmarks, write_results
+
+
+def test_run_benchmarks(tmp_path):
+    seen = []
+    results = run_benchmarks([200], ['ontology_cached', 'ph_typer_many', 'reporter'], repeat=2,
+                             progress=seen.append)
+    assert [(r['benchmark'], r['entities']) for r in results['results']] == [
+        ('ontology_cached', None), ('ph_typer_many', 200), ('reporter', 200)]
+    assert seen == results['results']
+    for r in results['results']:
+        assert 0 < r['min'] <= r['median']
+    assert results['results'][1]['entities_per_s'] > 0
+    assert set(results['environment']) == {'python', 'platform', 'cpus', 'commit'}
+
+    file = str(tmp_path / 'results.json')
+    write_results(results, file)
+    assert load_results(file) == results
+
+
+def test_unknown_benchmark():
+    with pytest.raises(ValueError):
+        run_benchmarks([100], ['nope'])
+
+
+def test_find_regressions():
+    def results(*times):
+        return {'results': [{'benchmark': b, 'entities': 100, 'min': t} for b, t in zip('ab', times)]}
+    assert find_regressions(results(1.0, 1.0), results(1.1, 2.0)) == [('b', 100, 1.0, 2.0, 2.0)]
+    assert find_regressions(results(1.0), results(1.0, 2.0)) == []
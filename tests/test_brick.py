@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import utils.queries
+from utils.brick import BrickDefs, BrickTagsetIndex, class_tags, haystack_to_brick_tags
+from utils.defs import Taxonomy
+from utils.export import haystack_to_brick_triples
+from utils.queries import BRICK
+from utils.utils import ph_typer
+from rdflib import RDF
+
+
+@pytest.fixture(scope='module')
+def brick(tmp_path_factory):
+    return BrickDefs(cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+def test_snapshot_is_cached(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    compiled = BrickDefs(cache_dir=cache_dir).snapshot
+    assert any(f.startswith('brick_') for f in os.listdir(cache_dir))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Brick.ttl parsed despite a cached snapshot")
+    monkeypatch.setattr(utils.queries, 'init_brick_graph', fail)
+    defs = BrickDefs(cache_dir=cache_dir)
+    assert defs.snapshot == compiled
+    assert defs._graph is None
+    assert 'Discharge_Air_Temperature_Sensor' in defs.classes
+
+
+def test_tags():
+    assert class_tags('Discharge_Air_Temperature_Sensor') == {'discharge', 'air', 'temperature', 'sensor'}
+    assert haystack_to_brick_tags(['temp', 'sp', 'coolingTower', 'equip']) == \
+        {'temperature', 'setpoint', 'cooling', 'tower', 'equipment'}
+
+
+@pytest.mark.parametrize('markers, expected', [
+    (['equip', 'ahu'], 'AHU'),
+    (['equip', 'vav'], 'VAV'),
+    (['equip', 'elec', 'meter'], 'Electricity_Meter'),
+    (['site'], 'Building'),
+    (['point', 'sensor'], 'Sensor'),
+    (['point', 'sensor', 'discharge', 'air', 'temp'], 'Discharge_Air_Temperature_Sensor'),
+    (['point', 'sp', 'zone', 'air', 'temp', 'cooling'], 'Zone_Cooling_Temperature_Setpoint'),
+    (['custom'], None),
+])
+def test_match(brick, markers, expected):
+    assert brick.match(markers) == expected
+
+
+def test_ties_use_depth_then_name():
+    taxonomy = Taxonomy([['Hot_Water_Sensor', 'Water_Sensor'], ['Water_Sensor', 'Sensor']])
+    index = BrickTagsetIndex(['Sensor', 'Water_Sensor', 'Hot_Water_Sensor', 'Water_Hot_Sensor', 'Fan'], taxonomy)
+    assert index.match({'hot', 'water', 'sensor'}) == 'Hot_Water_Sensor'
+    assert index.match({'water', 'sensor', 'fan'}) == 'Water_Sensor'
+    assert sorted(index.candidates({'water', 'sensor'})) == ['Sensor', 'Water_Sensor']
+
+
+def test_cross_validate(brick):
+    entities = [
+        {'id': '@ahu', 'equip': 'm:', 'ahu': 'm:'},
+        {'id': '@t', 'point': 'm:', 'sensor': 'm:', 'discharge': 'm:', 'air': 'm:', 'temp': 'm:'},
+        # A point whose markers only describe equipment
+        {'id': '@odd', 'point': 'm:', 'ahu': 'm:'},
+        {'id': '@none', 'custom': 'm:'},
+    ]
+    typed = [ph_typer(e) for e in entities]
+    consistent, inconsistent = brick.cross_validate(entities, typed)
+    assert consistent == [('@ahu', 'ahu', 'AHU'), ('@t', 'point', 'Discharge_Air_Temperature_Sensor')]
+    assert inconsistent == [('@odd', 'point', 'AHU')]
+
+
+def test_export_with_brick_classes(brick):
+    e = {'id': '@t', 'point': 'm:', 'sensor': 'm:', 'discharge': 'm:', 'air': 'm:', 'temp': 'm:'}
+    triples = set(haystack_to_brick_triples([(e, ph_typer(e))], classes=brick.entity_class))
+    assert any(p == RDF.type and o == BRICK.Discharge_Air_Temperature_Sensor for s, p, o in triples)
@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils.cli import main
+from utils.synthetic import generate_building, write_haystack_json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAUNCHER = os.path.join(ROOT, 'scripts', 'building-graphs')
+HEAVY = ('rdflib', 'pandas', 'plotnine')
+
+
+@pytest.fixture(scope='module')
+def site(tmp_path_factory):
+    file = str(tmp_path_factory.mktemp('cli') / 'site.json')
+    write_haystack_json(generate_building(300), file)
+    return file
+
+
+def _run(*args):
+    return subprocess.run([sys.executable, LAUNCHER] + list(args), capture_output=True, text=True, cwd=ROOT)
+
+
+# Run the CLI in a fresh interpreter and return the heavy modules imported
+def _heavy_imports(*args):
+    code = ("import sys; sys.path.insert(0, {!r})\n"
+            "from utils.cli import main\n"
+            "try:\n"
+            "    main({!r})\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('heavy:', *[m for m in {!r} if m in sys.modules])").format(ROOT, list(args), HEAVY)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=ROOT, check=True)
+    return out.stdout.splitlines()[-1].split()[1:]
+
+
+def test_help_and_report_skip_heavy_imports(site, tmp_path):
+    assert _heavy_imports('--help') == []
+    assert _heavy_imports('report', site, '--output', str(tmp_path), '--quiet') == []
+    assert _heavy_imports('typecheck', site) == []
+    assert _heavy_imports('query', site, 'point and equipRef->ahu', '--count') == []
+
+
+def test_startup_budget(site, tmp_path):
+    # The first report compiles (or reads) the vocabulary snapshot cache
+    assert _run('report', site, '--output', str(tmp_path), '--quiet').returncode == 0
+    for args in (['--help'], ['report', site, '--output', str(tmp_path), '--quiet']):
+        start = time.perf_counter()
+        result = _run(*args)
+        elapsed = time.perf_counter() - start
+        assert result.returncode == 0, result.stderr
+        assert elapsed < 1.0, "{} took {:.2f}s".format(args, elapsed)
+
+
+def test_report(site, tmp_path, capsys):
+    assert main(['report', site, '--output', str(tmp_path), '--name', 'bldg']) == 0
+    assert "Report for bldg" in capsys.readouterr().out
+    assert sorted(os.listdir(str(tmp_path / 'bldg'))) == ['report_bldg.csv', 'report_bldg.json']
+
+    assert main(['report', site, '--output', str(tmp_path), '--format', 'jsonl', '--quiet', '--metrics']) == 0
+    out = capsys.readouterr().out
+    assert "Report for" not in out
+    assert "ph_typer_many\t" in out
+    assert os.path.isfile(str(tmp_path / 'site' / 'report_site.jsonl'))
+
+
+def test_typecheck(tmp_path, capsys):
+    file = str(tmp_path / 'site.json')
+    write_haystack_json([{'id': 'r:a', 'ahu': 'M', 'equip': 'M'}, {'id': 'r:b', 'foo': 'M'}], file)
+    assert main(['typecheck', file]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out == ["r:b\tNo first class entity type provided", "Entities: 2\tinvalid: 1"]
+    assert main(['typecheck', file, '--strict']) == 1
+
+
+def test_query(site, capsys):
+    assert main(['query', site, 'ahu']) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows and all(r['ahu'] == 'm:' for r in rows)
+
+    assert main(['query', site, 'ahu', '--count']) == 0
+    assert int(capsys.readouterr().out) == len(rows)
+
+    with pytest.raises(SystemExit):
+        main(['query', site])
+
+
+def test_query_sparql(capsys):
+    assert main(['query', '--sparql', 'SELECT ?s WHERE { ?s rdfs:subClassOf phIoT:ahu }']) == 0
+    assert any(line.endswith('#rtu') for line in capsys.readouterr().out.splitlines())
+
+
+def test_launcher(site):
+    result = _run('query', site, 'site', '--count')
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '1'
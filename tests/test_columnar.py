@@ -0,0 +1,49 @@
+import csv
+
+import pandas as pd
+
+from utils.columnar import split_by_tag_category, tag_counts_frame
+from utils.utils import TAG_COUNT_COLUMNS, cleanup_marker_tags, ph_typer_many, reporter
+
+
+def report():
+    bldg = cleanup_marker_tags([
+        {'id': '@site', 'site': 'M', 'area': 'n:1000'},
+        {'id': '@ahu', 'equip': 'm:', 'ahu': 'm:', 'custom': 'm:', 'siteRef': '@site'},
+        {'id': '@fcu', 'equip': 'm:', 'custom': 'm:', 'navName': 'FCU-1', 'siteRef': '@site'},
+        {'id': '@odd', 'newRec': 'm:'},
+    ])
+    return bldg, ph_typer_many(bldg)
+
+
+def test_frame_matches_csv(tmp_path):
+    bldg, r = report()
+    reporter(r, 'site', bldg, str(tmp_path), verbose=False)
+    with open(str(tmp_path / 'site' / 'report_site.csv')) as f:
+        rows = [(e, c, t, int(n)) for e, c, t, n in list(csv.reader(f))[1:]]
+
+    df = tag_counts_frame(r)
+    assert list(df.columns) == TAG_COUNT_COLUMNS
+    assert list(df.itertuples(index=False, name=None)) == rows
+    for column in ('entity_type', 'tag_category', 'tag'):
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert list(df['entity_type'].cat.categories)[-1] == 'other'
+    # Also accepts the general section, or count_tags_by_entity
+    assert tag_counts_frame(r['general']).equals(df)
+    assert tag_counts_frame(r['general']['count_tags_by_entity']).equals(df)
+
+
+def test_split_by_tag_category():
+    _, r = report()
+    parts = dict(split_by_tag_category(tag_counts_frame(r)))
+    assert list(parts) == ['valid_markers', 'invalid_markers', 'valid_vals', 'invalid_vals']
+    invalid = parts['invalid_markers']
+    assert list(invalid['tag'].cat.categories) == ['custom', 'newRec']
+    assert list(invalid['entity_type'].cat.categories) == ['equip', 'other']
+    assert invalid.set_index('tag')['count'].to_dict() == {'custom': 2, 'newRec': 1}
+
+
+def test_empty_report():
+    df = tag_counts_frame({'count_tags_by_entity': {'other': {}}})
+    assert len(df) == 0
+    assert list(split_by_tag_category(df)) == []
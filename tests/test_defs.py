@@ -0,0 +1,114 @@
+import copy
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+import utils.utils as u
+from utils.defs import HaystackDefs, get_default_defs, set_default_defs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, 'tests', 'data', 'typer_fixture.json')
+
+
+# Sort string lists (set ordering is not stable) and strip the set repr
+# from the multiple first class entity description
+def normalize(o):
+    if isinstance(o, dict):
+        o = {k: normalize(v) for k, v in o.items()}
+        if o.get('description', '').startswith('Mutliple'):
+            types = o['description'].split(': ', 1)[1].strip('{}').replace("'", '')
+            o['description'] = 'Mutliple first class entity types provided: ' + \
+                ', '.join(sorted(t.strip() for t in types.split(',')))
+        return o
+    if isinstance(o, list):
+        if all(isinstance(x, str) for x in o):
+            return sorted(o)
+        return [normalize(x) for x in o]
+    return o
+
+
+@pytest.fixture
+def fixture():
+    with open(FIXTURE, 'r') as f:
+        return json.load(f)
+
+
+def test_import_does_not_load_ontology():
+    code = (
+        "import utils.utils\n"
+        "from utils.defs import get_default_defs\n"
+        "d = get_default_defs()\n"
+        "assert d._graph is None and d._snapshot is None\n"
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+def test_import_outside_repo_root(tmp_path):
+    code = "import utils.utils as u; assert 'vav' in u.ALL_EQUIPS"
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-c', code], cwd=str(tmp_path), env=env, check=True)
+
+
+def test_ph_typer_many_matches_baseline(fixture):
+    report = u.ph_typer_many(copy.deepcopy(fixture['rows']))
+    assert normalize(report) == fixture['report']
+
+
+def test_old_positional_arguments_still_accepted(fixture):
+    report = u.ph_typer_many(copy.deepcopy(fixture['rows']), u.FC_ENTITIES, u.ALL_ENTITIES)
+    assert normalize(report) == fixture['report']
+    typed = u.ph_typer(fixture['rows'][1], u.FC_ENTITIES, u.ALL_ENTITIES)
+    assert typed['fc_entity_type'] == 'equip'
+
+
+def test_set_default_defs_swaps_and_restores():
+    original = get_default_defs()
+    custom = HaystackDefs(snapshot=copy.deepcopy(original.snapshot))
+    custom.snapshot['fc_entities'].remove('site')
+    previous = set_default_defs(custom)
+    try:
+        assert previous is original
+        assert get_default_defs() is custom
+        assert 'site' not in u.FC_ENTITIES
+        assert u.ph_typer({'id': '@s', 'site': 'm:'})['valid'] is False
+    finally:
+        set_default_defs(previous)
+    assert get_default_defs() is original
+    assert 'site' in u.FC_ENTITIES
+    assert u.ph_typer({'id': '@s', 'site': 'm:'})['valid'] is True
+
+
+def test_explicit_defs_override_default():
+    custom = HaystackDefs(snapshot=copy.deepcopy(get_default_defs().snapshot))
+    custom.snapshot['markers'].append('unicorn')
+    typed = u.ph_typer({'id': '@x', 'unicorn': 'm:'}, defs=custom)
+    assert typed['valid_markers'] == ['unicorn']
+    assert u.ph_typer({'id': '@x', 'unicorn': 'm:'})['invalid_markers'] == ['unicorn']
+
+
+def test_pickle_keeps_only_snapshot():
+    defs = HaystackDefs()
+    defs.all_markers
+    defs.graph
+    state = defs.__getstate__()
+    assert set(state) == {'path', 'cache_dir', 'use_cache', '_snapshot'}
+    clone = pickle.loads(pickle.dumps(defs))
+    assert clone._graph is None
+    assert clone._memo == {}
+    assert clone.snapshot == defs.snapshot
+    assert clone.all_markers == defs.all_markers
+
+
+def test_legacy_globals_are_memoized_and_star_exported():
+    assert u.ALL_MARKERS is u.ALL_MARKERS
+    assert u.EACH_EQUIP_AS_SET is u.EACH_EQUIP_AS_SET
+    assert 'marker' not in u.ALL_MARKERS
+    assert 'ALL_MARKERS' in u.__all__
+    namespace = {}
+    exec('from utils.utils import *', namespace)
+    assert namespace['FC_ENTITIES'] == u.FC_ENTITIES
+    assert 'ph_typer_many' in namespace
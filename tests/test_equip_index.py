@@ -0,0 +1,40 @@
+import random
+from itertools import permutations
+
+from utils.defs import EquipTokenIndex, get_default_defs
+from utils.utils import ph_typer
+
+
+# The permutation scan previously used by ph_subtyper
+def permutation_match(markers, equips):
+    found = []
+    for e in [set(name.split('-')) for name in equips]:
+        if e.issubset(markers):
+            if len(e) > 1:
+                for c in permutations(list(e), len(e)):
+                    found.append('-'.join(c)) if '-'.join(c) in equips else None
+            else:
+                found.append(list(e)[0])
+    return found
+
+
+def test_match_agrees_with_permutation_scan():
+    equips = list(get_default_defs().all_equips)
+    index = get_default_defs().equip_index
+    tokens = sorted({t for name in equips for t in name.split('-')})
+    rng = random.Random(7)
+    for _ in range(500):
+        markers = set(rng.sample(tokens, rng.randint(1, 8))) | {'equip', 'custom'}
+        assert index.match(markers) == permutation_match(markers, equips)
+
+
+def test_match_in_definition_order():
+    index = EquipTokenIndex(['meter', 'elec-meter', 'ac-elec-meter', 'pump', 'pump-motor'])
+    assert index.match({'ac', 'elec', 'meter'}) == ['meter', 'elec-meter', 'ac-elec-meter']
+    assert index.match({'motor', 'pump'}) == ['pump', 'pump-motor']
+    assert index.match({'motor'}) == []
+
+
+def test_ph_typer_subclasses_in_entity():
+    typed = ph_typer({'id': '@m', 'equip': 'm:', 'elec': 'm:', 'meter': 'm:', 'ac': 'm:'})
+    assert typed['subclasses_in_entity'] == ['meter', 'elec-meter', 'ac-elec-meter']
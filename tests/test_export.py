@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from rdflib import Graph, Literal, RDF, RDFS
+
+from utils.export import BLDG, brick_class, export_haystack_json_to_brick, haystack_to_brick_triples, write_triples
+from utils.queries import BF, BRICK
+from utils.utils import cleanup_marker_tags, ph_typer
+
+
+def rows():
+    return [
+        {'id': '@site', 'site': 'M', 'dis': 'Main'},
+        {'id': '@ahu', 'equip': 'M', 'ahu': 'M', 'siteRef': '@site', 'dis': 's:AHU 1'},
+        {'id': '@vav', 'equip': 'M', 'vav': 'M', 'equipRef': '@ahu', 'ahuRef': '@ahu', 'siteRef': '@site'},
+        {'id': '@t1', 'point': 'M', 'sensor': 'M', 'temp': 'M', 'equipRef': '@vav'},
+        {'id': '@m1', 'equip': 'M', 'elec': 'M', 'meter': 'M'},
+        {'id': '@m2', 'equip': 'M', 'elec': 'M', 'meter': 'M', 'submeterOf': 'r:m1 Main Meter'},
+        {'id': '@odd', 'custom': 'M'},
+        {'custom': 'M'},
+    ]
+
+
+def typed_rows():
+    return [(e, ph_typer(e)) for e in cleanup_marker_tags(rows())]
+
+
+def test_brick_class():
+    classes = [brick_class(t, e) for e, t in typed_rows()]
+    assert classes == ['Building', 'AHU', 'VAV', 'Sensor', 'Electricity_Meter', 'Electricity_Meter', None, None]
+
+
+def test_triples():
+    triples = set(haystack_to_brick_triples(typed_rows()))
+    assert (BLDG.ahu, RDF.type, BRICK.AHU) in triples
+    assert (BLDG.ahu, RDFS.label, Literal('AHU 1')) in triples
+    assert (BLDG.t1, BF.isPointOf, BLDG.vav) in triples
+    assert (BLDG.vav, BF.isPartOf, BLDG.ahu) in triples
+    assert (BLDG.ahu, BF.feeds, BLDG.vav) in triples
+    assert (BLDG.m1, BF.feeds, BLDG.m2) in triples
+    assert (BLDG.vav, BF.hasLocation, BLDG.site) in triples
+    assert not any(s == BLDG.odd and p == RDF.type for s, p, o in triples)
+
+
+@pytest.mark.parametrize('fmt', ['nt', 'turtle'])
+def test_streamed_file_parses(tmp_path, fmt):
+    src = tmp_path / 'site.json'
+    src.write_text(json.dumps({'meta': {'ver': '3.0'}, 'rows': rows()}))
+    out = str(tmp_path / ('site.' + fmt))
+    n = export_haystack_json_to_brick(str(src), out, fmt=fmt, batch_size=3)
+    g = Graph()
+    g.parse(out, format=fmt)
+    assert len(g) == n
+    assert set(g) == set(haystack_to_brick_triples(typed_rows()))
+
+
+def test_write_triples_rejects_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_triples([], str(tmp_path / 'x'), fmt='xml')
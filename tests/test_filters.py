@@ -0,0 +1,80 @@
+import pytest
+
+from utils.filters import And, FilterIndex, Has, Missing, Or, compile_filter
+from utils.utils import add_marker, find_filter, find_tagset
+
+
+def building():
+    return [
+        {'id': '@site', 'site': 'm:', 'dis': 'Main', 'area': 'n:12000 ft²'},
+        {'id': '@small', 'site': 'm:', 'dis': 'Annex', 'area': 'n:800 ft²'},
+        {'id': '@ahu', 'equip': 'm:', 'ahu': 'm:', 'siteRef': '@site'},
+        {'id': '@vav', 'equip': 'm:', 'vav': 'm:', 'siteRef': '@site', 'equipRef': '@ahu'},
+        {'id': '@t1', 'point': 'm:', 'sensor': 'm:', 'temp': 'm:', 'his': 'm:', 'equipRef': 'r:ahu AHU',
+         'curVal': 'n:55.2 °F', 'kind': 's:Number'},
+        {'id': '@t2', 'point': 'm:', 'sensor': 'm:', 'temp': 'm:', 'equipRef': '@vav', 'curVal': 'n:71'},
+        {'id': '@c1', 'point': 'm:', 'cmd': 'm:', 'equipRef': '@vav', 'enabled': True},
+    ]
+
+
+def ids(entities):
+    return [e['id'] for e in entities]
+
+
+@pytest.fixture
+def index():
+    return FilterIndex(building())
+
+
+@pytest.mark.parametrize('expr, expected', [
+    ('point', ['@t1', '@t2', '@c1']),
+    ('point and sensor and temp', ['@t1', '@t2']),
+    ('point and sensor and temp and equipRef->ahu', ['@t1']),
+    ('point and not his', ['@t2', '@c1']),
+    ('not his and not site and not equip', ['@t2', '@c1']),
+    ('area > 1000', ['@site']),
+    ('area <= 800', ['@small']),
+    ('curVal >= 60', ['@t2']),
+    ('dis == "Annex"', ['@small']),
+    ('kind == "Number"', ['@t1']),
+    ('equipRef == @vav', ['@t2', '@c1']),
+    ('enabled == true', ['@c1']),
+    ('equipRef->equipRef->ahu', ['@t2', '@c1']),
+    ('equipRef->siteRef->area > 1000', ['@vav', '@t1', '@t2', '@c1']),
+    ('ahu or vav', ['@ahu', '@vav']),
+    ('point and (cmd or his)', ['@t1', '@c1']),
+    ('not point', ['@site', '@small', '@ahu', '@vav']),
+    ('dis > 1000', []),
+    ('missing', []),
+    ('equipRef->missing', []),
+])
+def test_query(index, expr, expected):
+    assert ids(index.query(expr)) == expected
+
+
+def test_find_filter_matches_find_tagset():
+    bldg = building()
+    assert find_filter(bldg, 'point and sensor') == find_tagset(bldg, ['point', 'sensor'])
+
+
+def test_plan_cache_and_shape():
+    plan = compile_filter('point and (sensor and temp) and not his or site')
+    assert compile_filter('point and (sensor and temp) and not his or site') is plan
+    assert isinstance(plan, Or)
+    conjunction = plan.clauses[0]
+    # Nested conjunctions are flattened so they are planned together
+    assert isinstance(conjunction, And) and len(conjunction.clauses) == 4
+    assert isinstance(conjunction.clauses[-1], Missing)
+    assert isinstance(plan.clauses[1], Has)
+
+
+def test_index_stays_consistent(index):
+    add_marker(index.query('equip and vav'), 'terminal', index=index)
+    assert ids(index.query('terminal')) == ['@vav']
+
+
+@pytest.mark.parametrize('expr', ['', 'point and', 'and point', '(point', 'area >', 'point $ sensor',
+                                  'area > point'])
+def test_invalid_filters(expr):
+    with pytest.raises(ValueError):
+        compile_filter(expr)
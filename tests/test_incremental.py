@@ -0,0 +1,85 @@
+import pytest
+
+from utils.incremental import IncrementalReport
+from utils.utils import ph_typer_many
+
+
+def building():
+    return [
+        {'id': '@site', 'site': 'm:', 'area': 'n:1000'},
+        {'id': '@ahu', 'equip': 'm:', 'ahu': 'm:', 'siteRef': '@site', 'navName': 's:AHU-1'},
+        {'id': '@fcu', 'equip': 'm:', 'navName': 's:FCU-1', 'custom': 'm:'},
+        {'id': '@temp', 'point': 'm:', 'sensor': 'm:', 'cmd': 'm:', 'temp': 'm:', 'his': 'm:'},
+        {'id': '@odd', 'newRec': 'm:', 'dis': 's:odd'},
+    ]
+
+
+def normalized(report):
+    general = report['general']
+    return (
+        sorted(report['entities'], key=lambda t: t['id']),
+        {k: sorted(general[k]) for k in ('valid_markers', 'invalid_markers', 'valid_vals', 'invalid_vals')},
+        general['count_tags_by_entity'],
+    )
+
+
+def assert_matches_full_run(incremental, entities):
+    assert normalized(incremental.report) == normalized(ph_typer_many(entities))
+
+
+def test_initial_report_matches_full_run():
+    assert_matches_full_run(IncrementalReport(building()), building())
+
+
+def test_deltas_match_full_run():
+    incremental = IncrementalReport(building())
+    bldg = building()
+
+    # Add fcu to the fcu, drop sensor from the sensor and cmd point
+    bldg[2]['fcu'] = 'm:'
+    del bldg[3]['sensor']
+    incremental.change([bldg[2], bldg[3]])
+    assert_matches_full_run(incremental, bldg)
+
+    new = {'id': '@vav', 'equip': 'm:', 'vav': 'm:', 'custom': 'm:'}
+    incremental.apply(added=[new], removed=['@odd'])
+    bldg = [e for e in bldg if e['id'] != '@odd'] + [new]
+    assert_matches_full_run(incremental, bldg)
+    assert 'newRec' not in incremental.general()['invalid_markers']
+    assert incremental.count_tags_by_entity['equip']['invalid_markers'] == {'custom': 2}
+
+    incremental.remove(['@fcu', '@vav'])
+    assert 'custom' not in incremental.count_tags_by_entity['equip']['invalid_markers']
+    assert 'custom' not in incremental.general()['invalid_markers']
+
+
+def test_in_place_modification_is_retracted():
+    bldg = building()
+    incremental = IncrementalReport(bldg)
+    bldg[1]['custom'] = 'm:'
+    incremental.change([bldg[1]])
+    assert incremental.count_tags_by_entity['equip']['invalid_markers'] == {'custom': 2}
+    del bldg[1]['custom']
+    incremental.change([bldg[1]])
+    assert incremental.count_tags_by_entity['equip']['invalid_markers'] == {'custom': 1}
+
+
+def test_only_delta_is_retyped():
+    incremental = IncrementalReport(building())
+    before = dict(incremental.typed)
+    changed = dict(building()[1], chilledWaterCool='m:')
+    incremental.change([changed, building()[2]])
+    assert incremental.typed['@ahu'] is not before['@ahu']
+    assert incremental.typed['@fcu'] is before['@fcu']
+
+
+def test_invalid_deltas():
+    incremental = IncrementalReport(building())
+    with pytest.raises(ValueError):
+        incremental.add([{'id': '@site', 'site': 'm:'}])
+    with pytest.raises(ValueError):
+        incremental.add([{'site': 'm:'}])
+    with pytest.raises(KeyError):
+        incremental.remove(['@missing'])
+    with pytest.raises(KeyError):
+        incremental.change([{'id': '@missing'}])
@@ -0,0 +1,54 @@
+import random
+
+from utils.index import TagIndex
+from utils.utils import (add_marker, cleanup_marker_tags, find_cmds, find_equips, find_sites,
+                         find_str_in_navName, find_tagset, find_tagset_exclusive, remove_tag)
+
+TAGS = ['equip', 'point', 'site', 'sensor', 'cmd', 'sp', 'vav', 'ahu', 'temp', 'air']
+
+
+def building(n=300, seed=3):
+    rng = random.Random(seed)
+    return [dict({'id': '@%d' % i, 'navName': rng.choice(['FCU 1', 'AHU 2', 'EF'])},
+                 **{t: rng.choice(['m:', 'M']) for t in rng.sample(TAGS, rng.randint(0, 5))})
+            for i in range(n)]
+
+
+def test_queries_match_list_scan():
+    bldg = building()
+    index = TagIndex(bldg)
+    for tags in (['equip'], ['point', 'sensor'], ['sp', 'cmd', 'temp'], ['missing'], []):
+        assert find_tagset(index, tags) == find_tagset(bldg, tags)
+        assert find_tagset_exclusive(index, tags, ['air']) == find_tagset_exclusive(bldg, tags, ['air'])
+        assert index.complement(tags) == find_tagset(bldg, tags)[1]
+    for helper in (find_equips, find_sites, find_cmds):
+        assert helper(index) == helper(bldg)
+    assert find_str_in_navName(index, 'fcu') == find_str_in_navName(bldg, 'fcu')
+
+
+def test_index_consistent_after_mutations():
+    bldg = building()
+    index = TagIndex(bldg)
+    cleanup_marker_tags(index)
+    assert all(v != 'M' for e in bldg for v in e.values())
+
+    fcus, _ = find_str_in_navName(find_equips(index)[0], 'fcu')
+    add_marker(fcus, 'fcu', index=index)
+    assert find_tagset(index, ['equip', 'fcu']) == find_tagset(bldg, ['equip', 'fcu'])
+    assert len(find_tagset(index, ['fcu'])[0]) == len(fcus)
+
+    both, _ = find_tagset(index, ['sensor', 'cmd'])
+    remove_tag(both, 'sensor', index=index)
+    assert find_tagset(index, ['sensor', 'cmd'])[0] == []
+    assert find_tagset(index, ['sensor']) == find_tagset(bldg, ['sensor'])
+
+    bldg[0]['unicorn'] = 'm:'
+    del bldg[0]['id']
+    index.reindex(bldg[0])
+    assert find_tagset(index, ['unicorn'])[0] == [bldg[0]]
+    assert bldg[0] not in find_tagset(index, ['id'])[0]
+
+
+def test_remove_missing_tag_is_noop():
+    bldg = [{'id': '@a', 'sensor': 'm:'}, {'id': '@b'}]
+    assert remove_tag(bldg, 'sensor') == [{'id': '@a'}, {'id': '@b'}]
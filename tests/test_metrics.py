@@ -0,0 +1,101 @@
+import os
+import pstats
+
+import pytest
+
+from utils.defs import HaystackDefs
+from utils.metrics import (METRICS_ENV, PROFILE_ENV, Metrics, active_metrics, collect_metrics, profile_to,
+                           resolve_metrics)
+from utils.synthetic import generate_building
+from utils.utils import cleanup_marker_tags, ph_typer_many, reporter
+
+
+@pytest.fixture
+def bldg():
+    return cleanup_marker_tags(list(generate_building(500)))
+
+
+def test_disabled_by_default(bldg, monkeypatch):
+    monkeypatch.delenv(METRICS_ENV, raising=False)
+    assert 'metrics' not in ph_typer_many(bldg)
+    assert resolve_metrics(None) is None and resolve_metrics(False) is None
+
+
+def test_ph_typer_many_metrics(bldg):
+    report = ph_typer_many(bldg, metrics=True)
+    metrics = report['metrics']
+    stages = metrics['stages']
+    assert stages['typing']['calls'] == len(bldg)
+    assert stages['aggregation']['calls'] == len(bldg)
+    assert stages['ph_typer_many']['calls'] == 1
+    assert stages['ph_typer_many']['seconds'] >= stages['typing']['seconds']
+    # Only the distinct signatures are subtyped
+    counters = metrics['counters']
+    assert counters['entities'] == len(bldg)
+    assert stages['subtyping']['calls'] <= counters['typing_cache_misses']
+    assert counters['typing_cache_hits'] + counters['typing_cache_misses'] == len(bldg)
+    assert metrics['entities_per_s'] > 0
+    assert {k: v for k, v in report.items() if k != 'metrics'} == ph_typer_many(bldg)
+
+
+def test_ontology_counters(tmp_path):
+    with collect_metrics() as metrics:
+        HaystackDefs(cache_dir=str(tmp_path)).all_markers
+        HaystackDefs(cache_dir=str(tmp_path)).all_markers
+    assert metrics.counters['graphs_parsed'] == 1
+    assert metrics.counters['sparql_queries'] > 1
+    assert metrics.counters['snapshot_cache_misses'] == 1
+    assert metrics.counters['snapshot_cache_hits'] == 1
+    assert metrics.stages['ontology_snapshot'][1] == 2
+    assert active_metrics() is None
+
+
+def test_reporter_metrics(bldg, tmp_path):
+    shared = Metrics()
+    report = ph_typer_many(bldg, metrics=shared)
+    reporter(report, 'site', bldg, str(tmp_path), verbose=False, metrics=shared)
+    stages = report['metrics']['stages']
+    assert stages['typing']['calls'] == len(bldg)
+    for stage in ('summary', 'write_report', 'write_csv'):
+        assert stages[stage]['calls'] == 1
+    assert set(shared.stages) == set(stages)
+
+
+def test_environment(bldg, tmp_path, monkeypatch):
+    monkeypatch.setenv(METRICS_ENV, '1')
+    report = ph_typer_many(bldg)
+    assert report['metrics']['counters']['entities'] == len(bldg)
+    reporter(report, 'site', bldg, str(tmp_path), verbose=False)
+    assert 'write_report' in report['metrics']['stages']
+    assert 'metrics' not in ph_typer_many(bldg, metrics=False)
+
+
+def test_collect_nested(bldg):
+    with collect_metrics() as outer:
+        ph_typer_many(bldg)
+        ph_typer_many(bldg)
+    assert outer.counters['entities'] == 2 * len(bldg)
+    assert outer.stages['ph_typer_many'][1] == 2
+
+
+def test_merge_round_trip():
+    metrics = Metrics()
+    metrics.add_time('typing', 1.5, 3)
+    metrics.count('entities', 3)
+    copy = Metrics.from_dict(metrics.as_dict())
+    assert copy.as_dict() == metrics.as_dict()
+    assert copy.merge(metrics).stages['typing'] == [3.0, 6]
+
+
+def test_profile(bldg, tmp_path, monkeypatch):
+    with profile_to(str(tmp_path / 'a')):
+        report = ph_typer_many(bldg)
+        reporter(report, 'site', bldg, str(tmp_path), verbose=False)
+    files = sorted(os.listdir(str(tmp_path / 'a')))
+    assert [f.split('_')[0] for f in files] == ['ph', 'reporter']
+    stats = pstats.Stats(str(tmp_path / 'a' / files[0]))
+    assert any(func[2] == 'ph_typer' for func in stats.stats)
+
+    monkeypatch.setenv(PROFILE_ENV, str(tmp_path / 'b'))
+    ph_typer_many(bldg)
+    assert len(os.listdir(str(tmp_path / 'b'))) == 1
@@ -0,0 +1,42 @@
+import random
+
+from utils.parallel import default_chunk_size, ph_typer_many_parallel
+from utils.utils import ph_typer_many
+
+TAGS = ['equip', 'point', 'site', 'sensor', 'cmd', 'vav', 'ahu', 'elec', 'meter', 'temp', 'custom', 'newRec']
+
+
+def building(n=700, seed=5):
+    rng = random.Random(seed)
+    return [dict({'id': '@%d' % i, 'siteRef': '@s', 'dis': 'E%d' % i},
+                 **{t: 'm:' for t in rng.sample(TAGS, rng.randint(0, 4))}) for i in range(n)]
+
+
+# Tag lists are built from sets, so only their contents are compared
+def sort_lists(d):
+    return {k: sorted(v) if isinstance(v, list) else v for k, v in d.items()}
+
+
+def test_parallel_matches_serial():
+    bldg = building()
+    serial = ph_typer_many(bldg)
+    parallel = ph_typer_many_parallel(bldg, workers=2, chunk_size=97)
+    assert [e['id'] for e in parallel['entities']] == [e['id'] for e in serial['entities']]
+    assert [sort_lists(e) for e in parallel['entities']] == [sort_lists(e) for e in serial['entities']]
+    assert sort_lists(parallel['general']) == sort_lists(serial['general'])
+    # Merging chunk tallies in order keeps the tag order of a serial pass
+    assert list(parallel['general']['count_tags_by_entity']['equip']['valid_markers']) == \
+        list(serial['general']['count_tags_by_entity']['equip']['valid_markers'])
+
+
+def test_workers_argument_and_generator_input():
+    bldg = building(300)
+    seen = []
+    report = ph_typer_many((e for e in bldg), workers=2, keep_entities=False, on_entity=seen.append)
+    assert report['entities'] == []
+    assert [sort_lists(e) for e in seen] == [sort_lists(e) for e in ph_typer_many(bldg)['entities']]
+
+
+def test_default_chunk_size():
+    assert default_chunk_size(100, 8) == 500
+    assert default_chunk_size(100000, 8) == 3125
@@ -0,0 +1,127 @@
+import os
+
+import pandas as pd
+import pytest
+
+import utils.plotting
+from utils.plotting import HASHES_FILE, plot1, plot_jobs, plot_portfolio, render_plots, stale_jobs, top_tags
+from utils.columnar import tag_counts_frame
+from utils.synthetic import generate_building
+from utils.utils import cleanup_marker_tags, ph_typer_many, reporter
+
+
+@pytest.fixture(scope='module')
+def building():
+    bldg = cleanup_marker_tags(list(generate_building(500, custom_ratio=0.3)))
+    return bldg, ph_typer_many(bldg)
+
+
+# Record the jobs rendered instead of drawing them
+@pytest.fixture
+def rendered(monkeypatch):
+    jobs = []
+
+    def render(job):
+        os.makedirs(os.path.dirname(job.f_name), exist_ok=True)
+        open(job.f_name, 'wb').close()
+        jobs.append(job)
+        return job.f_name
+    monkeypatch.setattr(utils.plotting, 'render_plot', render)
+    return jobs
+
+
+def test_plot_jobs(building, tmp_path):
+    _, report = building
+    jobs = plot_jobs(report, str(tmp_path), 'bldg')
+    assert [j.tag_category for j in jobs] == ['valid_markers', 'invalid_markers', 'valid_vals', 'invalid_vals']
+    assert jobs[0].f_name == str(tmp_path / 'plots' / 'bldg_valid_markers.png')
+    assert jobs[0].title == "Building: bldg\nTag Type: valid_markers"
+    assert len({j.digest for j in jobs}) == len(jobs)
+
+
+def test_digest_follows_the_data(building, tmp_path):
+    bldg, report = building
+    def digests(df, **options):
+        return {j.tag_category: j.digest for j in plot_jobs(df, str(tmp_path), 'bldg', **options)}
+    expected = digests(report)
+    assert digests(tag_counts_frame(report)) == expected
+
+    # The csv report written by the reporter plots the same
+    reporter(report, 'bldg', bldg, str(tmp_path), verbose=False)
+    df = pd.read_csv(str(tmp_path / 'bldg' / 'report_bldg.csv'), keep_default_na=False)
+    assert digests(df) == expected
+
+    assert digests(ph_typer_many(bldg[:-1])) != expected
+    assert digests(report, fast=True)['valid_markers'] != expected['valid_markers']
+
+
+def test_top_tags(building):
+    _, report = building
+    df = tag_counts_frame(report)
+    markers = df[df['tag_category'] == 'valid_markers']
+    top, n_tags = top_tags(markers, 3)
+    assert n_tags == markers['tag'].nunique() > 3
+    totals = markers.groupby('tag', observed=True)['count'].sum().sort_values(ascending=False)
+    assert set(top['tag']) == set(totals.index[:3])
+    assert list(top['tag'].cat.categories) == sorted(set(top['tag']), key=list(markers['tag'].cat.categories).index)
+    assert top_tags(markers, None)[0] is markers
+
+    jobs = plot_jobs(report, 'out', 'bldg', top_n=3)
+    assert jobs[0].title.endswith("(top 3 of {} tags)".format(n_tags))
+    assert jobs[0].data['tag'].nunique() == 3
+
+
+def test_render_only_what_changed(building, tmp_path, rendered):
+    bldg, report = building
+    output_dir = str(tmp_path)
+    files = plot1(report, output_dir, 'bldg')
+    assert len(files) == len(rendered) == 4
+    assert os.path.isfile(os.path.join(output_dir, 'plots', HASHES_FILE))
+
+    assert plot1(report, output_dir, 'bldg') == []
+    assert len(plot1(report, output_dir, 'bldg', force=True)) == 4
+
+    # Only the categories whose counts changed are rendered again
+    extra = {'id': 'r:extra', 'brandNewTag': 'm:'}
+    changed = plot1(ph_typer_many(bldg + [extra]), output_dir, 'bldg')
+    assert [os.path.basename(f) for f in changed] == ['bldg_invalid_markers.png']
+
+    # A deleted png is drawn again
+    os.remove(files[0])
+    assert plot1(ph_typer_many(bldg + [extra]), output_dir, 'bldg') == [files[0]]
+
+
+def test_stale_jobs(building, tmp_path, rendered):
+    _, report = building
+    jobs = plot_jobs(report, str(tmp_path), 'bldg')
+    assert stale_jobs(jobs) == jobs
+    render_plots(jobs)
+    assert stale_jobs(jobs) == []
+    assert stale_jobs(jobs, force=True) == jobs
+
+
+def test_plot_portfolio(building, tmp_path, rendered):
+    bldg, report = building
+    other = ph_typer_many(bldg[:200])
+    files = plot_portfolio({'a': report, 'b': other}, str(tmp_path))
+    assert len(files) == 8
+    assert {os.path.basename(os.path.dirname(os.path.dirname(f))) for f in files} == {'a', 'b'}
+    assert plot_portfolio({'a': report, 'b': other}, str(tmp_path)) == []
+
+
+def test_render_fast_in_pool(building, tmp_path):
+    pytest.importorskip('matplotlib')
+    _, report = building
+    files = plot1(report, str(tmp_path), 'bldg', workers=2, fast=True, top_n=20)
+    assert len(files) == 4
+    for f in files:
+        with open(f, 'rb') as png:
+            assert png.read(8) == b'\x89PNG\r\n\x1a\n'
+    assert plot1(report, str(tmp_path), 'bldg', workers=2, fast=True, top_n=20) == []
+
+
+def test_render_plotnine(building, tmp_path):
+    pytest.importorskip('plotnine')
+    _, report = building
+    files = plot1(report, str(tmp_path), 'bldg', top_n=10)
+    assert len(files) == 4 and all(os.path.isfile(f) for f in files)
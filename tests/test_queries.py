@@ -0,0 +1,65 @@
+import pytest
+from rdflib import Literal
+
+from utils.defs import HaystackDefs
+from utils.metrics import collect_metrics
+from utils.queries import (PHIOT, HAYSTACK_DEFS, QueryCache, init_haystack_graph, ph_def_uri, ph_is_chain,
+                           ph_subclass_of_phiot, ph_tags_on, prepare_query, query_cache, query_return_list)
+
+
+@pytest.fixture(scope='module')
+def graph():
+    return init_haystack_graph()
+
+
+def test_prepared_once(graph):
+    q = 'SELECT ?e WHERE { ?e rdfs:subClassOf ?parent }'
+    assert prepare_query(q) is prepare_query(q)
+    queries = QueryCache(graph)
+    with collect_metrics() as metrics:
+        for parent in ('equip', 'point', 'equip'):
+            queries.query(q, {'parent': PHIOT[parent]})
+    assert metrics.counters.get('queries_prepared', 0) <= 1
+    assert metrics.counters['sparql_queries'] == 2
+    assert queries.stats()['hits'] == 1 and queries.stats()['misses'] == 2
+
+
+def test_bindings_match_formatting(graph):
+    formatted = query_return_list(graph, 'SELECT ?e WHERE { ?e rdfs:subClassOf phIoT:airHandlingEquip }')
+    assert sorted(ph_subclass_of_phiot('airHandlingEquip', graph)) == sorted(formatted)
+    assert 'ahu' in formatted
+
+
+def test_lru_eviction(graph):
+    queries = QueryCache(graph, maxsize=2)
+    q = 'SELECT ?d WHERE { ?d rdfs:label ?label }'
+    for name in ('ahu', 'vav', 'ahu', 'fcu', 'vav'):
+        queries.query(q, {'label': Literal(name)})
+    assert len(queries) == 2
+    assert queries.stats()['hits'] == 1
+    queries.clear()
+    assert len(queries) == 0
+
+
+def test_query_cache_by_path():
+    with collect_metrics() as metrics:
+        a = query_cache(HAYSTACK_DEFS)
+        b = query_cache(HAYSTACK_DEFS)
+    assert a is b
+    assert metrics.counters.get('graphs_parsed', 0) <= 1
+
+
+def test_vocabulary_lookups(graph):
+    assert str(ph_def_uri('ahu', graph)) == str(PHIOT['ahu'])
+    assert ph_def_uri('notADef', graph) is None
+    assert set(ph_is_chain('ahu', graph)) == {'airHandlingEquip', 'equip', 'entity', 'marker'}
+    assert set(ph_is_chain('number', graph)) == {'scalar', 'val'}
+    assert {'area', 'tz'}.issubset(ph_tags_on('site', graph))
+    assert ph_tags_on('notADef', graph) == []
+
+
+def test_defs_query():
+    defs = HaystackDefs()
+    rows = defs.query('SELECT ?e WHERE { ?e rdfs:subClassOf ?parent }', {'parent': PHIOT['equip']})
+    assert rows is defs.query('SELECT ?e WHERE { ?e rdfs:subClassOf ?parent }', {'parent': PHIOT['equip']})
+    assert sorted(str(r[0]).split('#')[1] for r in rows) == sorted(defs.snapshot['fc_equips'])
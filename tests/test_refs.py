@@ -0,0 +1,79 @@
+from rdflib import Graph, Namespace, RDF
+
+from utils.queries import BF, BRICK
+from utils.refs import RefGraph, ref_id
+from utils.utils import find_equip_points
+
+
+def building():
+    return [
+        {'id': '@site', 'site': 'm:'},
+        {'id': 'r:ahu AHU-1', 'equip': 'm:', 'ahu': 'm:', 'siteRef': '@site'},
+        {'id': '@vav1', 'equip': 'm:', 'vav': 'm:', 'siteRef': '@site', 'equipRef': '@ahu'},
+        {'id': '@p1', 'point': 'm:', 'equipRef': 'r:ahu AHU-1', 'siteRef': '@site'},
+        {'id': '@p2', 'point': 'm:', 'equipRef': '@vav1', 'siteRef': '@site'},
+        {'id': '@p3', 'point': 'm:', 'siteRef': '@site'},
+        {'id': '@main', 'equip': 'm:', 'meter': 'm:'},
+        {'id': '@sub1', 'equip': 'm:', 'meter': 'm:', 'submeterOf': '@main'},
+        {'id': '@sub2', 'equip': 'm:', 'meter': 'm:', 'submeterOf': '@main'},
+        {'id': '@sub11', 'equip': 'm:', 'meter': 'm:', 'submeterOf': '@sub1'},
+        {'id': '@lost', 'point': 'm:', 'equipRef': '@gone', 'spaceRef': ['@site', '@nowhere']},
+    ]
+
+
+def ids(entities):
+    return [e['id'] for e in entities]
+
+
+def test_ref_id():
+    assert ref_id('@ahu') == ref_id('r:ahu AHU-1') == 'ahu'
+    assert ref_id(None) is None
+    assert ref_id('m:') == 'm:'
+
+
+def test_lookups():
+    graph = RefGraph(building())
+    assert ids(graph.equip_points({'id': '@ahu'})) == ['@p1']
+    assert ids(graph.referrers('@ahu', 'equipRef')) == ['@vav1', '@p1']
+    assert ids(graph.site_equips('@site')) == ['r:ahu AHU-1', '@vav1']
+    assert ids(graph.refs('@p2')) == ['@vav1', '@site']
+    assert ids(graph.refs('@lost')) == ['@site']
+
+
+def test_traversal_and_submeters():
+    graph = RefGraph(building())
+    hops = [(e['id'], d) for e, d in graph.traverse('@p2', 'equipRef')]
+    assert hops == [('@vav1', 1), ('r:ahu AHU-1', 2)]
+    assert [e['id'] for e, _ in graph.traverse('@p2', 'equipRef', max_depth=1)] == ['@vav1']
+    assert graph.submeter_tree('@main') == {'@sub1': {'@sub11': {}}, '@sub2': {}}
+    below = [e['id'] for e, _ in graph.traverse('@main', 'submeterOf', reverse=True)]
+    assert below == ['@sub1', '@sub2', '@sub11']
+
+
+def test_cycles_terminate():
+    graph = RefGraph([{'id': '@a', 'equipRef': '@b'}, {'id': '@b', 'equipRef': '@a'}])
+    assert [e['id'] for e, _ in graph.traverse('@a')] == ['@b']
+
+
+def test_dangling():
+    graph = RefGraph(building())
+    assert graph.dangling == [('@lost', 'equipRef', '@gone'), ('@lost', 'spaceRef', '@nowhere')]
+
+
+def test_find_equip_points():
+    bldg = building()
+    ahu = bldg[1]
+    # Entities without an equipRef no longer raise KeyError
+    assert ids(find_equip_points(ahu, bldg)) == ['@vav1', '@p1']
+    assert ids(find_equip_points(ahu, RefGraph(bldg))) == ['@vav1', '@p1']
+    assert find_equip_points({'id': '@elsewhere'}, RefGraph(bldg)) == []
+
+
+def test_find_equip_points_brick():
+    BLDG = Namespace('http://example.com/bldg#')
+    g = Graph()
+    g.add((BLDG.ahu1, RDF.type, BRICK.AHU))
+    g.add((BLDG.temp1, BF.isPointOf, BLDG.ahu1))
+    g.add((BLDG.ahu1, BF.hasPoint, BLDG.temp2))
+    g.add((BLDG.temp3, BF.isPointOf, BLDG.ahu2))
+    assert find_equip_points(BLDG.ahu1, g, 'brick') == [BLDG.temp1, BLDG.temp2]
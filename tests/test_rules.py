@@ -0,0 +1,106 @@
+import copy
+
+import pytest
+
+from utils.filters import FilterIndex, compile_filter
+from utils.rules import apply_rules, format_rule_counts, load_rules, parse_rule, parse_rules
+
+GHAUSI_RULES = '''
+# fcus are only named as such
+if equip and navName contains fcu then add fcu
+
+if sensor and cmd then remove sensor
+if sensor then add point
+if cmd and not sensor then add point
+if sp and not sensor and not cmd then add point
+'''
+
+
+@pytest.fixture
+def bldg():
+    return [
+        {'id': '@fcu1', 'equip': 'm:', 'navName': 'FCU-1'},
+        {'id': '@fcu2', 'equip': 'm:', 'navName': 's:Fcu 2'},
+        {'id': '@ahu', 'equip': 'm:', 'navName': 'AHU-1'},
+        {'id': '@s', 'sensor': 'm:', 'temp': 'm:', 'equipRef': '@fcu1'},
+        {'id': '@sc', 'sensor': 'm:', 'cmd': 'm:', 'equipRef': '@fcu2'},
+        {'id': '@c', 'cmd': 'm:', 'equipRef': '@ahu'},
+        {'id': '@sp', 'sp': 'm:', 'equipRef': '@ahu'},
+        {'id': '@other', 'dis': 'x'},
+    ]
+
+
+def _sequential(bldg, rules):
+    # The same rules run one after the other over the whole building
+    for rule in rules:
+        for e in bldg:
+            if rule.matches(e):
+                rule.apply(e)
+    return bldg
+
+
+def test_apply_rules(bldg):
+    rules = parse_rules(GHAUSI_RULES)
+    expected = _sequential(copy.deepcopy(bldg), rules)
+    results = apply_rules(bldg, rules)
+    assert bldg == expected
+    assert [e['id'] for e in bldg if 'fcu' in e] == ['@fcu1', '@fcu2']
+    assert [e['id'] for e in bldg if 'point' in e] == ['@s', '@sc', '@c', '@sp']
+    assert 'sensor' not in bldg[4]
+    counts = [(c['before'], c['changed'], c['after']) for c in results['rules']]
+    assert counts == [(2, 2, 2), (1, 1, 0), (1, 1, 1), (2, 2, 2), (1, 1, 1)]
+    assert results['entities'] == 8 and results['changed'] == 6
+    assert len(format_rule_counts(results)) == 6
+
+
+def test_dry_run(bldg):
+    original = copy.deepcopy(bldg)
+    dry = apply_rules(bldg, GHAUSI_RULES.splitlines()[2:3] + ['if sensor then add point'], dry_run=True)
+    assert bldg == original
+    assert apply_rules(bldg, GHAUSI_RULES.splitlines()[2:3] + ['if sensor then add point']) == dry
+
+
+def test_index_kept_consistent(bldg):
+    index = FilterIndex(bldg)
+    apply_rules(index, parse_rules(GHAUSI_RULES))
+    assert [e['id'] for e in index.query('point')] == ['@s', '@sc', '@c', '@sp']
+    assert index.query('sensor and cmd') == []
+    assert FilterIndex(index.entities).postings == index.postings
+
+    dry = FilterIndex(copy.deepcopy(bldg))
+    apply_rules(dry, ['if equip then add x'], dry_run=True)
+    assert dry.query('x') == []
+
+
+def test_ref_paths(bldg):
+    # The fcus come before their points, so they are already tagged when the
+    # points go through the first rule
+    results = apply_rules(bldg, ['if equipRef->fcu then add fcuPoint',
+                                 'if equip and navName contains fcu then add fcu'])
+    assert results['rules'][0]['before'] == 2
+    assert [e['id'] for e in bldg if 'fcuPoint' in e] == ['@s', '@sc']
+    assert apply_rules(bldg, ['if equipRef->navName contains ahu then add ahuPoint'])['rules'][0]['changed'] == 2
+
+
+def test_contains_filter(bldg):
+    index = FilterIndex(bldg)
+    assert [e['id'] for e in index.query('navName contains "fcu"')] == ['@fcu1', '@fcu2']
+    assert [e['id'] for e in index.query('equip and navName contains "hu-"')] == ['@ahu']
+    assert compile_filter('navName contains FCU').matches(bldg[1])
+    with pytest.raises(ValueError):
+        compile_filter('navName contains 3')
+
+
+@pytest.mark.parametrize('text', ['equip then add x', 'if equip add x', 'if equip then tag x',
+                                  'if equip then add', 'if equip and then add x'])
+def test_invalid_rules(text):
+    with pytest.raises(ValueError):
+        parse_rule(text)
+
+
+def test_load_rules(tmp_path):
+    f = tmp_path / 'site.rules'
+    f.write_text(GHAUSI_RULES)
+    rules = load_rules(str(f))
+    assert [r.actions for r in rules][:2] == [[('add', 'fcu')], [('remove', 'sensor')]]
+    assert parse_rule('if a or b then add c, remove d').actions == [('add', 'c'), ('remove', 'd')]
@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.service import BackgroundService, ServiceClient, TypingService
+from utils.synthetic import generate_building
+from utils.utils import cleanup_marker_tags, ph_typer_many
+
+
+def _strip(report):
+    return json.loads(json.dumps({'entities': report['entities'], 'general': report['general']}))
+
+
+@pytest.fixture(scope='module')
+def service():
+    with BackgroundService(TypingService(batch_delay=0.01)) as service:
+        yield service
+
+
+@pytest.fixture
+def rows():
+    return list(generate_building(300, marker='m:'))
+
+
+def test_type_rows(service, rows):
+    with ServiceClient(*service.address) as client:
+        assert client.health() == {'status': 'ok'}
+        assert client.type_rows(rows) == _strip(ph_typer_many(rows))
+        # The connection is kept alive between requests
+        assert client.type_rows(rows[:5]) == _strip(ph_typer_many(rows[:5]))
+
+
+def test_cleanup(service):
+    raw = list(generate_building(50, marker='M'))
+    with ServiceClient(*service.address) as client:
+        report = client.type_rows(raw, cleanup=True)
+    assert report == _strip(ph_typer_many(cleanup_marker_tags(raw)))
+
+
+def test_concurrent_requests_are_batched(service, rows):
+    before = ServiceClient(*service.address).stats()
+    chunks = [rows[i:i + 10] for i in range(0, 200, 10)]
+
+    def type_chunk(chunk):
+        with ServiceClient(*service.address) as client:
+            return client.type_rows(chunk)
+
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        reports = list(pool.map(type_chunk, chunks))
+    for chunk, report in zip(chunks, reports):
+        assert report == _strip(ph_typer_many(chunk))
+    after = ServiceClient(*service.address).stats()
+    assert after['requests'] - before['requests'] == len(chunks)
+    assert after['batches'] - before['batches'] < len(chunks)
+    assert after['cache']['hits'] > before['cache']['hits']
+
+
+@pytest.mark.parametrize('body, status', [
+    (b'{not json', 400),
+    (b'{"rows": 3}', 400),
+    (b'{"rows": [1]}', 400),
+])
+def test_bad_requests(service, body, status):
+    with ServiceClient(*service.address) as client:
+        client.connection.request('POST', '/type', body=body)
+        response = client.connection.getresponse()
+        assert response.status == status
+        assert 'error' in json.loads(response.read())
+
+
+def test_routes(service):
+    with ServiceClient(*service.address) as client:
+        for method, url, status in (('GET', '/nope', 404), ('GET', '/type', 405), ('POST', '/health', 405)):
+            client.connection.request(method, url)
+            response = client.connection.getresponse()
+            response.read()
+            assert response.status == status
+
+
+def test_body_limit():
+    with BackgroundService(TypingService(max_body=100)) as service:
+        with ServiceClient(*service.address) as client:
+            with pytest.raises(ValueError):
+                client.type_rows([{'id': '@p%d' % i, 'point': 'm:'} for i in range(20)])
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs Unix sockets")
+def test_unix_socket(rows):
+    path = os.path.join(tempfile.mkdtemp(), 'typing.sock')
+    with BackgroundService(path=path) as service:
+        assert service.address == path
+        with ServiceClient(path=path) as client:
+            assert client.type_rows(rows) == _strip(ph_typer_many(rows))
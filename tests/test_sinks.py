@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+from utils.batch import batch_report
+from utils.sinks import (SINKS, open_sink, read_binary_report, read_jsonl_report, stream_site_report)
+from utils.utils import ph_typer_many, reporter, summarize_report
+
+
+@pytest.fixture
+def bldg():
+    rows = [{'id': '@site', 'site': 'm:', 'dis': 'Site', 'area': 'n:10'}]
+    rows += [{'id': '@vav%d' % i, 'equip': 'm:', 'vav': 'm:', 'siteRef': '@site', 'custom': 'm:'}
+             for i in range(4)]
+    rows += [{'id': '@p', 'newRec': 'm:'}, {'dis': 'no id', 'point': 'm:'}]
+    return rows
+
+
+def _write(fmt, report, output_dir, name='site'):
+    with open_sink(fmt, str(output_dir), name) as sink:
+        for r in report['entities']:
+            sink(r)
+        sink.write_general(report['general'])
+    return sink
+
+
+@pytest.mark.parametrize('n', [0, 1, 6])
+def test_pretty_matches_json_dump(bldg, tmp_path, n):
+    report = ph_typer_many(bldg[:n])
+    sink = _write('pretty', report, tmp_path)
+    with open(sink.path) as f:
+        text = f.read()
+    assert text == json.dumps(report, sort_keys=True, indent=2)
+
+
+@pytest.mark.parametrize('fmt, reader', [('jsonl', read_jsonl_report), ('binary', read_binary_report)])
+def test_round_trip(bldg, tmp_path, fmt, reader):
+    report = ph_typer_many(bldg)
+    sink = _write(fmt, report, tmp_path)
+    assert list(reader(sink.path)) == report['entities']
+    with open(os.path.join(str(tmp_path), 'report_site.general.json')) as f:
+        assert json.load(f) == json.loads(json.dumps(report['general']))
+
+
+def test_binary_is_compact(tmp_path):
+    rows = [{'id': '@p%d' % i, 'point': 'm:', 'sensor': 'm:', 'temp': 'm:', 'air': 'm:', 'his': 'm:'}
+            for i in range(200)]
+    report = ph_typer_many(rows)
+    jsonl = _write('jsonl', report, tmp_path)
+    binary = _write('binary', report, tmp_path)
+    assert os.path.getsize(binary.path) * 5 < os.path.getsize(jsonl.path)
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink('xml', str(tmp_path), 'site')
+
+
+def test_stream_site_report(bldg, tmp_path):
+    file = tmp_path / 'site.json'
+    file.write_text(json.dumps({'rows': bldg}))
+    summary, general = stream_site_report(str(file), 'site', str(tmp_path / 'out'), 'jsonl')
+    report = ph_typer_many(bldg)
+    assert summary == summarize_report(report, bldg)
+    assert general['count_tags_by_entity'] == report['general']['count_tags_by_entity']
+    out = tmp_path / 'out' / 'site'
+    assert list(read_jsonl_report(str(out / 'report_site.jsonl'))) == report['entities']
+    assert (out / 'report_site.csv').is_file()
+
+
+def test_reporter_format(bldg, tmp_path):
+    report = ph_typer_many(bldg)
+    reporter(report, 'site', bldg, str(tmp_path), verbose=False, fmt='binary')
+    out = tmp_path / 'site'
+    assert list(read_binary_report(str(out / 'report_site.bgr'))) == report['entities']
+    assert not (out / 'report_site.json').exists()
+
+
+@pytest.mark.parametrize('fmt', sorted(SINKS))
+def test_batch_formats(bldg, tmp_path, fmt):
+    sites = tmp_path / 'sites'
+    sites.mkdir()
+    for name in ('alpha', 'beta'):
+        (sites / (name + '.json')).write_text(json.dumps({'rows': bldg}))
+    summaries, _ = batch_report(str(sites), str(tmp_path / 'out'), workers=2, fmt=fmt)
+    assert [s['valid'] for s in summaries] == [5, 5]
+    suffix = {'pretty': '.json', 'jsonl': '.jsonl', 'binary': '.bgr'}[fmt]
+    for name in ('alpha', 'beta'):
+        assert (tmp_path / 'out' / name / ('report_' + name + suffix)).is_file()
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import utils.snapshot as snapshot
+from utils.queries import HAYSTACK_DEFS
+
+
+@pytest.fixture
+def defs_copy(tmp_path):
+    path = str(tmp_path / 'defs.ttl')
+    shutil.copy(HAYSTACK_DEFS, path)
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+# Count calls to compile_haystack_snapshot while still compiling for real
+@pytest.fixture
+def compiles(monkeypatch):
+    calls = []
+    compile_snapshot = snapshot.compile_haystack_snapshot
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return compile_snapshot(*args, **kwargs)
+    monkeypatch.setattr(snapshot, 'compile_haystack_snapshot', counting)
+    return calls
+
+
+def test_cache_hit_matches_compiled(defs_copy, cache_dir, compiles):
+    first = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    second = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    assert len(compiles) == 1
+    assert second == first
+    assert second == snapshot.compile_haystack_snapshot(defs_copy)
+    assert 'vav' in second['equips']
+    assert ['elec-meter', 'meter'] in second['subclass_edges']
+
+
+def test_changed_ttl_recompiles(defs_copy, cache_dir, compiles):
+    first = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    with open(defs_copy, 'a') as f:
+        f.write('\n# local edit\n')
+    second = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    assert len(compiles) == 2
+    assert second['source_hash'] != first['source_hash']
+    assert second['source_hash'] == snapshot.ttl_content_hash(defs_copy)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_stale_version_recompiles(defs_copy, cache_dir, compiles):
+    first = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    f_name = snapshot.snapshot_file(first['source_hash'], cache_dir)
+    stale = dict(first, version=snapshot.SNAPSHOT_VERSION - 1)
+    with open(f_name, 'w') as f:
+        json.dump(stale, f)
+    second = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    assert len(compiles) == 2
+    assert second['version'] == snapshot.SNAPSHOT_VERSION
+    with open(f_name, 'r') as f:
+        assert json.load(f)['version'] == snapshot.SNAPSHOT_VERSION
+
+
+def test_corrupt_cache_recompiles(defs_copy, cache_dir, compiles):
+    first = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    f_name = snapshot.snapshot_file(first['source_hash'], cache_dir)
+    with open(f_name, 'w') as f:
+        f.write('{"version": 1, "markers": [')
+    assert snapshot.read_snapshot(f_name, first['source_hash']) is None
+    assert snapshot.load_haystack_snapshot(defs_copy, cache_dir) == first
+    assert len(compiles) == 2
+
+
+def test_unwritable_cache_dir(defs_copy, tmp_path, compiles):
+    # A regular file where the cache directory should be cannot be created
+    blocked = tmp_path / 'blocked'
+    blocked.write_text('')
+    cache_dir = str(blocked / 'cache')
+    content_hash = snapshot.ttl_content_hash(defs_copy)
+    compiled = snapshot.compile_haystack_snapshot(defs_copy, content_hash)
+    assert snapshot.write_snapshot(compiled, snapshot.snapshot_file(content_hash, cache_dir)) is False
+    loaded = snapshot.load_haystack_snapshot(defs_copy, cache_dir)
+    assert loaded == compiled
+    assert len(compiles) == 2
+
+
+def test_cache_dir_environment_override(defs_copy, cache_dir, monkeypatch):
+    monkeypatch.setenv(snapshot.CACHE_DIR_ENV, cache_dir)
+    assert snapshot.default_cache_dir(defs_copy) == cache_dir
+    snapshot.load_haystack_snapshot(defs_copy)
+    assert len(os.listdir(cache_dir)) == 1
@@ -0,0 +1,103 @@
+import gc
+import json
+import pickle
+import tracemalloc
+
+from utils.store import Building, Entity, TagTable
+from utils.utils import (add_marker, cleanup_marker_tags, find_equips, find_str_in_navName, find_tagset,
+                         find_tagset_exclusive, import_haystack_building, all_valid_invalid_markers_and_vals, ph_typer,
+                         ph_typer_many, remove_tag, summarize_report, tag_signature)
+
+
+def rows():
+    return [
+        {'id': '@site', 'site': 'M', 'dis': 'Site', 'area': 'n:1000', 'geoCoord': 'c:37.5,-77.4'},
+        {'id': '@ahu', 'navName': 'AHU-1', 'equip': 'm:', 'ahu': 'm:', 'siteRef': '@site'},
+        {'id': '@fcu', 'navName': 'FCU-1', 'equip': 'm:', 'siteRef': '@site', 'custom': 'M'},
+        {'id': '@temp', 'point': 'm:', 'sensor': 'm:', 'cmd': 'm:', 'temp': 'm:', 'equipRef': '@ahu',
+         'kind': 's:Number', 'unit': 's:°F', 'his': 'm:'},
+        {'dis': 'no id', 'point': 'm:'},
+    ]
+
+
+def test_round_trip(tmp_path):
+    bldg = Building(rows())
+    assert bldg.to_rows() == rows()
+    assert [list(e) for e in bldg] == [list(r) for r in rows()]
+    path = str(tmp_path / 'site.json')
+    bldg.to_json(path)
+    assert import_haystack_building(path).to_rows() == rows()
+
+
+def test_entity_interning():
+    table = TagTable()
+    a = Entity({'id': '@a', 'point': 'm:', 'equipRef': '@ahu'}, table)
+    b = Entity({'id': '@b', 'point': 'm:', 'equipRef': '@ahu'}, table)
+    assert a.layout is b.layout
+    assert a.vals[1] is b.vals[1]
+    assert a.layout.markers == (table.ids['point'],)
+    assert [table.names[t] for t in a.layout.val_tags] == ['id', 'equipRef']
+    assert a['point'] == 'm:' and a['equipRef'] == '@ahu'
+    assert a.id == '@a' and str(a) == 'No dis available'
+    assert tag_signature(a) == tag_signature(dict(a))
+    assert pickle.loads(pickle.dumps(a)) == a
+
+
+def test_mutation():
+    e = Entity({'id': '@e', 'equip': 'm:', 'navName': 'FCU-2'})
+    add_marker([e], 'fcu')
+    assert dict(e) == {'id': '@e', 'equip': 'm:', 'navName': 'FCU-2', 'fcu': 'm:'}
+    remove_tag([e], 'navName')
+    assert dict(e) == {'id': '@e', 'equip': 'm:', 'fcu': 'm:'}
+    assert 'navName' not in e
+
+
+def test_helpers_accept_building():
+    plain = cleanup_marker_tags(rows())
+    bldg = cleanup_marker_tags(Building(rows()))
+    assert bldg.to_rows() == plain
+    assert find_equips(bldg)[0] == find_equips(plain)[0]
+    assert find_tagset(bldg, ['point'])[1] == find_tagset(plain, ['point'])[1]
+    assert find_tagset_exclusive(bldg, ['point'], ['sensor', 'cmd']) == \
+        find_tagset_exclusive(plain, ['point'], ['sensor', 'cmd'])
+    assert find_str_in_navName(bldg, 'fcu')[0] == find_str_in_navName(plain, 'fcu')[0]
+    assert [ph_typer(e) for e in bldg] == [ph_typer(e) for e in plain]
+
+    report = ph_typer_many(bldg)
+    expected = ph_typer_many(plain)
+    assert report['entities'] == expected['entities']
+    assert report['general']['count_tags_by_entity'] == expected['general']['count_tags_by_entity']
+    general = all_valid_invalid_markers_and_vals(bldg, {'entities': report['entities'], 'general': {}})['general']
+    assert sorted(general['invalid_markers']) == sorted(expected['general']['invalid_markers'])
+    assert summarize_report(report, bldg) == summarize_report(expected, plain)
+
+
+def test_memory_reduction():
+    points = []
+    for i in range(5000):
+        r = {'id': '@p%d' % i, 'dis': 'AHU-%d Discharge Air Temp %d' % (i % 50, i), 'navName': 'DA-T %d' % i,
+             'siteRef': '@site', 'equipRef': '@ahu%d' % (i % 50), 'kind': 's:Number', 'unit': 's:°F',
+             'tz': 'New_York', 'curStatus': 's:ok', 'hisMode': 's:cov', 'precision': 'n:1'}
+        for m in ['point', 'his', 'sensor', 'temp', 'air', 'discharge', 'cur', 'writable', 'logical',
+                  'zone', 'occupied', 'unocc', 'effective', 'hvac', 'sp', 'cmd', 'heating', 'cooling'][:8 + i % 10]:
+            r[m] = 'm:'
+        points.append(r)
+    text = json.dumps({'rows': points})
+    del points
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        dicts = json.loads(text)['rows']
+        dicts_size = tracemalloc.get_traced_memory()[0] - start
+        del dicts
+        gc.collect()
+        start = tracemalloc.get_traced_memory()[0]
+        bldg = Building(json.loads(text)['rows'])
+        gc.collect()
+        bldg_size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    assert len(bldg) == 5000
+    assert dicts_size >= 5 * bldg_size
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from utils.stream import iter_cleanup_marker_tags, iter_haystack_rows, iter_ph_typer, stream_report
+from utils.utils import ReportTally, cleanup_marker_tags, import_haystack_json, ph_typer_many
+
+
+def rows(n=200):
+    return [{'id': '@%d' % i, 'point': 'M', 'sensor': 'm:', 'dis': 'Point "%d" {x}, [y]' % i,
+             'curVal': 'n:%d.5' % i, 'custom%d' % (i % 4): 'M'} for i in range(n)]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = str(tmp_path / 'bldg.json')
+    with open(path, 'w') as f:
+        json.dump({'meta': {'ver': '3.0', 'nested': {'rows': [1]}}, 'cols': [{'name': 'id'}],
+                   'rows': rows(), 'trailer': 12345}, f, indent=1)
+    return path
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64, 1 << 16])
+def test_rows_match_json_load(export, chunk_size):
+    assert list(iter_haystack_rows(export, chunk_size)) == import_haystack_json(export)
+
+
+def test_empty_and_missing_rows(tmp_path):
+    for doc in ({'rows': []}, {'meta': {}}, {}):
+        path = str(tmp_path / 'x.json')
+        with open(path, 'w') as f:
+            json.dump(doc, f)
+        assert list(iter_haystack_rows(path)) == []
+
+
+def test_truncated_file_raises(tmp_path):
+    path = str(tmp_path / 'x.json')
+    with open(path, 'w') as f:
+        f.write('{"rows": [{"id": "@a"}, {"id": ')
+    with pytest.raises(ValueError):
+        list(iter_haystack_rows(path))
+
+
+def test_stream_report_matches_ph_typer_many(export):
+    expected = ph_typer_many(cleanup_marker_tags(import_haystack_json(export)))
+    typed = []
+    report = stream_report(export, on_entity=typed.append, chunk_size=128)
+    assert report['entities'] == []
+    assert typed == expected['entities']
+    assert {k: sorted(v) if isinstance(v, list) else v for k, v in report['general'].items()} == \
+        {k: sorted(v) if isinstance(v, list) else v for k, v in expected['general'].items()}
+
+
+def test_generator_pipeline_with_tally(export):
+    tally = ReportTally()
+    pipeline = iter_ph_typer(iter_cleanup_marker_tags(iter_haystack_rows(export)), tally=tally)
+    assert sum(1 for _ in pipeline) == 200
+    counts = tally.general()['count_tags_by_entity']
+    assert counts['point']['valid_markers'] == {'point': 200, 'sensor': 200}
+    assert counts['point']['invalid_markers'] == {'custom0': 50, 'custom1': 50, 'custom2': 50, 'custom3': 50}
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from utils.refs import RefGraph
+from utils.synthetic import generate_building, write_haystack_json
+from utils.utils import cleanup_marker_tags, import_haystack_json, ph_typer_many, summarize_report
+
+
+@pytest.mark.parametrize('n', [1, 2, 50, 1000])
+def test_size(n):
+    assert len(list(generate_building(n))) == n
+
+
+def test_deterministic():
+    assert list(generate_building(300, seed=3)) == list(generate_building(300, seed=3))
+    assert list(generate_building(300, seed=3)) != list(generate_building(300, seed=4))
+
+
+def test_typing_and_refs():
+    rows = cleanup_marker_tags(list(generate_building(2000, custom_ratio=0)))
+    report = ph_typer_many(rows)
+    summary = summarize_report(report, rows)
+    assert summary['fc_count']['site'] == 1
+    assert summary['fc_count']['point'] > 3 * summary['fc_count']['equip']
+    assert 'ahu' in summary['subclass_count'] and 'vav' in summary['subclass_count']
+    assert not any(report['general']['count_tags_by_entity'][t]['invalid_markers'] for t in ('equip', 'point'))
+    # Every reference resolves within the building
+    assert RefGraph(rows).dangling == []
+
+
+def test_custom_ratio():
+    def custom_share(ratio):
+        rows = list(generate_building(5000, custom_ratio=ratio))
+        return sum(any(k.startswith('custom') for k in r) for r in rows) / len(rows)
+    assert custom_share(0) == 0
+    assert 0.4 < custom_share(0.5) < 0.6
+
+
+def test_points_per_equip():
+    def mix(points_per_equip):
+        rows = list(generate_building(5000, points_per_equip=points_per_equip))
+        return sum('point' in r for r in rows) / sum('equip' in r for r in rows)
+    assert mix(2) < mix(16)
+
+
+def test_write_haystack_json(tmp_path):
+    file = str(tmp_path / 'site.json')
+    rows = list(generate_building(100, marker="M"))
+    write_haystack_json(iter(rows), file)
+    assert import_haystack_json(file) == rows
+    with open(file) as f:
+        assert json.load(f)['meta'] == {'ver': '3.0'}
@@ -0,0 +1,47 @@
+from utils.defs import Taxonomy
+from utils.utils import lowest_subclass, get_default_defs
+
+
+def test_lowest_across_branches_does_not_hang():
+    # ahu and rtu are not direct subclasses of equip, which used to loop forever
+    assert lowest_subclass(['ahu', 'rtu'], 'equip') == 'rtu'
+
+
+def test_lowest_sibling_tie_goes_to_first_candidate():
+    assert lowest_subclass(['boiler', 'chiller'], 'equip') == 'boiler'
+    assert lowest_subclass(['chiller', 'boiler'], 'equip') == 'chiller'
+
+
+def test_lowest_follows_chain():
+    assert lowest_subclass(['elec-meter', 'meter'], 'equip') == 'elec-meter'
+    assert lowest_subclass(['meter', 'elec-meter', 'ac-elec-meter'], 'equip') == 'ac-elec-meter'
+
+
+def test_lowest_does_not_modify_class_list():
+    class_list = ['ac-elec-meter', 'elec-meter', 'meter']
+    lowest_subclass(class_list, 'equip')
+    assert class_list == ['ac-elec-meter', 'elec-meter', 'meter']
+
+
+def test_lowest_ignores_candidates_outside_root():
+    assert lowest_subclass(['notADef', 'alsoNotADef'], 'equip') == 'equip'
+    assert lowest_subclass(['vav', 'temp'], 'equip') == 'vav'
+
+
+def test_single_candidate_returned_as_is():
+    assert lowest_subclass(['vav'], 'equip') == 'vav'
+
+
+def test_defs_self_loops_are_ignored():
+    taxonomy = get_default_defs().taxonomy
+    assert 'date' not in taxonomy.ancestors.get('date', ())
+    assert taxonomy.is_subclass('ac-elec-meter', 'meter')
+    assert taxonomy.depth['elec-meter'] > taxonomy.depth['meter'] > taxonomy.depth['equip']
+
+
+def test_cyclic_edges_terminate():
+    taxonomy = Taxonomy([['a', 'b'], ['b', 'a'], ['c', 'a'], ['d', 'd']])
+    assert taxonomy.is_subclass('c', 'a')
+    assert taxonomy.depth['c'] > taxonomy.depth['a']
+    assert 'd' not in taxonomy.ancestors
+    assert taxonomy.lowest(['a', 'c'], 'b') == 'c'
@@ -0,0 +1,67 @@
+import copy
+
+from utils.defs import HaystackDefs, get_default_defs
+from utils.utils import TypingCache, ph_typer, ph_typer_many, tag_signature
+
+
+def vav(i):
+    return {'id': '@vav%d' % i, 'equip': 'm:', 'vav': 'm:', 'siteRef': '@s', 'navName': 'VAV %d' % i}
+
+
+def test_signature_ignores_id_and_values():
+    assert tag_signature(vav(1)) == tag_signature(vav(2))
+    assert tag_signature(vav(1)) != tag_signature(dict(vav(1), hot='m:'))
+
+
+def test_results_stamped_by_id():
+    cache = TypingCache()
+    first = ph_typer(vav(1), cache=cache)
+    second = ph_typer(vav(2), cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert first['id'] == '@vav1' and second['id'] == '@vav2'
+    assert first['lowest_subclass'] == second['lowest_subclass'] == 'vav'
+    # Results never share mutable lists
+    second['valid_markers'].append('x')
+    assert 'x' not in first['valid_markers']
+    assert 'x' not in ph_typer(vav(3), cache=cache)['valid_markers']
+
+
+def test_cached_matches_uncached():
+    entities = [vav(i) for i in range(20)] + [{'id': '@p%d' % i, 'point': 'm:', 'sensor': 'm:',
+                                               'temp': 'm:', 'custom%d' % (i % 3): 'm:'} for i in range(20)]
+    cached = ph_typer_many(copy.deepcopy(entities))
+    uncached = ph_typer_many(copy.deepcopy(entities), cache=False)
+    assert cached == uncached
+
+
+def test_lru_eviction_and_stats():
+    cache = TypingCache(maxsize=2)
+    ph_typer({'id': '@a', 'site': 'm:'}, cache=cache)
+    ph_typer({'id': '@b', 'equip': 'm:'}, cache=cache)
+    ph_typer({'id': '@a2', 'site': 'm:'}, cache=cache)
+    ph_typer({'id': '@c', 'point': 'm:'}, cache=cache)
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 1 and stats['misses'] == 3
+    assert stats['hit_rate'] == 0.25
+    # 'equip' was least recently used and was evicted, 'site' was kept
+    ph_typer({'id': '@a3', 'site': 'm:'}, cache=cache)
+    assert cache.hits == 2
+    ph_typer({'id': '@b2', 'equip': 'm:'}, cache=cache)
+    assert cache.misses == 4
+
+
+def test_cache_keyed_by_defs():
+    cache = TypingCache()
+    custom = HaystackDefs(snapshot=copy.deepcopy(get_default_defs().snapshot))
+    custom.snapshot['markers'].append('unicorn')
+    entity = {'id': '@x', 'unicorn': 'm:'}
+    assert ph_typer(entity, cache=cache)['invalid_markers'] == ['unicorn']
+    assert ph_typer(entity, defs=custom, cache=cache)['valid_markers'] == ['unicorn']
+
+
+def test_entities_without_id_not_cached():
+    cache = TypingCache()
+    assert ph_typer({'point': 'm:'}, cache=cache)['status']['valid'] is False
+    assert cache.stats()['misses'] == 0
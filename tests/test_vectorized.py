@@ -0,0 +1,60 @@
+import random
+
+from utils.utils import ph_typer_many
+from utils.vectorized import ph_typer_many_vectorized
+
+TAGS = ['equip', 'point', 'site', 'sensor', 'cmd', 'sp', 'vav', 'ahu', 'elec', 'meter', 'hot', 'water',
+        'boiler', 'temp', 'air', 'his', 'custom', 'newRec']
+VALS = ['siteRef', 'equipRef', 'dis', 'navName', 'kind', 'unit', 'hisId']
+
+
+def building(n=500, seed=11):
+    rng = random.Random(seed)
+    bldg = []
+    for i in range(n):
+        tags = [(t, 'm:') for t in rng.sample(TAGS, rng.randint(0, 6))]
+        tags += [(v, 's:%d' % i) for v in rng.sample(VALS, rng.randint(0, 3))]
+        rng.shuffle(tags)
+        bldg.append(dict([('id', '@%d' % i)] + tags))
+    return bldg
+
+
+# Sort string lists (set ordering is not stable), keeping the description
+# of multiple first class types comparable
+def normalize(o):
+    if isinstance(o, dict):
+        o = {k: normalize(v) for k, v in o.items()}
+        if o.get('description', '').startswith('Mutliple'):
+            o['description'] = sorted(o['description'].split(': ', 1)[1].strip('{}').split(', '))
+        return o
+    if isinstance(o, list):
+        return sorted(o) if all(isinstance(x, str) for x in o) else [normalize(x) for x in o]
+    return o
+
+
+def test_matches_ph_typer_many():
+    bldg = building()
+    assert normalize(ph_typer_many_vectorized(bldg)) == normalize(ph_typer_many(bldg))
+
+
+def test_entity_results_do_not_share_lists():
+    bldg = [{'id': '@a', 'equip': 'm:', 'vav': 'm:'}, {'id': '@b', 'vav': 'm:', 'equip': 'm:'}]
+    report = ph_typer_many_vectorized(bldg)
+    report['entities'][0]['valid_markers'].append('x')
+    assert 'x' not in report['entities'][1]['valid_markers']
+    assert report['entities'][1]['lowest_subclass'] == 'vav'
+
+
+def test_entities_without_id():
+    bldg = building(50) + [{'point': 'm:', 'sensor': 'm:'}]
+    report = ph_typer_many_vectorized(bldg)
+    assert report['entities'][-1] == {'status': {'valid': False, 'description': 'Entity does not have an id'}}
+    expected = normalize(ph_typer_many(bldg[:-1]))
+    assert normalize(report['general']['count_tags_by_entity']) == expected['general']['count_tags_by_entity']
+    assert 'sensor' in report['general']['valid_markers']
+
+
+def test_empty_building():
+    report = ph_typer_many_vectorized([])
+    assert report['entities'] == []
+    assert report['general']['count_tags_by_entity']['other']['valid_markers'] == {}
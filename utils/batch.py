@@ -0,0 +1,131 @@
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .defs import get_default_defs
+from .parallel import _init_worker
+from .sinks import SINKS, stream_site_report
+from .utils import (TAG_CATEGORIES, TAG_COUNT_COLUMNS, cleanup_marker_tags, import_haystack_json, ph_typer_many,
+                    reporter, tag_count_rows)
+
+# First class entity types and lowest subclasses are added as extra columns
+# after these, as in the README's per-site table
+SUMMARY_COLUMNS = ['site_name', 'file_name', 'total', 'valid', 'no_fc_entity', 'mult_fc_entities']
+
+
+# Given a directory (all *.json files in it) or a glob pattern, return the
+# sorted list of site files to report on
+def find_site_files(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.json')
+    return sorted(f for f in glob.glob(path) if os.path.isfile(f))
+
+
+# Type a single site file and write its report through the fmt output sink
+# (see utils/sinks.py) and report_<name>.csv, as reporter does.  Unless the
+# report is printed (verbose), the site is streamed: entities are written
+# as they are typed and never held in memory.  Returns (site_name, summary,
+# count_tags_by_entity).
+def report_site(file, output_root=None, defs=None, verbose=False, fmt='pretty'):
+    bldg_name = os.path.splitext(os.path.basename(file))[0]
+    if verbose:
+        bldg = cleanup_marker_tags(import_haystack_json(file))
+        report = ph_typer_many(bldg, defs=defs)
+        summary = reporter(report, bldg_name, bldg, output_root, verbose, fmt)
+        general = report['general']
+    else:
+        summary, general = stream_site_report(file, bldg_name, output_root, fmt, defs)
+    summary['file_name'] = os.path.basename(file)
+    return bldg_name, summary, general['count_tags_by_entity']
+
+
+def _report_site_worker(args):
+    file, output_root, fmt = args
+    return report_site(file, output_root, fmt=fmt)
+
+
+# Report on every site file, typing them concurrently in a process pool
+# whose workers share one ontology snapshot and each write their own sites'
+# fmt reports, then write the portfolio roll up (see write_portfolio) to
+# output_root.  Returns the per site summaries and the portfolio wide tag
+# counts.
+def batch_report(path, output_root=None, workers=None, defs=None, fmt='pretty'):
+    if defs is None:
+        defs = get_default_defs()
+    if output_root is None:
+        output_root = os.path.join(os.getcwd(), 'output')
+    if fmt not in SINKS:
+        raise ValueError("Unknown report format {!r}, expected one of {}".format(fmt, sorted(SINKS)))
+    files = find_site_files(path)
+    if not files:
+        raise ValueError("No site files found for {}".format(path))
+    workers = min(workers or os.cpu_count() or 1, len(files))
+
+    results = []
+    if workers > 1:
+        # Resolve the snapshot here so that workers never compile it themselves
+        defs.snapshot
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(defs,)) as pool:
+            for result in pool.map(_report_site_worker, [(f, output_root, fmt) for f in files]):
+                results.append(result)
+    else:
+        for f in files:
+            results.append(report_site(f, output_root, defs, fmt=fmt))
+
+    summaries = []
+    portfolio_counts = {}
+    for bldg_name, summary, counts in results:
+        summary['site_name'] = bldg_name
+        summaries.append(summary)
+        merge_tag_counts(portfolio_counts, counts)
+    write_portfolio(summaries, portfolio_counts, output_root)
+    return summaries, portfolio_counts
+
+
+# Add the count_tags_by_entity of one site into the portfolio totals
+def merge_tag_counts(totals, counts):
+    for entity_type, categories in counts.items():
+        entity_totals = totals.setdefault(entity_type, {i: {} for i in TAG_CATEGORIES})
+        for tag_category, tags in categories.items():
+            category = entity_totals.setdefault(tag_category, {})
+            for tag, n in tags.items():
+                category[tag] = category.get(tag, 0) + n
+    return totals
+
+
+# One row per site, with the README's per-site columns: totals, counts by
+# first class entity type and by lowest subclass
+def summary_table(summaries):
+    fc_types = sorted({t for s in summaries for t in s['fc_count']})
+    subclasses = sorted({t for s in summaries for t in s['subclass_count']})
+    header = SUMMARY_COLUMNS + ['fc_' + t for t in fc_types] + ['subclass_' + t for t in subclasses]
+    rows = []
+    for s in summaries:
+        rows.append([s[c] for c in SUMMARY_COLUMNS] +
+                    [s['fc_count'].get(t, 0) for t in fc_types] +
+                    [s['subclass_count'].get(t, 0) for t in subclasses])
+    return header, rows
+
+
+# Write the portfolio roll up:
+#   portfolio_summary.csv / .md: the per-site table
+#   portfolio_tags.csv: valid / invalid tag counts by first class entity
+#       type across all sites, in the same layout as report_<name>.csv
+def write_portfolio(summaries, portfolio_counts, output_root):
+    os.makedirs(output_root, exist_ok=True)
+    header, rows = summary_table(summaries)
+    with open(os.path.join(output_root, 'portfolio_summary.csv'), 'w') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(header)
+        csv_writer.writerows(rows)
+
+    with open(os.path.join(output_root, 'portfolio_summary.md'), 'w') as f:
+        f.write('| ' + ' | '.join(header) + ' |\n')
+        f.write('|' + '---|' * len(header) + '\n')
+        for row in rows:
+            f.write('| ' + ' | '.join(str(v) for v in row) + ' |\n')
+
+    with open(os.path.join(output_root, 'portfolio_tags.csv'), 'w') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(TAG_COUNT_COLUMNS)
+        csv_writer.writerows(tag_count_rows(portfolio_counts))
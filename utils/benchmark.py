@@ -0,0 +1,177 @@
+import copy
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from .defs import HaystackDefs
+from .synthetic import generate_building, write_haystack_json
+from .utils import (cleanup_marker_tags, count_tags_by_entity, find_tagset, import_haystack_json, ph_typer_many,
+                    reporter)
+
+# Benchmarks of the report pipeline on synthetic buildings.  Each benchmark
+# is a setup(context) returning the argument of a run(arg) which is timed,
+# so that only the stage itself is measured.  context holds the building
+# file, its rows, the typed report and a scratch directory, built once per
+# size.
+
+RESULTS_VERSION = 1
+
+
+def _fresh_rows(context):
+    return copy.deepcopy(context['raw_rows'])
+
+
+def _ontology_setup(context):
+    return None
+
+
+# Cold ontology load: parse defs.ttl and compile the vocabulary snapshot
+def _ontology_cold(_):
+    HaystackDefs(use_cache=False).all_markers
+
+
+# Warm ontology load: the compiled snapshot is read from the on-disk cache
+def _ontology_cached(_):
+    HaystackDefs().all_markers
+
+
+def _reporter(context):
+    reporter(context['report'], 'benchmark', context['rows'], context['scratch'], verbose=False)
+
+
+# name: (setup, run, scales with the building size)
+BENCHMARKS = {
+    'ontology_cold': (_ontology_setup, _ontology_cold, False),
+    'ontology_cached': (_ontology_setup, _ontology_cached, False),
+    'import_haystack_json': (lambda c: c['file'], import_haystack_json, True),
+    'cleanup_marker_tags': (_fresh_rows, cleanup_marker_tags, True),
+    'find_tagset': (lambda c: c['rows'], lambda rows: find_tagset(rows, ['point', 'sensor', 'temp']), True),
+    'ph_typer_many': (lambda c: c['rows'], ph_typer_many, True),
+    'count_tags_by_entity': (lambda c: (c['rows'], {'entities': c['report']['entities'], 'general': {}}),
+                             lambda args: count_tags_by_entity(*args), True),
+    'reporter': (lambda c: c, _reporter, True),
+}
+
+
+def _time(setup, run, context, repeat):
+    times = []
+    for _ in range(repeat):
+        arg = setup(context)
+        gc.collect()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': _git_commit(),
+    }
+
+
+# Run the benchmarks (all of BENCHMARKS by default) on synthetic buildings
+# of each of the sizes, repeat times each.  generator_options are passed to
+# generate_building.  Returns the machine readable results:
+#   {'version', 'environment', 'results': [{'benchmark', 'entities',
+#    'repeat', 'min', 'median', 'mean', 'entities_per_s'}, ...]}
+# Benchmarks which do not scale with the building are only run once, with
+# entities None.
+def run_benchmarks(sizes, benchmarks=None, repeat=3, generator_options=None, progress=None):
+    benchmarks = list(benchmarks or BENCHMARKS)
+    unknown = set(benchmarks).difference(BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmarks: {}".format(', '.join(sorted(unknown))))
+    results = []
+
+    def record(name, n, times):
+        result = {
+            'benchmark': name,
+            'entities': n,
+            'repeat': repeat,
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'entities_per_s': n / min(times) if n and min(times) else None,
+        }
+        results.append(result)
+        if progress is not None:
+            progress(result)
+
+    for name in benchmarks:
+        setup, run, scales = BENCHMARKS[name]
+        if not scales:
+            record(name, None, _time(setup, run, {}, repeat))
+
+    scratch = tempfile.mkdtemp(prefix='building_graphs_benchmark_')
+    try:
+        for n in sizes:
+            file = os.path.join(scratch, 'synthetic_{}.json'.format(n))
+            write_haystack_json(generate_building(n, **(generator_options or {})), file)
+            raw_rows = import_haystack_json(file)
+            rows = cleanup_marker_tags(copy.deepcopy(raw_rows))
+            context = {
+                'file': file,
+                'raw_rows': raw_rows,
+                'rows': rows,
+                'report': ph_typer_many(rows),
+                'scratch': scratch,
+            }
+            for name in benchmarks:
+                setup, run, scales = BENCHMARKS[name]
+                if scales:
+                    record(name, len(rows), _time(setup, run, context, repeat))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'environment': environment(),
+        'results': results,
+    }
+
+
+def write_results(results, file):
+    with open(file, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(file):
+    with open(file, 'r') as f:
+        return json.load(f)
+
+
+# Compare results against a baseline run on the min times of the same
+# (benchmark, entities).  Returns (benchmark, entities, baseline, current,
+# ratio) for every benchmark more than threshold times slower.
+def find_regressions(baseline, results, threshold=1.25):
+    before = {(r['benchmark'], r['entities']): r['min'] for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        key = (r['benchmark'], r['entities'])
+        if before.get(key) and r['min'] > before[key] * threshold:
+            regressions.append(key + (before[key], r['min'], r['min'] / before[key]))
+    return regressions
+
+
+def print_result(r, file=sys.stdout):
+    rate = '' if r['entities_per_s'] is None else '\t{:,.0f} entities/s'.format(r['entities_per_s'])
+    file.write("{}\t{}\tmin {:.4f}s\tmedian {:.4f}s{}\n".format(
+        r['benchmark'], r['entities'] if r['entities'] is not None else '-', r['min'], r['median'], rate))
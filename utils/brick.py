@@ -0,0 +1,211 @@
+import re
+from .defs import taxonomy_for_snapshot
+from .export import HAYSTACK_TO_BRICK
+from .resources import BRICK_DEFS
+from .snapshot import load_brick_snapshot
+
+# Haystack markers whose Brick tag is spelled differently.  camelCase
+# markers are split into their words first (coolingTower -> cooling, tower).
+HAYSTACK_TO_BRICK_TAGS = {
+    'temp': 'temperature',
+    'sp': 'setpoint',
+    'cmd': 'command',
+    'elec': 'electricity',
+    'equip': 'equipment',
+    'unocc': 'unoccupied',
+    'freq': 'frequency',
+    'run': 'running',
+    'site': 'building',
+}
+
+_CAMEL_CASE = re.compile(r'[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])')
+
+
+# Brick tags of a Brick class, i.e. the words of its name
+# (Discharge_Air_Temperature_Sensor -> discharge, air, temperature, sensor)
+def class_tags(name):
+    return frozenset(name.lower().split('_'))
+
+
+# Brick tags of a set of Haystack markers
+def haystack_to_brick_tags(markers):
+    tags = set()
+    for m in markers:
+        for word in _CAMEL_CASE.findall(m):
+            word = word.lower()
+            tags.add(HAYSTACK_TO_BRICK_TAGS.get(word, word))
+    return tags
+
+
+# Index of Brick classes by their tagsets.  As in EquipTokenIndex, each
+# tagset is filed under its rarest tag, so matching a set of tags only
+# inspects the tagsets anchored on one of those tags instead of every class.
+class BrickTagsetIndex(object):
+    def __init__(self, classes, taxonomy=None):
+        self.taxonomy = taxonomy
+        self.tagsets = {}
+        for name in classes:
+            self.tagsets.setdefault(class_tags(name), []).append(name)
+
+        frequency = {}
+        for tags in self.tagsets:
+            for t in tags:
+                frequency[t] = frequency.get(t, 0) + 1
+        self.by_anchor = {}
+        for tags in self.tagsets:
+            anchor = min(tags, key=lambda t: (frequency[t], t))
+            self.by_anchor.setdefault(anchor, []).append(tags)
+
+    def _depth(self, name):
+        if self.taxonomy is None:
+            return 0
+        return self.taxonomy.depth.get(name, 0)
+
+    # Every class whose whole tagset is contained in tags
+    def candidates(self, tags):
+        found = []
+        for t in tags:
+            for tagset in self.by_anchor.get(t, ()):
+                if tagset.issubset(tags):
+                    found.extend(self.tagsets[tagset])
+        return found
+
+    # The most specific class whose tagset is contained in tags: the one
+    # matching the most tags, then the deepest in the class hierarchy, then
+    # the first by name.  None if no class matches.
+    def match(self, tags):
+        best = None
+        best_key = None
+        for name in self.candidates(tags):
+            key = (len(class_tags(name)), self._depth(name))
+            if best is None or key > best_key or (key == best_key and name < best):
+                best = name
+                best_key = key
+        return best
+
+
+# A session scoped view of the Brick ontology, mirroring HaystackDefs: the
+# compiled snapshot (classes, hierarchy, equivalent classes) is loaded from
+# the on-disk cache when available, and the graph is only parsed if a query
+# actually needs it.
+class BrickDefs(object):
+    def __init__(self, path=BRICK_DEFS, cache_dir=None, use_cache=True, snapshot=None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self._snapshot = snapshot
+        self._graph = None
+        self._memo = {}
+
+    def __getstate__(self):
+        return {
+            'path': self.path,
+            'cache_dir': self.cache_dir,
+            'use_cache': self.use_cache,
+            '_snapshot': self._snapshot,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._graph = None
+        self._memo = {}
+
+    def __repr__(self):
+        return "BrickDefs({!r})".format(self.path)
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            from .queries import init_brick_graph
+            self._graph = init_brick_graph(self.path)
+        return self._graph
+
+    # Prepared, memoized queries over the graph (see QueryCache)
+    @property
+    def queries(self):
+        from .queries import query_cache
+        return query_cache(self.graph)
+
+    def query(self, q, bindings=None):
+        return self.queries.query(q, bindings)
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = load_brick_snapshot(self.path, self.cache_dir, self.use_cache, self._graph)
+        return self._snapshot
+
+    def _memoized(self, key, build):
+        if key not in self._memo:
+            self._memo[key] = build()
+        return self._memo[key]
+
+    @property
+    def classes(self):
+        return self._memoized('classes', lambda: tuple(self.snapshot['classes']))
+
+    # The rdfs:subClassOf hierarchy of the Brick classes
+    @property
+    def taxonomy(self):
+        return self._memoized('taxonomy', lambda: taxonomy_for_snapshot(self.snapshot))
+
+    @property
+    def tagset_index(self):
+        return self._memoized('tagset_index', lambda: BrickTagsetIndex(self.classes, self.taxonomy))
+
+    # Class -> the classes declared owl:equivalentClass to it (both ways)
+    @property
+    def equivalent_classes(self):
+        def build():
+            equivalent = {}
+            for a, b in self.snapshot['equivalent_classes']:
+                equivalent.setdefault(a, set()).add(b)
+                equivalent.setdefault(b, set()).add(a)
+            return {k: frozenset(v) for k, v in equivalent.items()}
+        return self._memoized('equivalent_classes', build)
+
+    # Most specific Brick class matching a set of Haystack markers
+    def match(self, markers):
+        return self.tagset_index.match(haystack_to_brick_tags(markers))
+
+    # Most specific Brick class of an entity, from its marker tags.  If the
+    # entity's ph_typer result is given, entities without a valid Haystack
+    # type get no class.  Can be passed as classes to the Brick export.
+    def entity_class(self, entity, typed=None):
+        if typed is not None and not typed.get('valid'):
+            return None
+        return self.match([k for k, v in entity.items() if v == "m:"])
+
+    # True if a Brick class agrees with a ph_typer result, i.e. it is (a
+    # subclass of) the Brick class of the entity's first class entity type
+    def consistent(self, typed, brick_class):
+        if brick_class is None or not typed.get('valid'):
+            return False
+        expected = HAYSTACK_TO_BRICK.get(typed['fc_entity_type'])
+        return expected is not None and self.taxonomy.is_subclass(brick_class, expected)
+
+    # Cross-validate ph_typer results against Brick: returns
+    # (consistent, inconsistent) lists of (entity id, Haystack type, Brick
+    # class) for the entities with a valid Haystack type
+    def cross_validate(self, entities, typed_entities):
+        consistent = []
+        inconsistent = []
+        for e, t in zip(entities, typed_entities):
+            if not t.get('valid'):
+                continue
+            cls = self.entity_class(e, t)
+            row = (t['id'], t.get('lowest_subclass', t['fc_entity_type']), cls)
+            (consistent if self.consistent(t, cls) else inconsistent).append(row)
+        return consistent, inconsistent
+
+
+_DEFAULT_BRICK_DEFS = None
+
+
+# Return the process wide BrickDefs, creating it (without loading anything)
+# on first use
+def get_default_brick_defs():
+    global _DEFAULT_BRICK_DEFS
+    if _DEFAULT_BRICK_DEFS is None:
+        _DEFAULT_BRICK_DEFS = BrickDefs()
+    return _DEFAULT_BRICK_DEFS
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import sys
+
+# The building-graphs command:
+#     building-graphs report FILE [--name NAME] [--output DIR] [--format pretty|jsonl|binary]
+#     building-graphs typecheck FILE [--strict]
+#     building-graphs plot FILE [FILE ...] [--output DIR] [--workers N] [--top N] [--fast]
+#     building-graphs query FILE FILTER
+#     building-graphs query --sparql QUERY [--brick]
+# FILE is a Haystack JSON export; the building name defaults to its file
+# name.  Every subcommand imports what it needs when it runs: report and
+# typecheck type from the cached vocabulary snapshot and never import
+# rdflib, pandas or plotnine, plot imports pandas / plotnine and only
+# query --sparql imports rdflib, so --help and a report start quickly.
+
+FORMATS = ('pretty', 'jsonl', 'binary')
+
+
+def _bldg_name(args):
+    return args.name or os.path.splitext(os.path.basename(args.file))[0]
+
+
+def _load(file):
+    from .utils import cleanup_marker_tags, import_haystack_json
+    return cleanup_marker_tags(import_haystack_json(file))
+
+
+def _report(args):
+    from .metrics import Metrics
+    from .utils import ph_typer_many, reporter
+    metrics = Metrics() if args.metrics else None
+    bldg = _load(args.file)
+    report = ph_typer_many(bldg, workers=args.workers, metrics=metrics)
+    reporter(report, _bldg_name(args), bldg, args.output, verbose=not args.quiet, fmt=args.format,
+             metrics=metrics)
+    if metrics is not None:
+        for name, (seconds, calls) in metrics.stages.items():
+            print("{}\t{:.4f}s\t{} calls".format(name, seconds, calls))
+        for name, n in metrics.counters.items():
+            print("{}\t{}".format(name, n))
+    return 0
+
+
+# Lists the entities which did not type, with the reason, and with --strict
+# fails if there are any
+def _typecheck(args):
+    from .stream import stream_report
+    invalid = []
+    n = 0
+
+    def check(e):
+        nonlocal n
+        n += 1
+        status = e.get('status', e)
+        if not status.get('valid', False):
+            invalid.append((e.get('id', '-'), status.get('description', '')))
+
+    stream_report(args.file, on_entity=check)
+    for id_, description in invalid:
+        print("{}\t{}".format(id_, description))
+    print("Entities: {}\tinvalid: {}".format(n, len(invalid)))
+    return 1 if args.strict and invalid else 0
+
+
+# Plots every building given, rendering the plots of all of them in one
+# pool of workers and skipping those whose input did not change
+def _plot(args):
+    if args.name and len(args.file) > 1:
+        raise SystemExit("plot: --name needs a single FILE")
+    if not args.fast:
+        try:
+            import plotnine
+        except ImportError:
+            raise SystemExit("plot: plotnine is not installed (use --fast to draw with matplotlib)")
+    from .plotting import plot_portfolio
+    from .utils import ph_typer_many
+    output = args.output or os.path.join(os.getcwd(), 'output')
+    reports = {}
+    for file in args.file:
+        name = args.name or os.path.splitext(os.path.basename(file))[0]
+        reports[name] = ph_typer_many(_load(file))
+    rendered = plot_portfolio(reports, output, workers=args.workers, force=args.force, top_n=args.top,
+                              fast=args.fast)
+    print("{} plots rendered to {}".format(len(rendered), output))
+    return 0
+
+
+# Entities of the file matching a Haystack filter, one JSON object per
+# line, or the rows of a SPARQL query over the Haystack (or Brick) defs
+def _query(args):
+    if args.sparql is not None:
+        if args.file is not None:
+            raise SystemExit("query: give either FILE FILTER or --sparql, not both")
+        if args.brick:
+            from .brick import get_default_brick_defs as get_defs
+        else:
+            from .defs import get_default_defs as get_defs
+        rows = get_defs().query(args.sparql)
+        for row in rows:
+            print("\t".join('' if v is None else str(v) for v in row))
+        return 0
+    if args.file is None or args.filter is None:
+        raise SystemExit("query: FILE and FILTER are required without --sparql")
+    from .filters import FilterIndex
+    matches = FilterIndex(_load(args.file)).query(args.filter)
+    if args.count:
+        print(len(matches))
+    else:
+        for e in matches:
+            print(json.dumps(dict(e)))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='building-graphs',
+                                     description="Type, report on and query Haystack building exports")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    p = commands.add_parser('report', help="Type a building and write its report")
+    p.add_argument('file', help="Haystack JSON file")
+    p.add_argument('--name', default=None, help="Building name (default: the file name)")
+    p.add_argument('--output', default=None, help="Output directory (default: ./output)")
+    p.add_argument('--format', default='pretty', choices=FORMATS, help="Report format")
+    p.add_argument('--workers', type=int, default=None, help="Type in this many worker processes")
+    p.add_argument('--metrics', action='store_true', help="Print the time spent in each stage")
+    p.add_argument('--quiet', action='store_true', help="Only write the report files")
+    p.set_defaults(run=_report)
+
+    p = commands.add_parser('typecheck', help="List the entities which do not type")
+    p.add_argument('file', help="Haystack JSON file")
+    p.add_argument('--strict', action='store_true', help="Exit with status 1 if any entity is invalid")
+    p.set_defaults(run=_typecheck)
+
+    p = commands.add_parser('plot', help="Plot the tag counts of buildings")
+    p.add_argument('file', nargs='+', help="Haystack JSON files")
+    p.add_argument('--name', default=None, help="Building name (default: the file name)")
+    p.add_argument('--output', default=None, help="Output directory (default: ./output)")
+    p.add_argument('--workers', type=int, default=None, help="Render in this many worker processes")
+    p.add_argument('--force', action='store_true', help="Render plots even if their input did not change")
+    p.add_argument('--top', type=int, default=None, help="Only plot the top N tags of each tag category")
+    p.add_argument('--fast', action='store_true', help="Draw smaller rasters directly with matplotlib")
+    p.set_defaults(run=_plot)
+
+    p = commands.add_parser('query', help="Query a building with a Haystack filter, or the defs with SPARQL")
+    p.add_argument('file', nargs='?', default=None, help="Haystack JSON file")
+    p.add_argument('filter', nargs='?', default=None, help="Haystack filter, e.g. 'point and equipRef->ahu'")
+    p.add_argument('--count', action='store_true', help="Only print the number of matches")
+    p.add_argument('--sparql', default=None, help="SPARQL query over the defs instead")
+    p.add_argument('--brick', action='store_true', help="Run --sparql over Brick rather than the Haystack defs")
+    p.set_defaults(run=_query)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from .utils import TAG_CATEGORIES, TAG_COUNT_COLUMNS, tag_count_rows
+
+
+# Columnar form of count_tags_by_entity: one row per (entity_type,
+# tag_category, tag) with its count, in the same order as report_<name>.csv.
+# entity_type, tag_category and tag are categoricals (entity types and tag
+# categories in report order), so the frame is small and group-bys over it
+# are done on integer codes.  Accepts a report from ph_typer_many (or its
+# 'general' section, or count_tags_by_entity itself), so that a report can
+# be plotted straight from memory.
+def tag_counts_frame(report):
+    counts = report
+    if 'general' in counts:
+        counts = counts['general']
+    if 'count_tags_by_entity' in counts:
+        counts = counts['count_tags_by_entity']
+
+    entity_types = list(counts)
+    tag_categories = list(TAG_CATEGORIES)
+    for categories in counts.values():
+        tag_categories.extend(c for c in categories if c not in tag_categories)
+    entity_type_codes = {t: i for i, t in enumerate(entity_types)}
+    tag_category_codes = {c: i for i, c in enumerate(tag_categories)}
+    tag_codes = {}
+
+    n = sum(len(tags) for categories in counts.values() for tags in categories.values())
+    codes = np.empty((3, n), dtype=np.int32)
+    count = np.empty(n, dtype=np.int64)
+    for i, (entity_type, tag_category, tag, c) in enumerate(tag_count_rows(counts)):
+        codes[0, i] = entity_type_codes[entity_type]
+        codes[1, i] = tag_category_codes[tag_category]
+        codes[2, i] = tag_codes.setdefault(tag, len(tag_codes))
+        count[i] = c
+
+    return pd.DataFrame({
+        'entity_type': pd.Categorical.from_codes(codes[0], entity_types),
+        'tag_category': pd.Categorical.from_codes(codes[1], tag_categories),
+        'tag': pd.Categorical.from_codes(codes[2], list(tag_codes)),
+        'count': count,
+    }, columns=TAG_COUNT_COLUMNS)
+
+
+# Split a tag counts frame by tag category, yielding (tag_category, frame)
+# for the categories which have any tags.  Unused categories are dropped
+# from each part, so plots of a part only show its own tags and entity types.
+def split_by_tag_category(df):
+    for tag_category, part in df.groupby('tag_category', observed=True, sort=True):
+        part = part.copy()
+        for column in ('entity_type', 'tag'):
+            if isinstance(part[column].dtype, pd.CategoricalDtype):
+                part[column] = part[column].cat.remove_unused_categories()
+        yield tag_category, part
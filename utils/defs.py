@@ -0,0 +1,305 @@
+from .resources import HAYSTACK_DEFS
+from .snapshot import load_haystack_snapshot
+
+# Vocabulary keys of the compiled snapshot, mapped to the root def which
+# the ph_load_all_* queries return alongside its subclasses (None when
+# the query does not include a root)
+VOCABULARY_ROOTS = {
+    'markers': 'marker',
+    'vals': 'val',
+    'entities': 'entity',
+    'equips': 'equip',
+    'phenomena': 'phenomenon',
+    'quantities': 'quantity',
+    'fc_markers': None,
+    'fc_entities': None,
+    'fc_equips': None,
+    'fc_phenomena': None,
+    'fc_quantities': None,
+    'point_function_types': None,
+}
+
+
+# In-memory index of the rdfs:subClassOf hierarchy, built once from the
+# direct edges of a snapshot.  Provides parent / child maps, the depth of
+# each def (longest path to a root) and the transitive closure of
+# ancestors, so that subclass checks are set lookups instead of queries.
+class Taxonomy(object):
+    def __init__(self, edges):
+        parents = {}
+        children = {}
+        for child, parent in edges:
+            # defs.ttl declares some defs (e.g. date) as subclasses of
+            # themselves, which carries no hierarchy information
+            if child == parent:
+                continue
+            parents.setdefault(child, []).append(parent)
+            children.setdefault(parent, []).append(child)
+            parents.setdefault(parent, [])
+            children.setdefault(child, [])
+        self.parents = {k: tuple(v) for k, v in parents.items()}
+        self.children = {k: tuple(v) for k, v in children.items()}
+        self.depth = {}
+        self.ancestors = {}
+        for name in self.parents:
+            self._resolve(name)
+
+    # Iteratively resolve depth and ancestors of name (and every def above
+    # it) so that deep hierarchies do not hit the recursion limit.  Any
+    # cycle is broken at the def where it is first revisited.
+    def _resolve(self, name):
+        stack = [name]
+        visiting = set()
+        while stack:
+            current = stack[-1]
+            if current in self.depth:
+                stack.pop()
+                continue
+            pending = [p for p in self.parents[current] if p not in self.depth and p not in visiting]
+            if pending and current not in visiting:
+                visiting.add(current)
+                stack.extend(pending)
+                continue
+            stack.pop()
+            ancestors = set()
+            depth = 0
+            for p in self.parents[current]:
+                if p not in self.depth:
+                    continue
+                ancestors.add(p)
+                ancestors.update(self.ancestors[p])
+                depth = max(depth, self.depth[p] + 1)
+            self.depth[current] = depth
+            self.ancestors[current] = frozenset(ancestors)
+
+    # True if child is parent, or is a (transitive) subclass of parent
+    def is_subclass(self, child, parent):
+        return child == parent or parent in self.ancestors.get(child, ())
+
+    # Given candidate classes found on an entity, return the most specific
+    # one that is a subclass of root.  Candidates outside of root's
+    # hierarchy are ignored; root is returned if none remain.  The deepest
+    # candidate wins.  Candidates of equal depth (e.g. boiler and chiller,
+    # siblings under equip) are not ordered by the defs, so the tie goes to
+    # the first one in the list, keeping the result stable for a given input.
+    def lowest(self, candidates, root):
+        lowest = root
+        lowest_depth = -1
+        for c in candidates:
+            if c != root and self.is_subclass(c, root):
+                if self.depth[c] > lowest_depth:
+                    lowest = c
+                    lowest_depth = self.depth[c]
+        return lowest
+
+
+# Index of equip defs by their hyphen separated name tokens, i.e.
+# frozenset(['elec', 'meter']) -> ('elec-meter',).  Each token set is filed
+# under its rarest token, so matching an entity only inspects the token
+# sets anchored on one of the entity's own markers (instead of every equip
+# def, and every permutation of its name).
+class EquipTokenIndex(object):
+    def __init__(self, equips):
+        self.names = {}
+        self.positions = {}
+        for position, name in enumerate(equips):
+            tokens = frozenset(name.split('-'))
+            self.names.setdefault(tokens, []).append(name)
+            self.positions.setdefault(tokens, position)
+        self.names = {k: tuple(v) for k, v in self.names.items()}
+
+        frequency = {}
+        for tokens in self.names:
+            for t in tokens:
+                frequency[t] = frequency.get(t, 0) + 1
+        self.by_anchor = {}
+        for tokens in self.names:
+            anchor = min(tokens, key=lambda t: (frequency[t], t))
+            self.by_anchor.setdefault(anchor, []).append(tokens)
+
+    # Return the canonical equip names whose tokens are all present in
+    # markers, in the order they are defined in the defs
+    def match(self, markers):
+        found = []
+        for m in markers:
+            for tokens in self.by_anchor.get(m, ()):
+                if tokens.issubset(markers):
+                    found.append(tokens)
+        found.sort(key=self.positions.__getitem__)
+        names = []
+        for tokens in found:
+            names.extend(self.names[tokens])
+        return names
+
+
+# Taxonomies are immutable, so they are shared between every HaystackDefs
+# built from the same defs content
+_TAXONOMIES = {}
+
+
+def taxonomy_for_snapshot(snapshot):
+    key = snapshot['source_hash']
+    if key not in _TAXONOMIES:
+        _TAXONOMIES[key] = Taxonomy(snapshot['subclass_edges'])
+    return _TAXONOMIES[key]
+
+
+# A session scoped view of the Haystack defs.  Holds (at most) one parsed
+# Graph, and builds each vocabulary set on first access, memoizing it for
+# the lifetime of the object.  Nothing is loaded at construction time, so
+# instances are cheap to create, share across a session or swap in tests.
+class HaystackDefs(object):
+    def __init__(self, path=HAYSTACK_DEFS, cache_dir=None, use_cache=True, snapshot=None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self._snapshot = snapshot
+        self._graph = None
+        self._memo = {}
+
+    # Only the snapshot is shipped when pickled (e.g. to worker processes),
+    # the graph and memoized sets are rebuilt lazily on the other side
+    def __getstate__(self):
+        return {
+            'path': self.path,
+            'cache_dir': self.cache_dir,
+            'use_cache': self.use_cache,
+            '_snapshot': self._snapshot,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._graph = None
+        self._memo = {}
+
+    def __repr__(self):
+        return "HaystackDefs({!r})".format(self.path)
+
+    # The parsed defs graph, only loaded (and rdflib only imported) when a
+    # query actually needs it
+    @property
+    def graph(self):
+        if self._graph is None:
+            from .queries import init_haystack_graph
+            self._graph = init_haystack_graph(self.path)
+        return self._graph
+
+    # Prepared, memoized queries over the graph (see QueryCache), for
+    # vocabulary lookups beyond the snapshot, e.g.
+    # defs.query('SELECT ?tag WHERE { ?tag ph:tagOn ?def }', {'def': PHIOT['ahu']})
+    @property
+    def queries(self):
+        from .queries import query_cache
+        return query_cache(self.graph)
+
+    def query(self, q, bindings=None):
+        return self.queries.query(q, bindings)
+
+    # The compiled vocabulary snapshot, loaded from the on-disk cache when
+    # available.  If the graph was already parsed it is reused to compile.
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = load_haystack_snapshot(self.path, self.cache_dir, self.use_cache, self._graph)
+        return self._snapshot
+
+    # Return the given vocabulary from the snapshot as an ordered list,
+    # with the root def removed (i.e. 'marker' from all markers)
+    def vocabulary(self, key):
+        values = list(self.snapshot[key])
+        root = VOCABULARY_ROOTS[key]
+        if root is not None and root in values:
+            values.remove(root)
+        return values
+
+    def _memoized(self, key, build):
+        if key not in self._memo:
+            self._memo[key] = build()
+        return self._memo[key]
+
+    # The rdfs:subClassOf hierarchy of the defs, built once per defs version
+    @property
+    def taxonomy(self):
+        return self._memoized('taxonomy', lambda: taxonomy_for_snapshot(self.snapshot))
+
+    @property
+    def all_markers(self):
+        return self._memoized('all_markers', lambda: frozenset(self.vocabulary('markers')))
+
+    @property
+    def all_vals(self):
+        return self._memoized('all_vals', lambda: frozenset(self.vocabulary('vals')))
+
+    @property
+    def all_entities(self):
+        return self._memoized('all_entities', lambda: frozenset(self.vocabulary('entities')))
+
+    # Ordered as defined in the defs, as subtypes are resolved in this order
+    @property
+    def all_equips(self):
+        return self._memoized('all_equips', lambda: tuple(self.vocabulary('equips')))
+
+    @property
+    def each_equip_as_set(self):
+        return self._memoized('each_equip_as_set',
+                              lambda: tuple(frozenset(e.split('-')) for e in self.all_equips))
+
+    # Token index used to resolve equip subtypes from an entity's markers
+    @property
+    def equip_index(self):
+        return self._memoized('equip_index', lambda: EquipTokenIndex(self.all_equips))
+
+    @property
+    def all_phenomenon(self):
+        return self._memoized('all_phenomenon', lambda: frozenset(self.vocabulary('phenomena')))
+
+    @property
+    def all_quantities(self):
+        return self._memoized('all_quantities', lambda: frozenset(self.vocabulary('quantities')))
+
+    # Ordered as defined in the defs, as reports are broken out in this order
+    @property
+    def fc_entities(self):
+        return self._memoized('fc_entities', lambda: tuple(self.vocabulary('fc_entities')))
+
+    @property
+    def fc_equips(self):
+        return self._memoized('fc_equips', lambda: frozenset(self.vocabulary('fc_equips')))
+
+    @property
+    def fc_markers(self):
+        return self._memoized('fc_markers', lambda: frozenset(self.vocabulary('fc_markers')))
+
+    @property
+    def fc_phenomenon(self):
+        return self._memoized('fc_phenomenon', lambda: frozenset(self.vocabulary('fc_phenomena')))
+
+    @property
+    def fc_quantities(self):
+        return self._memoized('fc_quantities', lambda: frozenset(self.vocabulary('fc_quantities')))
+
+    @property
+    def point_function_types(self):
+        return self._memoized('point_function_types',
+                              lambda: frozenset(self.vocabulary('point_function_types')))
+
+
+_DEFAULT_DEFS = None
+
+
+# Return the process wide HaystackDefs used when callers do not pass
+# their own, creating it (without loading anything) on first use
+def get_default_defs():
+    global _DEFAULT_DEFS
+    if _DEFAULT_DEFS is None:
+        _DEFAULT_DEFS = HaystackDefs()
+    return _DEFAULT_DEFS
+
+
+# Replace the process wide HaystackDefs, returning the previous one so
+# that it can be restored
+def set_default_defs(defs):
+    global _DEFAULT_DEFS
+    previous = _DEFAULT_DEFS
+    _DEFAULT_DEFS = defs
+    return previous
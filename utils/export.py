@@ -0,0 +1,175 @@
+import re
+from functools import lru_cache
+from urllib.parse import quote
+from rdflib import Literal, Namespace, RDF, RDFS, URIRef
+from .queries import BF, BRICK
+from .refs import ref_id
+from .stream import iter_cleanup_marker_tags, iter_haystack_rows, iter_ph_typer
+from .utils import TypingCache
+
+# Namespace of the exported entities, unless another is given
+BLDG = Namespace("http://my_buildings.com/bldg#")
+
+# Brick class of each Haystack entity type / subclass.  The most specific
+# type found on an entity wins (lowest_subclass, then point function, then
+# first class entity type).
+HAYSTACK_TO_BRICK = {
+    # first class entity types
+    'equip': 'Equipment',
+    'point': 'Point',
+    'site': 'Building',
+    'space': 'Space',
+    # equip subclasses
+    'ahu': 'AHU',
+    'vav': 'VAV',
+    'fcu': 'FCU',
+    'meter': 'Meter',
+    'elec-meter': 'Electricity_Meter',
+    'gas-meter': 'Gas_Meter',
+    'steam-meter': 'Steam_Meter',
+    'water-meter': 'Water_Meter',
+    'boiler': 'Boiler',
+    'chiller': 'Chiller',
+    'pump': 'Pump',
+    'fan': 'Fan',
+    'damper': 'Damper',
+    'valve': 'Valve',
+    'coolingTower': 'Cooling_Tower',
+    'heatExchanger': 'Heat_Exchanger',
+    'thermostat': 'Thermostat',
+    # point functions
+    'sensor': 'Sensor',
+    'cmd': 'Command',
+    'sp': 'Setpoint',
+    # space subclasses
+    'floor': 'Floor',
+    'room': 'Room',
+}
+
+# Point function markers, in the order they are checked
+POINT_FUNCTIONS = ['sensor', 'cmd', 'sp']
+
+# Ref tags exported as relationships, as (predicate, inverse).  inverse
+# relationships point from the referenced entity to the referencing one,
+# e.g. an ahuRef on a vav becomes <ahu> bf:feeds <vav>.  equipRef is
+# bf:isPointOf on points and bf:isPartOf on equips.
+REF_RELATIONSHIPS = {
+    'ahuRef': (BF.feeds, True),
+    'submeterOf': (BF.feeds, True),
+    'equipParent': (BF.isPartOf, False),
+    'siteRef': (BF.hasLocation, False),
+    'spaceRef': (BF.hasLocation, False),
+    'floorRef': (BF.hasLocation, False),
+}
+
+# Number of triples written to the file at a time
+BATCH_SIZE = 10000
+
+_TURTLE_LOCAL = re.compile(r'^[A-Za-z_][A-Za-z0-9_\-]*$')
+
+
+# Local Brick class name of a typed entity, or None if it has no valid type
+def brick_class(typed, entity=None):
+    if not typed.get('valid'):
+        return None
+    candidates = [typed.get('lowest_subclass')]
+    if entity is not None and typed['fc_entity_type'] == 'point':
+        candidates.extend(f for f in POINT_FUNCTIONS if f in entity)
+    candidates.append(typed['fc_entity_type'])
+    for c in candidates:
+        if c in HAYSTACK_TO_BRICK:
+            return HAYSTACK_TO_BRICK[c]
+    return None
+
+
+# Refs repeat heavily (every point of an equip refers to it), so the URIs
+# of recently seen ids are cached
+@lru_cache(maxsize=1 << 16)
+def entity_uri(value, namespace=BLDG):
+    return namespace[quote(ref_id(value), safe='-_.~')]
+
+
+# Triples of one entity and its ph_typer result: its Brick class, label and
+# the relationships of its ref tags
+def entity_triples(entity, typed, namespace=BLDG, classes=None):
+    if entity.get('id') is None:
+        return
+    subject = entity_uri(entity['id'], namespace)
+    cls = brick_class(typed, entity) if classes is None else classes(entity, typed)
+    if cls is not None:
+        yield (subject, RDF.type, BRICK[cls])
+    dis = entity.get('dis')
+    if isinstance(dis, str):
+        yield (subject, RDFS.label, Literal(dis[2:] if dis.startswith('s:') else dis))
+    for tag, value in entity.items():
+        if tag == 'equipRef':
+            predicate = BF.isPointOf if 'point' in entity else BF.isPartOf
+            inverse = False
+        elif tag in REF_RELATIONSHIPS:
+            predicate, inverse = REF_RELATIONSHIPS[tag]
+        else:
+            continue
+        for v in (value if isinstance(value, list) else [value]):
+            if ref_id(v) is None:
+                continue
+            target = entity_uri(v, namespace)
+            yield (target, predicate, subject) if inverse else (subject, predicate, target)
+
+
+# Triples of a stream of (entity, typed) pairs, e.g. from iter_ph_typer
+def haystack_to_brick_triples(pairs, namespace=BLDG, classes=None):
+    for entity, typed in pairs:
+        for triple in entity_triples(entity, typed, namespace, classes):
+            yield triple
+
+
+def _turtle_term(term, prefixes):
+    if isinstance(term, URIRef):
+        for prefix, ns in prefixes:
+            if term.startswith(ns):
+                local = term[len(ns):]
+                if _TURTLE_LOCAL.match(local):
+                    return prefix + ':' + local
+    return term.n3()
+
+
+# Serialize triples to file as N-Triples (fmt='nt') or Turtle (fmt='turtle')
+# without building a Graph: triples are formatted as they arrive and written
+# batch_size at a time, so memory use does not grow with the number of
+# triples.  Returns the number of triples written.
+def write_triples(triples, file, fmt='nt', namespace=BLDG, batch_size=BATCH_SIZE):
+    if fmt not in ('nt', 'turtle'):
+        raise ValueError("Unsupported format {!r}, expected 'nt' or 'turtle'".format(fmt))
+    prefixes = [('brick', str(BRICK)), ('bf', str(BF)), ('bldg', str(namespace)),
+                ('rdf', str(RDF)), ('rdfs', str(RDFS))]
+    # Subjects and objects repeat across triples, so their formatting is
+    # cached too
+    if fmt == 'turtle':
+        term = lru_cache(maxsize=1 << 16)(lambda t: _turtle_term(t, prefixes))
+    else:
+        term = lru_cache(maxsize=1 << 16)(lambda t: t.n3())
+    count = 0
+    batch = []
+    with open(file, 'w', encoding='utf-8') as f:
+        if fmt == 'turtle':
+            f.writelines('@prefix {}: <{}> .\n'.format(p, ns) for p, ns in prefixes)
+            f.write('\n')
+        for s, p, o in triples:
+            batch.append('{} {} {} .\n'.format(term(s), term(p), term(o)))
+            if len(batch) >= batch_size:
+                f.writelines(batch)
+                count += len(batch)
+                batch = []
+        f.writelines(batch)
+        count += len(batch)
+    return count
+
+
+# Stream a Haystack JSON file into a Brick RDF file: rows are read, cleaned
+# up, typed and converted one at a time, so a whole portfolio export runs
+# in bounded memory.  Returns the number of triples written.
+def export_haystack_json_to_brick(file, out, fmt='nt', namespace=BLDG, defs=None, m_bad="M",
+                                  batch_size=BATCH_SIZE, classes=None):
+    rows = iter_cleanup_marker_tags(iter_haystack_rows(file), m_bad)
+    pairs = iter_ph_typer(rows, defs=defs, cache=TypingCache())
+    return write_triples(haystack_to_brick_triples(pairs, namespace, classes), out, fmt, namespace, batch_size)
@@ -0,0 +1,409 @@
+import re
+from collections import OrderedDict
+from .index import TagIndex
+from .refs import RefGraph, ref_id
+
+# Haystack filters (https://project-haystack.org/doc/Filters) compiled to set
+# operations over a per-building index.  Supported:
+#     point and sensor and temp       has tag
+#     not his                         missing tag
+#     area > 1000                     comparison (==, !=, <, <=, >, >=) with
+#                                     numbers (units are ignored), "strings",
+#                                     @refs and true / false
+#     navName contains "fcu"          case insensitive substring of a string
+#                                     (the value may be left unquoted)
+#     equipRef->ahu                   paths through ref tags
+#     (a or b) and not c              boolean logic and grouping
+# Compiled filters can also be matched against a single entity (matches),
+# e.g. to filter entities as they are streamed.
+
+_TOKENS = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<arrow>->)
+  | (?P<op>==|!=|<=|>=|<|>)
+  | (?P<paren>[()])
+  | (?P<str>"(?:[^"\\]|\\.)*")
+  | (?P<ref>@[^\s()]+)
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)(?P<unit>[^\s()]*)
+  | (?P<name>[a-zA-Z_][a-zA-Z0-9_]*)
+''', re.VERBOSE)
+
+_KEYWORDS = {'and', 'or', 'not', 'true', 'false', 'contains'}
+
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = _TOKENS.match(expr, pos)
+        if m is None:
+            raise ValueError("Invalid filter {!r}: unexpected {!r} at offset {}".format(expr, expr[pos], pos))
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == 'ws':
+            continue
+        if kind == 'unit':
+            kind = 'number'
+        text = m.group(kind)
+        if kind == 'paren' or (kind == 'name' and text in _KEYWORDS):
+            kind = text
+        tokens.append((kind, text))
+    tokens.append(('end', ''))
+    return tokens
+
+
+# Decode a JSON Haystack value to something comparable with filter values:
+# numbers ('n:72.5 °F') to floats, refs ('@id', 'r:id Dis') to Ref, strings
+# ('s:text' or plain) to str.  Markers and other kinds decode to None.
+def decode_value(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    if value.startswith('n:'):
+        try:
+            return float(value[2:].split(' ', 1)[0])
+        except ValueError:
+            return None
+    if value.startswith('r:') or value.startswith('@'):
+        return Ref(value)
+    if value.startswith('s:'):
+        return value[2:]
+    if value == 'm:' or re.match(r'^[a-z]:', value):
+        return None
+    return value
+
+
+# A ref value, compared by bare id (see ref_id)
+class Ref(object):
+    __slots__ = ('id',)
+
+    def __init__(self, value):
+        self.id = ref_id(value)
+
+    def __eq__(self, other):
+        return isinstance(other, Ref) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "@" + self.id
+
+
+_COMPARE = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'contains': lambda a, b: b.lower() in a.lower(),
+}
+
+
+# Follow path from entity through its ref tags, returning the entity the
+# path ends on (None if a ref is missing or dangling).  lookup maps bare ids
+# (see ref_id) to entities.
+def _follow(entity, path, lookup):
+    if len(path) > 1 and lookup is None:
+        raise ValueError("Matching the path {} needs a lookup of the entities by id".format('->'.join(path)))
+    for tag in path[:-1]:
+        entity = lookup(ref_id(entity.get(tag)))
+        if entity is None:
+            return None
+    return entity
+
+
+# Nodes of a compiled filter.  Each evaluates to the set of positions of the
+# matching entities in a FilterIndex, and estimates how many entities it
+# matches (an upper bound) so that the planner can order clauses.
+# matches(entity, lookup) tests a single entity instead; lookup (bare id to
+# entity) is only needed to follow ref paths.
+class Has(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "Has({})".format('->'.join(self.path))
+
+    def estimate(self, index):
+        return index.count(self.path[0])
+
+    def evaluate(self, index):
+        return index.resolve_path(self.path, set(index.postings.get(self.path[-1], ())))
+
+    def matches(self, entity, lookup=None):
+        entity = _follow(entity, self.path, lookup)
+        return entity is not None and self.path[-1] in entity
+
+
+class Missing(object):
+    def __init__(self, path):
+        self.has = Has(path)
+
+    def __repr__(self):
+        return "Missing({})".format('->'.join(self.has.path))
+
+    def estimate(self, index):
+        return len(index) - (index.count(self.has.path[0]) if len(self.has.path) == 1 else 0)
+
+    def evaluate(self, index):
+        return index.all_positions().difference(self.has.evaluate(index))
+
+    def matches(self, entity, lookup=None):
+        return not self.has.matches(entity, lookup)
+
+
+class Compare(object):
+    def __init__(self, path, op, value):
+        self.path = path
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return "Compare({} {} {!r})".format('->'.join(self.path), self.op, self.value)
+
+    def estimate(self, index):
+        return index.count(self.path[0])
+
+    def evaluate(self, index):
+        tag = self.path[-1]
+        matches = set()
+        for i in index.postings.get(tag, ()):
+            if self._compare(index.entities[i][tag]):
+                matches.add(i)
+        return index.resolve_path(self.path, matches)
+
+    def _compare(self, value):
+        v = decode_value(value)
+        # Values of different kinds never match, as in Haystack
+        if v is None or type(v) is not type(self.value):
+            return False
+        try:
+            return _COMPARE[self.op](v, self.value)
+        except TypeError:
+            return False
+
+    def matches(self, entity, lookup=None):
+        entity = _follow(entity, self.path, lookup)
+        return entity is not None and self.path[-1] in entity and self._compare(entity[self.path[-1]])
+
+
+# Conjunction.  The positive clauses are intersected most selective first,
+# stopping as soon as the result is empty, and negated clauses are only
+# then subtracted, so 'not his' never materializes all the other entities.
+class And(object):
+    def __init__(self, clauses):
+        self.clauses = clauses
+
+    def __repr__(self):
+        return "And({})".format(', '.join(map(repr, self.clauses)))
+
+    def estimate(self, index):
+        return min(c.estimate(index) for c in self.clauses)
+
+    def evaluate(self, index):
+        positive = [c for c in self.clauses if not isinstance(c, Missing)]
+        negative = [c.has for c in self.clauses if isinstance(c, Missing)]
+        if positive:
+            positive.sort(key=lambda c: c.estimate(index))
+            matches = positive[0].evaluate(index)
+            for c in positive[1:]:
+                if not matches:
+                    return matches
+                matches.intersection_update(_positions(c, index))
+        else:
+            matches = index.all_positions()
+        for c in negative:
+            if not matches:
+                break
+            matches.difference_update(_positions(c, index))
+        return matches
+
+    def matches(self, entity, lookup=None):
+        return all(c.matches(entity, lookup) for c in self.clauses)
+
+
+# The positions matching a clause, used read-only: single tags are answered
+# with the postings themselves instead of a copy
+def _positions(clause, index):
+    if isinstance(clause, Has) and len(clause.path) == 1:
+        return index.postings.get(clause.path[0], ())
+    return clause.evaluate(index)
+
+
+class Or(object):
+    def __init__(self, clauses):
+        self.clauses = clauses
+
+    def __repr__(self):
+        return "Or({})".format(', '.join(map(repr, self.clauses)))
+
+    def estimate(self, index):
+        return min(len(index), sum(c.estimate(index) for c in self.clauses))
+
+    def evaluate(self, index):
+        matches = set()
+        for c in self.clauses:
+            matches.update(c.evaluate(index))
+        return matches
+
+    def matches(self, entity, lookup=None):
+        return any(c.matches(entity, lookup) for c in self.clauses)
+
+
+# Recursive descent parser for the filter grammar
+class _Parser(object):
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0]
+
+    def take(self, kind):
+        found, text = self.tokens[self.pos]
+        if found != kind:
+            raise ValueError("Invalid filter {!r}: expected {} but found {!r}".format(
+                self.expr, kind, text or 'end of filter'))
+        self.pos += 1
+        return text
+
+    def parse(self):
+        node = self.cond_or()
+        self.take('end')
+        return node
+
+    def cond_or(self):
+        clauses = [self.cond_and()]
+        while self.peek() == 'or':
+            self.take('or')
+            clauses.append(self.cond_and())
+        return clauses[0] if len(clauses) == 1 else Or(clauses)
+
+    def cond_and(self):
+        clauses = [self.term()]
+        while self.peek() == 'and':
+            self.take('and')
+            clauses.append(self.term())
+        # Flatten nested conjunctions so that all their clauses are planned
+        # together
+        flat = []
+        for c in clauses:
+            flat.extend(c.clauses if isinstance(c, And) else [c])
+        return flat[0] if len(flat) == 1 else And(flat)
+
+    def term(self):
+        if self.peek() == '(':
+            self.take('(')
+            node = self.cond_or()
+            self.take(')')
+            return node
+        if self.peek() == 'not':
+            self.take('not')
+            return Missing(self.path())
+        path = self.path()
+        if self.peek() == 'op':
+            op = self.take('op')
+            return Compare(path, op, self.value())
+        if self.peek() == 'contains':
+            self.take('contains')
+            if self.peek() == 'name':
+                return Compare(path, 'contains', self.take('name'))
+            value = self.value()
+            if not isinstance(value, str):
+                raise ValueError("Invalid filter {!r}: contains needs a string".format(self.expr))
+            return Compare(path, 'contains', value)
+        return Has(path)
+
+    def path(self):
+        names = [self.take('name')]
+        while self.peek() == 'arrow':
+            self.take('arrow')
+            names.append(self.take('name'))
+        return names
+
+    def value(self):
+        kind = self.peek()
+        text = self.take(kind)
+        if kind == 'number':
+            return float(re.match(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?', text).group(0))
+        if kind == 'str':
+            return re.sub(r'\\(.)', r'\1', text[1:-1])
+        if kind == 'ref':
+            return Ref(text)
+        if kind in ('true', 'false'):
+            return kind == 'true'
+        raise ValueError("Invalid filter {!r}: expected a value but found {!r}".format(self.expr, text))
+
+
+# Compiled filters, keyed by expression.  Compiling only depends on the
+# expression, so plans are shared by every building.
+_PLANS = OrderedDict()
+PLAN_CACHE_SIZE = 1024
+
+
+# Parse a filter expression into its plan, reusing a cached plan if the
+# expression was compiled before
+def compile_filter(expr):
+    plan = _PLANS.get(expr)
+    if plan is None:
+        plan = _Parser(expr).parse()
+        _PLANS[expr] = plan
+        while len(_PLANS) > PLAN_CACHE_SIZE:
+            _PLANS.popitem(last=False)
+    else:
+        _PLANS.move_to_end(expr)
+    return plan
+
+
+# TagIndex which also answers Haystack filter queries.  Tags are looked up
+# in the postings, and ref paths (equipRef->ahu) through a RefGraph of the
+# building, built on the first path query.  Like the TagIndex postings, the
+# ref graph is not updated when ref tags change; call reindex_refs then.
+class FilterIndex(TagIndex):
+    def __init__(self, entities):
+        TagIndex.__init__(self, entities)
+        self._refs = None
+
+    @property
+    def refs(self):
+        if self._refs is None:
+            self._refs = RefGraph(self.entities)
+        return self._refs
+
+    def reindex_refs(self):
+        self._refs = None
+
+    def all_positions(self):
+        return set(range(len(self.entities)))
+
+    # Given the positions of the entities matching the end of a path, return
+    # the positions of the entities the path starts from: walking the path
+    # backwards, each step keeps the entities whose ref tag points at one of
+    # the current matches
+    def resolve_path(self, path, matches):
+        if len(path) == 1:
+            return matches
+        for tag in reversed(path[:-1]):
+            if not matches:
+                break
+            matches = self.refs.referrer_positions(matches, tag)
+        return matches
+
+    # Positions of the entities matching the filter
+    def positions_matching(self, expr):
+        return compile_filter(expr).evaluate(self)
+
+    # Entities matching the filter, in building order
+    def query(self, expr):
+        return self._entities_at(self.positions_matching(expr))
+
+    # Same contract as find_tagset: (matches, non_matches) in building order
+    def find(self, expr):
+        matches = self.positions_matching(expr)
+        return (self._entities_at(matches), self._entities_at(self.all_positions().difference(matches)))
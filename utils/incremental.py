@@ -0,0 +1,131 @@
+from .defs import get_default_defs
+from .utils import TAG_CATEGORIES, TypingCache, ph_typer
+
+
+# A report (as from ph_typer_many) kept up to date under deltas to the
+# building: added entities, removed ids and changed tag sets.  Only the
+# entities in a delta are re-typed; count_tags_by_entity is adjusted by
+# decrementing the old result and incrementing the new one, and the
+# general valid / invalid sets are kept as reference counts of how many
+# entities use each tag, so every update costs O(delta) rather than
+# O(building).
+# Entities are keyed by id.  A copy of each entity is kept, so that the
+# old tags can be retracted even when the caller modified the entity in
+# place (e.g. with add_marker) before passing it to change.
+class IncrementalReport(object):
+    def __init__(self, entities=(), defs=None, cache=None):
+        self.defs = defs if defs is not None else get_default_defs()
+        self.cache = cache if cache is not None else TypingCache()
+        self.entities = {}
+        self.typed = {}
+        self.marker_refs = {}
+        self.val_refs = {}
+        self.count_tags_by_entity = {}
+        for ent in list(self.defs.fc_entities) + ['other']:
+            self.count_tags_by_entity[ent] = {i: {} for i in TAG_CATEGORIES}
+        self.add(entities)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.entities
+
+    # Add new entities.  Entities must have an id which is not already in
+    # the report.
+    def add(self, entities):
+        for e in entities:
+            entity_id = e.get('id')
+            if entity_id is None:
+                raise ValueError("Entity does not have an id: {}".format(e))
+            if entity_id in self.entities:
+                raise ValueError("Entity {} is already in the report".format(entity_id))
+            self._insert(entity_id, e)
+        return self
+
+    # Remove the entities with the given ids
+    def remove(self, ids):
+        for entity_id in ids:
+            if entity_id not in self.entities:
+                raise KeyError(entity_id)
+            self._retract(entity_id)
+        return self
+
+    # Replace the tags of existing entities with those of the given
+    # entities (matched by id).  Entities whose tags did not change are
+    # not re-typed.
+    def change(self, entities):
+        for e in entities:
+            entity_id = e.get('id')
+            if entity_id not in self.entities:
+                raise KeyError(entity_id)
+            if self.entities[entity_id] == e:
+                continue
+            self._retract(entity_id)
+            self._insert(entity_id, e)
+        return self
+
+    # Apply one delta: removals first, then changes, then additions
+    def apply(self, added=(), removed=(), changed=()):
+        self.remove(removed)
+        self.change(changed)
+        self.add(added)
+        return self
+
+    def _insert(self, entity_id, entity):
+        entity = dict(entity)
+        typed = ph_typer(entity, defs=self.defs, cache=self.cache)
+        self.entities[entity_id] = entity
+        self.typed[entity_id] = typed
+        for k, v in entity.items():
+            refs = self.marker_refs if v == "m:" else self.val_refs
+            refs[k] = refs.get(k, 0) + 1
+        counts = self.count_tags_by_entity[self._entity_type(typed)]
+        for marker_or_vals in TAG_CATEGORIES:
+            category = counts[marker_or_vals]
+            for tag in typed[marker_or_vals]:
+                category[tag] = category.get(tag, 0) + 1
+
+    # Take an entity's contribution back out.  Tags whose count drops to
+    # zero are dropped, so the result matches a report built from scratch.
+    def _retract(self, entity_id):
+        entity = self.entities.pop(entity_id)
+        typed = self.typed.pop(entity_id)
+        for k, v in entity.items():
+            refs = self.marker_refs if v == "m:" else self.val_refs
+            _decrement(refs, k)
+        counts = self.count_tags_by_entity[self._entity_type(typed)]
+        for marker_or_vals in TAG_CATEGORIES:
+            category = counts[marker_or_vals]
+            for tag in typed[marker_or_vals]:
+                _decrement(category, tag)
+
+    def _entity_type(self, typed):
+        return typed['fc_entity_type'] if typed['valid'] else 'other'
+
+    def general(self):
+        all_markers = self.defs.all_markers
+        all_vals = self.defs.all_vals
+        return {
+            'valid_markers': [t for t in self.marker_refs if t in all_markers],
+            'invalid_markers': [t for t in self.marker_refs if t not in all_markers],
+            'valid_vals': [t for t in self.val_refs if t in all_vals],
+            'invalid_vals': [t for t in self.val_refs if t not in all_vals],
+            'count_tags_by_entity': self.count_tags_by_entity,
+        }
+
+    # The current report, in the same shape as ph_typer_many's
+    @property
+    def report(self):
+        return {
+            'entities': list(self.typed.values()),
+            'general': self.general(),
+        }
+
+
+def _decrement(counts, key):
+    n = counts[key] - 1
+    if n:
+        counts[key] = n
+    else:
+        del counts[key]
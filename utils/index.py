@@ -0,0 +1,98 @@
+# Inverted index over the tags (keys) of a building's entities.  Each tag maps
+# to the set of positions of the entities carrying it, so tagset, exclusion
+# and complement queries are set intersections / differences instead of
+# scans over every entity.  The index holds the entity dicts themselves, so
+# mutations must go through add_marker / remove_tag / reindex to keep the
+# postings consistent.
+class TagIndex(object):
+    def __init__(self, entities):
+        self.entities = list(entities)
+        self.postings = {}
+        self._positions = {}
+        for i, e in enumerate(self.entities):
+            self._positions[id(e)] = i
+            for k in e:
+                self.postings.setdefault(k, set()).add(i)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    # Number of entities carrying the tag
+    def count(self, tag):
+        return len(self.postings.get(tag, ()))
+
+    # Positions of the entities carrying ALL of the tags.  Postings are
+    # intersected smallest first, so rare tags prune the work early.
+    def positions(self, tags):
+        tags = set(tags)
+        if not tags:
+            return set(range(len(self.entities)))
+        postings = sorted((self.postings.get(t, set()) for t in tags), key=len)
+        matches = set(postings[0])
+        for p in postings[1:]:
+            if not matches:
+                break
+            matches.intersection_update(p)
+        return matches
+
+    def _entities_at(self, positions):
+        return [self.entities[i] for i in sorted(positions)]
+
+    # Same contract as find_tagset: (matches, non_matches) in entity order
+    def find_tagset(self, tags):
+        matches = self.positions(tags)
+        non_matches = set(range(len(self.entities))).difference(matches)
+        return (self._entities_at(matches), self._entities_at(non_matches))
+
+    # Same contract as find_tagset_exclusive: entities with all of tags,
+    # except those which also have all of exclude_tags
+    def find_tagset_exclusive(self, tags, exclude_tags):
+        matches = self.positions(tags).difference(self.positions(exclude_tags))
+        return self._entities_at(matches)
+
+    # Entities NOT carrying all of the tags
+    def complement(self, tags):
+        return self._entities_at(set(range(len(self.entities))).difference(self.positions(tags)))
+
+    # Update the postings of an entity after it was modified directly
+    def reindex(self, entity):
+        i = self._positions.get(id(entity))
+        if i is None:
+            return
+        for tag, p in self.postings.items():
+            if tag not in entity:
+                p.discard(i)
+        for tag in entity:
+            self.postings.setdefault(tag, set()).add(i)
+
+    # Add tag_to_add as a marker to the entities, updating the postings
+    def add_marker(self, entities, tag_to_add):
+        p = self.postings.setdefault(tag_to_add, set())
+        for e in entities:
+            e[tag_to_add] = "m:"
+            i = self._positions.get(id(e))
+            if i is not None:
+                p.add(i)
+        return entities
+
+    # Remove the tag from the entities, updating the postings.  Entities
+    # without the tag are not affected.
+    def remove_tag(self, entities, tag):
+        p = self.postings.get(tag, set())
+        for e in entities:
+            e.pop(tag, None)
+            i = self._positions.get(id(e))
+            if i is not None:
+                p.discard(i)
+        return list(entities)
+
+    # Marker cleanup only rewrites values, so the postings are unaffected
+    def cleanup_marker_tags(self, m_bad="M"):
+        for e in self.entities:
+            for k, v in e.items():
+                if v == m_bad:
+                    e[k] = "m:"
+        return self.entities
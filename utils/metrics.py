@@ -0,0 +1,181 @@
+import cProfile
+import functools
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Opt-in instrumentation of the typing / report pipeline.  While a Metrics
+# is being collected (see collect_metrics) the pipeline records the wall
+# time and number of calls of each stage, and counters such as SPARQL
+# queries issued, graphs parsed and cache hits / misses.  Nothing is
+# recorded otherwise; the instrumented code only checks active_metrics().
+#
+# Stages nest: 'typing' (the ph_typer calls) includes 'subtyping' and
+# 'lowest_subclass', and includes 'ontology_parse' / 'ontology_snapshot'
+# when the defs are first loaded while typing.
+#
+# Setting BUILDING_GRAPHS_METRICS=1 collects metrics on every ph_typer_many
+# and reporter call, and BUILDING_GRAPHS_PROFILE=<directory> runs them under
+# cProfile, dumping one .prof file per call, so production runs can be
+# instrumented or profiled without code edits.
+
+METRICS_ENV = 'BUILDING_GRAPHS_METRICS'
+PROFILE_ENV = 'BUILDING_GRAPHS_PROFILE'
+
+
+class Metrics(object):
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+    # Add seconds (over calls calls) to the named stage
+    def add_time(self, name, seconds, calls=1):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0.0, 0]
+        stage[0] += seconds
+        stage[1] += calls
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        for name, (seconds, calls) in other.stages.items():
+            self.add_time(name, seconds, calls)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        return self
+
+    # Entities typed per second of ph_typer_many
+    @property
+    def throughput(self):
+        seconds = self.stages.get('ph_typer_many', (0.0, 0))[0]
+        entities = self.counters.get('entities', 0)
+        return entities / seconds if seconds else None
+
+    # The JSON serializable form attached to reports as report['metrics']
+    def as_dict(self):
+        return {
+            'stages': {k: {'seconds': s, 'calls': c} for k, (s, c) in self.stages.items()},
+            'counters': dict(self.counters),
+            'entities_per_s': self.throughput,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        metrics = cls()
+        for name, stage in (d or {}).get('stages', {}).items():
+            metrics.add_time(name, stage['seconds'], stage['calls'])
+        for name, n in (d or {}).get('counters', {}).items():
+            metrics.count(name, n)
+        return metrics
+
+
+_ACTIVE = None
+
+
+# The Metrics being collected, or None
+def active_metrics():
+    return _ACTIVE
+
+
+# Collect metrics into the given Metrics (a new one by default) for the
+# duration of the block.  Blocks nest, the innermost Metrics is recorded to.
+@contextmanager
+def collect_metrics(metrics=None):
+    global _ACTIVE
+    metrics = metrics if metrics is not None else Metrics()
+    previous = _ACTIVE
+    _ACTIVE = metrics
+    try:
+        yield metrics
+    finally:
+        _ACTIVE = previous
+
+
+# Resolve the metrics argument of ph_typer_many / reporter: a Metrics to
+# record to, True for a new one, or None / False to only record when
+# metrics are already being collected or enabled through METRICS_ENV
+def resolve_metrics(metrics):
+    if isinstance(metrics, Metrics):
+        return metrics
+    if metrics:
+        return Metrics()
+    if _ACTIVE is not None:
+        return _ACTIVE
+    if metrics is None and os.environ.get(METRICS_ENV, '') not in ('', '0'):
+        return Metrics()
+    return None
+
+
+# Time the block as the named stage of the active metrics, if any
+@contextmanager
+def timed(name):
+    metrics = _ACTIVE
+    if metrics is None:
+        yield None
+        return
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add_time(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, n)
+
+
+_PROFILE_DIR = None
+_PROFILING = False
+_PROFILE_RUNS = 0
+
+
+# Profile the ph_typer_many / reporter calls of the block with cProfile,
+# writing <name>_<pid>_<n>.prof files to directory (see profiled)
+@contextmanager
+def profile_to(directory):
+    global _PROFILE_DIR
+    previous = _PROFILE_DIR
+    _PROFILE_DIR = directory
+    try:
+        yield directory
+    finally:
+        _PROFILE_DIR = previous
+
+
+def profile_dir():
+    return _PROFILE_DIR or os.environ.get(PROFILE_ENV) or None
+
+
+# Decorator running the function under cProfile when a profile directory
+# is set (profile_to or PROFILE_ENV).  Calls made while already profiling
+# are part of the outer profile.
+def profiled(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _PROFILING, _PROFILE_RUNS
+        directory = profile_dir()
+        if directory is None or _PROFILING:
+            return func(*args, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        _PROFILE_RUNS += 1
+        f_name = os.path.join(directory, '{}_{}_{}.prof'.format(func.__name__, os.getpid(), _PROFILE_RUNS))
+        profile = cProfile.Profile()
+        _PROFILING = True
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            _PROFILING = False
+            profile.dump_stats(f_name)
+    return wrapper
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from .defs import get_default_defs, set_default_defs
+from .utils import ReportTally, TypingCache, ph_typer
+
+# Chunks smaller than this spend more time being shipped between processes
+# than being typed
+MIN_CHUNK_SIZE = 500
+
+# Per worker process state, set once by _init_worker
+_WORKER_DEFS = None
+_WORKER_CACHE = None
+
+
+# Runs once in each worker: the HaystackDefs arrives pickled (its snapshot
+# only), becomes the worker's default, and every chunk the worker types
+# shares one TypingCache
+def _init_worker(defs):
+    global _WORKER_DEFS, _WORKER_CACHE
+    _WORKER_DEFS = defs
+    _WORKER_CACHE = TypingCache()
+    set_default_defs(defs)
+
+
+def _type_chunk(chunk):
+    tally = ReportTally(_WORKER_DEFS)
+    typed = []
+    for e in chunk:
+        t = ph_typer(e, defs=_WORKER_DEFS, cache=_WORKER_CACHE)
+        tally.add(e, t)
+        typed.append(t)
+    return typed, tally
+
+
+def _chunks(entities, chunk_size):
+    it = iter(entities)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Default chunk size: about four chunks per worker, so that uneven chunks
+# still balance, but never so small that transfer dominates
+def default_chunk_size(n_entities, workers):
+    return max(MIN_CHUNK_SIZE, -(-n_entities // (workers * 4)))
+
+
+# Process pool equivalent of ph_typer_many.  The entities are split into
+# chunks, typed by workers which load the ontology sets once, and the
+# per chunk count_tags_by_entity tallies are merged in chunk order, so the
+# report (including the order of report['entities']) matches a serial run.
+def ph_typer_many_parallel(entities, workers=None, chunk_size=None, defs=None, keep_entities=True,
+                           on_entity=None):
+    if defs is None:
+        defs = get_default_defs()
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        n_entities = len(entities) if hasattr(entities, '__len__') else 0
+        chunk_size = default_chunk_size(n_entities, workers)
+    # Resolve the snapshot here so that workers never compile it themselves
+    defs.snapshot
+
+    report = {
+        'entities': [],
+        'general': {}
+    }
+    tally = ReportTally(defs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(defs,)) as pool:
+        for typed, chunk_tally in pool.map(_type_chunk, _chunks(entities, chunk_size)):
+            tally.merge(chunk_tally)
+            if on_entity is not None:
+                for t in typed:
+                    on_entity(t)
+            if keep_entities:
+                report['entities'].extend(typed)
+    report['general'] = tally.general()
+    return report
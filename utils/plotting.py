@@ -1,23 +1,208 @@
-import numpy as np
-import pandas as pd
+import hashlib
+import json
 import os
-from plotnine import *
+from concurrent.futures import ProcessPoolExecutor
 
-# Given a dataframe of the csv report produced by the reporter,
-# Create a plot for each of the tag-categories, showing breakout of
-# tags by entity types.
-def plot1(df, output_dir, bldg_name):
+# pandas, plotnine and matplotlib are imported where they are used, so
+# importing this module (e.g. star imported next to utils.utils by the
+# examples) stays cheap when no plots are drawn.
+#
+# Plots are rendered in three steps: plot_jobs splits the tag counts of a
+# building into one PlotJob per tag category, render_plots drops the jobs
+# whose png is up to date and renders the others, in a process pool when
+# there are several.  A plot is up to date when the digest of its input
+# (the rows plotted, title and rendering options) matches the one recorded
+# in plots/plot_hashes.json when it was last rendered, so regenerating the
+# plots of a portfolio after a small change only renders what changed.
+
+# Bump to re-render every plot after a change to the way plots are drawn
+PLOT_VERSION = 1
+HASHES_FILE = 'plot_hashes.json'
+
+
+class PlotJob(object):
+    def __init__(self, bldg_name, tag_category, data, f_name, title, fast=False):
+        self.bldg_name = bldg_name
+        self.tag_category = tag_category
+        self.data = data
+        self.f_name = f_name
+        self.title = title
+        self.fast = fast
+        self._digest = None
+
+    def __repr__(self):
+        return "PlotJob({!r}, {!r})".format(self.bldg_name, self.tag_category)
+
+    # (entity_type, tag, count) rows plotted
+    def rows(self):
+        return list(zip(self.data['entity_type'].astype(str), self.data['tag'].astype(str),
+                        self.data['count'].astype(int).tolist()))
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            key = [PLOT_VERSION, self.title, self.fast, self.rows()]
+            self._digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+        return self._digest
+
+
+# Keep the top_n tags of a tag category frame by total count over the
+# entity types (ties by tag name).  Returns the frame and the number of
+# tags it had.
+def top_tags(df, top_n):
+    import pandas as pd
+    totals = df.groupby('tag', observed=True, sort=False)['count'].sum()
+    n_tags = len(totals)
+    if top_n is None or n_tags <= top_n:
+        return df, n_tags
+    keep = [t for t, _ in sorted(totals.items(), key=lambda i: (-i[1], str(i[0])))[:top_n]]
+    df = df[df['tag'].isin(keep)].copy()
+    if isinstance(df['tag'].dtype, pd.CategoricalDtype):
+        df['tag'] = df['tag'].cat.remove_unused_categories()
+    return df, n_tags
+
+
+# One PlotJob per tag category of the building.  df may be the report from
+# ph_typer_many itself, a frame from tag_counts_frame, or a dataframe of
+# the csv report produced by the reporter.  With top_n only the top_n tags
+# of each category are plotted, and with fast the plots are drawn straight
+# with matplotlib as smaller rasters (see render_plot).
+def plot_jobs(df, output_dir, bldg_name, top_n=None, fast=False):
+    import pandas as pd
+    from .columnar import split_by_tag_category, tag_counts_frame
+    if not isinstance(df, pd.DataFrame):
+        df = tag_counts_frame(df)
     plot_dir = os.path.join(output_dir, 'plots')
-    if not os.path.isdir(plot_dir):
-        os.makedirs(plot_dir)
-    types = np.unique(np.array(df['tag_category']))
-    for t in types:
-        df2 = df.loc[df['tag_category'] == t]
-        p = ggplot(data=df2, mapping=aes(x='tag', y='count', fill='entity_type')) + \
+    jobs = []
+    for t, df2 in split_by_tag_category(df):
+        df2, n_tags = top_tags(df2, top_n)
+        title = "Building: " + bldg_name + "\nTag Type: " + t
+        if top_n is not None and n_tags > top_n:
+            title += " (top {} of {} tags)".format(top_n, n_tags)
+        f_name = os.path.join(plot_dir, bldg_name + "_" + t + '.png')
+        jobs.append(PlotJob(bldg_name, t, df2, f_name, title, fast))
+    return jobs
+
+
+def _load_hashes(plot_dir):
+    try:
+        with open(os.path.join(plot_dir, HASHES_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hashes(plot_dir, hashes):
+    f_name = os.path.join(plot_dir, HASHES_FILE)
+    with open(f_name + '.tmp', 'w') as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    os.replace(f_name + '.tmp', f_name)
+
+
+# The jobs whose png is missing or was rendered from different input
+def stale_jobs(jobs, force=False):
+    if force:
+        return list(jobs)
+    hashes = {}
+    stale = []
+    for job in jobs:
+        plot_dir = os.path.dirname(job.f_name)
+        if plot_dir not in hashes:
+            hashes[plot_dir] = _load_hashes(plot_dir)
+        if not os.path.isfile(job.f_name) or \
+                hashes[plot_dir].get(os.path.basename(job.f_name)) != job.digest:
+            stale.append(job)
+    return stale
+
+
+# Render one plot: a plotnine bar chart faceted by entity type at 12x12 in
+# and 200 dpi, or with job.fast a matplotlib chart sized to the number of
+# tags at 100 dpi, which is much quicker for categories with hundreds of
+# tags
+def render_plot(job):
+    os.makedirs(os.path.dirname(job.f_name), exist_ok=True)
+    if job.fast:
+        _render_fast(job)
+    else:
+        from plotnine import aes, coord_flip, facet_grid, geom_bar, ggplot, labs
+        p = ggplot(data=job.data, mapping=aes(x='tag', y='count', fill='entity_type')) + \
             geom_bar(stat='identity') + \
             facet_grid('~entity_type', scales='free') + \
-            labs(title="Building: " + bldg_name + "\nTag Type: " + t) + \
+            labs(title=job.title) + \
             coord_flip()
-        f_name = os.path.join(plot_dir, bldg_name + "_" + t + '.png')
-        ggplot.save(p, f_name, width=12, height=12, units='in', dpi=200)
+        ggplot.save(p, job.f_name, width=12, height=12, units='in', dpi=200)
             # geom_text(label='stat(count)') + \
+    return job.f_name
+
+
+def _render_fast(job):
+    # The object oriented API with an Agg canvas: no pyplot state, so it is
+    # safe in worker processes and needs no display
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    by_type = {}
+    for entity_type, tag, count in job.rows():
+        by_type.setdefault(entity_type, ([], []))
+        by_type[entity_type][0].append(tag)
+        by_type[entity_type][1].append(count)
+    n_tags = max(len(tags) for tags, _ in by_type.values())
+    fig = Figure(figsize=(min(4 * len(by_type), 24), max(4, 0.16 * n_tags + 1)))
+    FigureCanvasAgg(fig)
+    for i, (entity_type, (tags, counts)) in enumerate(by_type.items()):
+        ax = fig.add_subplot(1, len(by_type), i + 1)
+        ax.barh(range(len(tags)), counts)
+        ax.set_yticks(range(len(tags)))
+        ax.set_yticklabels(tags, fontsize=6)
+        ax.set_title(entity_type)
+    fig.suptitle(job.title)
+    fig.savefig(job.f_name, dpi=100)
+
+
+# Render the stale jobs (all of them with force), in a pool of workers
+# processes when given and there is more than one to render, recording the
+# digest of each rendered plot.  Returns the file names rendered.
+def render_plots(jobs, workers=None, force=False):
+    stale = stale_jobs(jobs, force)
+    hashes = {}
+    for job in stale:
+        plot_dir = os.path.dirname(job.f_name)
+        os.makedirs(plot_dir, exist_ok=True)
+        if plot_dir not in hashes:
+            hashes[plot_dir] = _load_hashes(plot_dir)
+    rendered = []
+    try:
+        if workers is not None and workers > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+                for job, f_name in zip(stale, pool.map(render_plot, stale)):
+                    hashes[os.path.dirname(f_name)][os.path.basename(f_name)] = job.digest
+                    rendered.append(f_name)
+        else:
+            for job in stale:
+                f_name = render_plot(job)
+                hashes[os.path.dirname(f_name)][os.path.basename(f_name)] = job.digest
+                rendered.append(f_name)
+    finally:
+        for plot_dir, plot_hashes in hashes.items():
+            _save_hashes(plot_dir, plot_hashes)
+    return rendered
+
+
+# Given the tag counts of a report, create a plot for each of the
+# tag-categories, showing breakout of tags by entity types.  df may be the
+# report from ph_typer_many itself, a frame from tag_counts_frame, or a
+# dataframe of the csv report produced by the reporter.  Plots whose input
+# did not change since they were last rendered are skipped unless force;
+# see plot_jobs and render_plots for the other options.  Returns the file
+# names rendered.
+def plot1(df, output_dir, bldg_name, workers=None, force=False, top_n=None, fast=False):
+    return render_plots(plot_jobs(df, output_dir, bldg_name, top_n, fast), workers, force)
+
+
+# plot1 for many buildings at once, with the plots of every building
+# rendered in one pool.  reports maps building names to anything plot1
+# accepts; each building's plots go to <output_root>/<bldg_name>/plots.
+def plot_portfolio(reports, output_root, workers=None, force=False, top_n=None, fast=False):
+    jobs = []
+    for bldg_name, df in reports.items():
+        jobs.extend(plot_jobs(df, os.path.join(output_root, bldg_name), bldg_name, top_n, fast))
+    return render_plots(jobs, workers, force)
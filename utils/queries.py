@@ -1,5 +1,10 @@
 import os
-from rdflib import Namespace, Graph, RDFS, RDF, OWL
+import weakref
+from collections import OrderedDict
+from rdflib import Namespace, Graph, Literal, URIRef, RDFS, RDF, OWL
+from rdflib.plugins.sparql import prepareQuery
+from .metrics import count as _count, timed as _timed
+from .resources import RESOURCES_DIR, HAYSTACK_DEFS, BRICK_DEFS
 
 # Define namespaces for Project Haystack
 PH = Namespace("https://project-haystack.org/def/ph/3.9.7#")
@@ -7,8 +12,10 @@ PHICT = Namespace("https://project-haystack.org/def/phIct/3.9.7#")
 PHSCIENCE = Namespace("https://project-haystack.org/def/phScience/3.9.7#")
 PHIOT = Namespace("https://project-haystack.org/def/phIoT/3.9.7#")
 
-# Location to Haystack RDFs
-HAYSTACK_DEFS = os.path.join(os.getcwd(), "resources/defs.ttl")
+# Define namespaces for Brick (classes / tagsets) and BrickFrame (relationships)
+BRICK = Namespace("https://brickschema.org/schema/1.0.3/Brick#")
+BF = Namespace("https://brickschema.org/schema/1.0.3/BrickFrame#")
+
 
 
 # Initialize and return a Haystack graph with the correct namespaces
@@ -19,19 +26,145 @@ def init_haystack_graph(path=HAYSTACK_DEFS):
     g.bind("phict", PHICT)
     g.bind("phscience", PHSCIENCE)
     g.bind("phiot", PHIOT)
-    g.parse(path, format="ttl")
+    _parse(g, path)
     return g
 
 
-# Run the given query on the graph (given the path to the graph),
-# returning as a list
-def query_return_list(path, q):
-    g = init_haystack_graph(path)
-    match = g.query(q)
-    m2 = []
-    for m in match:
-        m2.append(str(m[0]).split("#")[1])
-    return m2
+def _parse(g, path):
+    with _timed('ontology_parse'):
+        g.parse(path, format="ttl")
+    _count('graphs_parsed')
+
+
+# Prefixes usable in every query, on top of those bound in the graph
+QUERY_NAMESPACES = {
+    'rdf': RDF,
+    'rdfs': RDFS,
+    'owl': OWL,
+    'ph': PH,
+    'phIct': PHICT,
+    'phScience': PHSCIENCE,
+    'phIoT': PHIOT,
+    'brick': BRICK,
+    'bf': BF,
+}
+
+# Parsed and translated queries, keyed by (query, namespaces).  Preparing
+# does not depend on the graph, so prepared queries are shared by all graphs.
+_PREPARED = OrderedDict()
+PREPARED_CACHE_SIZE = 256
+
+
+def prepare_query(q, namespaces=None):
+    namespaces = namespaces if namespaces is not None else QUERY_NAMESPACES
+    key = (q, tuple(sorted((k, str(v)) for k, v in namespaces.items())))
+    prepared = _PREPARED.get(key)
+    if prepared is None:
+        _count('queries_prepared')
+        prepared = _PREPARED[key] = prepareQuery(q, initNs=namespaces)
+        while len(_PREPARED) > PREPARED_CACHE_SIZE:
+            _PREPARED.popitem(last=False)
+    else:
+        _PREPARED.move_to_end(key)
+    return prepared
+
+
+# The query layer of one loaded graph.  Queries are prepared once, values
+# are bound as parameters (bindings, e.g. {'parent': PHIOT['equip']}) rather
+# than formatted into the query text, and results are memoized per
+# (query, bindings), evicting the least recently used beyond maxsize.  The
+# graph is assumed not to change; call clear() if it does.
+class QueryCache(object):
+    def __init__(self, graph, maxsize=1024):
+        self.graph = graph
+        self.maxsize = maxsize
+        self.namespaces = {k: v for k, v in graph.namespaces() if k}
+        self.namespaces.update(QUERY_NAMESPACES)
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    # Run the query without memoizing, returning the rows as tuples
+    def execute(self, q, bindings=None):
+        _count('sparql_queries')
+        prepared = prepare_query(q, self.namespaces)
+        return [tuple(row) for row in self.graph.query(prepared, initBindings=bindings or {})]
+
+    # The memoized rows of the query; the returned tuple is shared, so it
+    # is never modified
+    def query(self, q, bindings=None):
+        key = (q, tuple(sorted((bindings or {}).items())))
+        rows = self._results.get(key)
+        if rows is not None:
+            self.hits += 1
+            _count('query_cache_hits')
+            self._results.move_to_end(key)
+            return rows
+        self.misses += 1
+        _count('query_cache_misses')
+        rows = self._results[key] = tuple(self.execute(q, bindings))
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+        return rows
+
+    # The first column of the query, with the URI's removed, as
+    # query_return_list returns it
+    def names(self, q, bindings=None):
+        return [str(row[0]).split("#")[1] for row in self.query(q, bindings)]
+
+    def clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+        }
+
+
+# QueryCaches of the graphs queried so far, dropped with their graph
+_GRAPH_QUERIES = weakref.WeakKeyDictionary()
+# Graphs loaded from a ttl path, keyed by (path, modification time), so
+# that querying by path parses each file once
+_PATH_GRAPHS = {}
+
+
+# Return the QueryCache of a graph, or of the graph parsed from a ttl path
+# (with init, loaded once per version of the file)
+def query_cache(path=HAYSTACK_DEFS, init=None):
+    if isinstance(path, Graph):
+        g = path
+    else:
+        key = (os.path.abspath(path), os.path.getmtime(path))
+        g = _PATH_GRAPHS.get(key)
+        if g is None:
+            for k in [k for k in _PATH_GRAPHS if k[0] == key[0]]:
+                del _PATH_GRAPHS[k]
+            g = _PATH_GRAPHS[key] = (init or init_haystack_graph)(path)
+    queries = _GRAPH_QUERIES.get(g)
+    if queries is None:
+        queries = _GRAPH_QUERIES[g] = QueryCache(g)
+    return queries
+
+
+# Run a SPARQL query on a loaded graph (counted in the active metrics),
+# through its prepared queries.  Returns the rows as tuples.
+def run_query(g, q, bindings=None):
+    return query_cache(g).execute(q, bindings)
+
+
+# Run the given query on the graph (given the path to the graph, or
+# an already loaded Graph), returning the first column as a list.  Both
+# the parsed graph and the results are cached, see QueryCache.
+def query_return_list(path, q, bindings=None):
+    return query_cache(path).names(q, bindings)
 
 
 # Query the ttl file to find all ph:marker objects
@@ -94,11 +227,13 @@ def ph_load_pointFunctionTypes(path=HAYSTACK_DEFS):
     return query_return_list(path, q)
 
 
+# Direct subclasses of the phIoT def cl.  The def is bound as a parameter,
+# so the query is prepared once for every cl.
 def ph_subclass_of_phiot(cl, path=HAYSTACK_DEFS):
     q = """SELECT ?e WHERE {
-        ?e rdfs:subClassOf phIoT:%s
-    }""" % cl
-    return query_return_list(path, q)
+        ?e rdfs:subClassOf ?parent
+    }"""
+    return query_return_list(path, q, {'parent': PHIOT[cl]})
 
 def ph_load_all_phenomenon(path=HAYSTACK_DEFS):
     q = """SELECT ?phenom WHERE {
@@ -129,3 +264,87 @@ def ph_load_all_vals(path=HAYSTACK_DEFS):
         ?q ph:is* ph:val
     }"""
     return query_return_list(path, q)
+
+
+# Resolve a def name (its rdfs:label, e.g. 'ahu' or 'tagOn') to its URI, or
+# None if the defs do not define it
+def ph_def_uri(name, path=HAYSTACK_DEFS):
+    q = """SELECT ?d WHERE {
+        ?d rdfs:label ?label
+    }"""
+    uris = sorted(str(row[0]) for row in query_cache(path).query(q, {'label': Literal(name)}))
+    return URIRef(uris[0]) if uris else None
+
+
+# Defs which are tags on the given def (ph:tagOn), e.g. the tags of 'ahu'
+def ph_tags_on(name, path=HAYSTACK_DEFS):
+    q = """SELECT ?tag WHERE {
+        ?tag ph:tagOn ?def
+    }"""
+    uri = ph_def_uri(name, path)
+    return query_return_list(path, q, {'def': uri}) if uri is not None else []
+
+
+# Every def the given def is (ph:is, transitively), e.g. 'ahu' is an
+# airHandlingEquip, an equip, ...
+def ph_is_chain(name, path=HAYSTACK_DEFS):
+    q = """SELECT DISTINCT ?super WHERE {
+        ?def ph:is+ ?super
+    }"""
+    uri = ph_def_uri(name, path)
+    return query_return_list(path, q, {'def': uri}) if uri is not None else []
+
+
+# Load every direct rdfs:subClassOf edge in the defs as [child, parent]
+# pairs, removing the URI's
+def ph_load_subclass_edges(path=HAYSTACK_DEFS):
+    q = """SELECT ?child ?parent WHERE {
+        ?child rdfs:subClassOf ?parent
+    }"""
+    edges = []
+    for m in query_cache(path).query(q):
+        edges.append([str(m[0]).split("#")[1], str(m[1]).split("#")[1]])
+    return edges
+
+
+# Initialize and return a Brick graph with the correct namespaces
+# and the parsed ttl file already loaded
+def init_brick_graph(path=BRICK_DEFS):
+    g = Graph()
+    g.bind("brick", BRICK)
+    g.bind("bf", BF)
+    _parse(g, path)
+    return g
+
+
+# Load every Brick class (tagset), removing the URI's
+def brick_load_classes(path=BRICK_DEFS):
+    q = """SELECT DISTINCT ?c WHERE {
+        ?c a owl:Class .
+        FILTER(STRSTARTS(STR(?c), "%s"))
+    }""" % str(BRICK)
+    return query_cache(path, init_brick_graph).names(q)
+
+
+# Load every direct rdfs:subClassOf edge between Brick classes as
+# [child, parent] pairs, removing the URI's
+def brick_load_subclass_edges(path=BRICK_DEFS):
+    q = """SELECT ?child ?parent WHERE {
+        ?child rdfs:subClassOf ?parent .
+        FILTER(STRSTARTS(STR(?child), "%s") && STRSTARTS(STR(?parent), "%s"))
+    }""" % (str(BRICK), str(BRICK))
+    edges = []
+    for m in query_cache(path, init_brick_graph).query(q):
+        edges.append([str(m[0]).split("#")[1], str(m[1]).split("#")[1]])
+    return edges
+
+
+# Load every owl:equivalentClass pair of Brick classes, removing the URI's
+def brick_load_equivalent_classes(path=BRICK_DEFS):
+    q = """SELECT ?a ?b WHERE {
+        ?a owl:equivalentClass ?b .
+    }"""
+    pairs = []
+    for m in query_cache(path, init_brick_graph).query(q):
+        pairs.append([str(m[0]).split("#")[1], str(m[1]).split("#")[1]])
+    return pairs
@@ -0,0 +1,180 @@
+from collections import deque
+import numpy as np
+
+# Ref tags which do not follow the *Ref naming convention
+EXTRA_REF_TAGS = ('submeterOf', 'equipParent')
+
+
+# True if the tag holds a reference to another entity
+def is_ref_tag(tag):
+    return tag.endswith('Ref') or tag in EXTRA_REF_TAGS
+
+
+# Normalize an id or ref value to the bare id, so that ids and refs written
+# as '@id', 'r:id' or with a trailing display name ('r:id Dis') compare equal
+def ref_id(value):
+    if not isinstance(value, str):
+        return None
+    if value.startswith('r:'):
+        value = value[2:]
+    elif value.startswith('@'):
+        value = value[1:]
+    return value.split(' ', 1)[0] or None
+
+
+# Compressed sparse row adjacency: the neighbours of node i are
+# targets[offsets[i]:offsets[i + 1]], via the ref tags in tags (same slice)
+class _CSR(object):
+    def __init__(self, n_nodes, sources, targets, tags):
+        order = np.argsort(sources, kind='stable')
+        self.targets = targets[order]
+        self.tags = tags[order]
+        self.offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=self.offsets[1:])
+
+    def neighbours(self, i, tag_codes=None):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        targets = self.targets[start:end]
+        if tag_codes is not None:
+            targets = targets[np.isin(self.tags[start:end], tag_codes)]
+        return targets
+
+
+# Index of the references between the entities of a building, built in one
+# pass over their ref tags (every *Ref tag, plus submeterOf / equipParent).
+# Entities are numbered by position, and the edges stored as CSR adjacency
+# in both directions, so that the entities referenced by an entity (its
+# site, equip, ...) and the entities referencing it (an equip's points, a
+# site's equips, a meter's submeters) are index lookups.  References to ids
+# which are not in the building are kept in dangling.
+class RefGraph(object):
+    def __init__(self, entities):
+        self.entities = list(entities)
+        self.positions = {}
+        for i, e in enumerate(self.entities):
+            entity_id = ref_id(e.get('id'))
+            if entity_id is not None:
+                self.positions.setdefault(entity_id, i)
+
+        self.tags = []
+        tag_codes = {}
+        sources, targets, tags = [], [], []
+        self.dangling = []
+        for i, e in enumerate(self.entities):
+            for tag, value in e.items():
+                if not is_ref_tag(tag):
+                    continue
+                code = tag_codes.get(tag)
+                if code is None:
+                    code = tag_codes[tag] = len(self.tags)
+                    self.tags.append(tag)
+                # Haystack 4 allows a list of refs
+                for v in (value if isinstance(value, list) else [value]):
+                    target = self.positions.get(ref_id(v))
+                    if target is None:
+                        self.dangling.append((e.get('id'), tag, v))
+                        continue
+                    sources.append(i)
+                    targets.append(target)
+                    tags.append(code)
+        self.tag_codes = tag_codes
+
+        n = len(self.entities)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        tags = np.asarray(tags, dtype=np.int64)
+        self.forward = _CSR(n, sources, targets, tags)
+        self.reverse = _CSR(n, targets, sources, tags)
+
+    def __len__(self):
+        return len(self.entities)
+
+    # Number of resolved references
+    @property
+    def n_edges(self):
+        return len(self.forward.targets)
+
+    # Position of an entity, given the entity itself or its id
+    def position(self, entity):
+        entity_id = ref_id(entity.get('id')) if hasattr(entity, 'get') else ref_id(entity)
+        i = self.positions.get(entity_id)
+        if i is None:
+            raise KeyError(entity_id)
+        return i
+
+    def _codes(self, tags):
+        if tags is None:
+            return None
+        if isinstance(tags, str):
+            tags = [tags]
+        return [self.tag_codes[t] for t in tags if t in self.tag_codes]
+
+    def _entities(self, positions):
+        return [self.entities[i] for i in positions]
+
+    # Entities the entity references, optionally only through the given tag(s)
+    def refs(self, entity, tags=None):
+        return self._entities(self.forward.neighbours(self.position(entity), self._codes(tags)))
+
+    # Entities referencing the entity, optionally only through the given tag(s)
+    def referrers(self, entity, tags=None):
+        return self._entities(self.reverse.neighbours(self.position(entity), self._codes(tags)))
+
+    # Positions of the entities referencing any of the entities at the given
+    # positions through tag, gathered from all their CSR slices at once
+    def referrer_positions(self, positions, tag):
+        code = self.tag_codes.get(tag)
+        if code is None or not positions:
+            return set()
+        csr = self.reverse
+        nodes = np.fromiter(positions, dtype=np.int64, count=len(positions))
+        starts = csr.offsets[nodes]
+        lengths = csr.offsets[nodes + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return set()
+        edges = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+        edges = edges[csr.tags[edges] == code]
+        return set(csr.targets[edges].tolist())
+
+    # Breadth first traversal from the entity along the given ref tag(s),
+    # following references (or, with reverse=True, referrers) up to max_depth
+    # hops.  Yields (entity, depth) once per reachable entity, so cycles in
+    # the references terminate.
+    def traverse(self, entity, tags=None, reverse=False, max_depth=None):
+        csr = self.reverse if reverse else self.forward
+        codes = self._codes(tags)
+        start = self.position(entity)
+        seen = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            i, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for j in csr.neighbours(i, codes).tolist():
+                if j not in seen:
+                    seen.add(j)
+                    queue.append((j, depth + 1))
+                    yield self.entities[j], depth + 1
+
+    # Points of an equip
+    def equip_points(self, equip):
+        return [e for e in self.referrers(equip, 'equipRef') if 'point' in e]
+
+    # Equips of a site
+    def site_equips(self, site):
+        return [e for e in self.referrers(site, 'siteRef') if 'equip' in e]
+
+    # Submeter tree of a meter, as nested dicts of id -> submeters
+    def submeter_tree(self, meter):
+        i = self.position(meter)
+        return self._submeter_tree(i, {i})
+
+    def _submeter_tree(self, i, seen):
+        tree = {}
+        for j in self.reverse.neighbours(i, self._codes('submeterOf')).tolist():
+            if j in seen:
+                continue
+            seen.add(j)
+            tree[self.entities[j].get('id')] = self._submeter_tree(j, seen)
+        return tree
@@ -0,0 +1,8 @@
+import os
+
+# Location to Haystack RDFs, resolved relative to this repo rather than
+# the current working directory.  Kept apart from utils/queries.py so that
+# the paths can be used without importing rdflib.
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+HAYSTACK_DEFS = os.path.join(RESOURCES_DIR, "defs.ttl")
+BRICK_DEFS = os.path.join(RESOURCES_DIR, "Brick.ttl")
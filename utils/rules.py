@@ -0,0 +1,156 @@
+from .filters import compile_filter
+from .index import TagIndex
+from .refs import ref_id
+
+# Declarative retagging.  A rules file holds one rule per line:
+#     if equip and navName contains fcu then add fcu
+#     if sensor and cmd then remove sensor
+#     if sensor or cmd or sp then add point, add his
+# The condition is a Haystack filter (see utils/filters.py), the actions a
+# comma separated list of 'add <marker>' / 'remove <tag>'.  Blank lines and
+# lines starting with # are ignored.
+#
+# apply_rules makes a single pass over the building: every entity goes
+# through the rules in file order, so each rule sees the entity as left by
+# the rules above it, exactly as if the rules had been run one after the
+# other over the whole building.  Conditions with ref paths (equipRef->ahu)
+# see the referenced entity as it is at that point of the pass.
+
+ACTIONS = ('add', 'remove')
+
+
+class Rule(object):
+    def __init__(self, condition, actions, text=None):
+        self.condition = condition
+        self.filter = compile_filter(condition)
+        self.actions = actions
+        self.text = text or "if {} then {}".format(condition, ', '.join(' '.join(a) for a in actions))
+
+    def __repr__(self):
+        return "Rule({!r})".format(self.text)
+
+    def matches(self, entity, lookup=None):
+        return self.filter.matches(entity, lookup)
+
+    # Apply the actions to the entity, returning the (action, tag) pairs
+    # which changed it
+    def apply(self, entity):
+        changes = []
+        for action, tag in self.actions:
+            if action == 'add':
+                if entity.get(tag) != "m:":
+                    entity[tag] = "m:"
+                    changes.append((action, tag))
+            elif tag in entity:
+                del entity[tag]
+                changes.append((action, tag))
+        return changes
+
+
+# Parse one 'if <filter> then <actions>' rule
+def parse_rule(text):
+    text = text.strip()
+    if not text.startswith('if ') or ' then ' not in text:
+        raise ValueError("Invalid rule {!r}: expected 'if <filter> then <actions>'".format(text))
+    condition, _, actions_text = text[3:].rpartition(' then ')
+    actions = []
+    for a in actions_text.split(','):
+        parts = a.split()
+        if len(parts) != 2 or parts[0] not in ACTIONS:
+            raise ValueError("Invalid rule {!r}: unknown action {!r}, expected one of {}".format(
+                text, a.strip(), ', '.join('{} <tag>'.format(i) for i in ACTIONS)))
+        actions.append((parts[0], parts[1]))
+    try:
+        return Rule(condition.strip(), actions, text)
+    except ValueError as e:
+        raise ValueError("Invalid rule {!r}: {}".format(text, e))
+
+
+def parse_rules(text):
+    rules = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            rules.append(parse_rule(line))
+    return rules
+
+
+def load_rules(file):
+    with open(file, 'r') as f:
+        return parse_rules(f.read())
+
+
+# Apply the rules (Rules, rule strings or a rules file name) to every entity
+# in one pass.  entities may be a list of entity dicts / Entities, a
+# Building or a TagIndex, whose postings are kept up to date.  With dry_run
+# the entities are left untouched and only the counts are computed (on
+# copies of the entities).
+# Returns {'entities', 'changed', 'rules': [...]} with, for each rule, the
+# number of entities matching it when it was applied ('before'), changed by
+# it ('changed') and still matching its condition once the entity went
+# through every rule ('after'), e.g. 0 after 'if sensor and cmd then
+# remove sensor'.
+def apply_rules(entities, rules, dry_run=False):
+    if isinstance(rules, str):
+        rules = load_rules(rules)
+    rules = [parse_rule(r) if isinstance(r, str) else r for r in rules]
+    index = entities if isinstance(entities, TagIndex) else None
+    entities = index.entities if index is not None else entities
+
+    lookup = None
+    if any(len(p) > 1 for r in rules for p in _paths(r.filter)):
+        by_id = {ref_id(e.get('id')): e for e in entities}
+        lookup = by_id.get
+
+    counts = [{'rule': r.text, 'before': 0, 'changed': 0, 'after': 0} for r in rules]
+    n = changed = 0
+    for e in entities:
+        n += 1
+        target = dict(e) if dry_run else e
+        entity_changed = False
+        matched = []
+        for rule, c in zip(rules, counts):
+            if not rule.matches(target, lookup):
+                continue
+            matched.append(c)
+            c['before'] += 1
+            changes = rule.apply(target)
+            if changes:
+                c['changed'] += 1
+                entity_changed = True
+                if index is not None and not dry_run:
+                    for action, tag in changes:
+                        if action == 'add':
+                            index.add_marker([e], tag)
+                        else:
+                            index.remove_tag([e], tag)
+        # An entity no rule changed still matches exactly the rules it
+        # matched (unless conditions look at other entities)
+        if entity_changed or lookup is not None:
+            for rule, c in zip(rules, counts):
+                if rule.matches(target, lookup):
+                    c['after'] += 1
+        else:
+            for c in matched:
+                c['after'] += 1
+        changed += entity_changed
+    return {'entities': n, 'changed': changed, 'rules': counts}
+
+
+# The tag paths used by a compiled filter
+def _paths(node):
+    if hasattr(node, 'clauses'):
+        for c in node.clauses:
+            yield from _paths(c)
+    elif hasattr(node, 'has'):
+        yield node.has.path
+    else:
+        yield node.path
+
+
+# Lines of 'before / changed / after' counts per rule, for printing
+def format_rule_counts(results):
+    lines = ["{}\tbefore: {}\tchanged: {}\tafter: {}".format(c['rule'], c['before'], c['changed'], c['after'])
+             for c in results['rules']]
+    lines.append("Entities: {}\tchanged: {}".format(results['entities'], results['changed']))
+    return lines
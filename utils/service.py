@@ -0,0 +1,347 @@
+import asyncio
+import http.client
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .defs import get_default_defs
+from .utils import TypingCache, cleanup_marker_tags, ph_typer_many
+
+# A long running local typing service.  The ontology is loaded once and the
+# TypingCache stays warm across requests, so tools which type a handful of
+# entities many times a minute do not pay the startup cost on every run.
+#
+# HTTP/1.1 with JSON bodies, on localhost or a Unix socket:
+#     POST /type    {"rows": [...], "cleanup": true}  (a Haystack JSON grid,
+#                   i.e. with "meta" / "cols", is accepted as is) returns the
+#                   ph_typer_many report of the rows: {"entities", "general"}.
+#                   "cleanup" fixes "M" markers as cleanup_marker_tags does.
+#     GET /health   {"status": "ok"}
+#     GET /stats    request, batch and typing cache counters
+#
+# Connections are handled concurrently by asyncio.  Typing itself runs on a
+# single worker thread (so the event loop stays responsive and the cache is
+# never shared between threads), and the requests which arrive while it is
+# busy, or within batch_delay of each other, are typed together as one batch
+# (up to max_batch rows).
+
+MAX_BODY = 256 * 1024 * 1024
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class TypingService(object):
+    def __init__(self, defs=None, cache=None, max_batch=50000, batch_delay=0.002, max_body=MAX_BODY):
+        self.defs = defs if defs is not None else get_default_defs()
+        self.cache = cache if cache is not None else TypingCache()
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.max_body = max_body
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self._queue = None
+        self._batcher = None
+        self._executor = None
+        self._server = None
+
+    # Load everything typing needs now rather than on the first request
+    def warm(self):
+        self.defs.all_markers
+        self.defs.all_vals
+        self.defs.fc_entities
+        self.defs.equip_index
+        self.defs.taxonomy
+        ph_typer_many([{'id': '@warm', 'point': 'm:'}], defs=self.defs, cache=self.cache)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'rows': self.rows,
+            'cache': self.cache.stats(),
+        }
+
+    # Start listening on host:port (port 0 picks a free port) or on the
+    # Unix socket path.  Returns the address listened on.
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        self.warm()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='typing')
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+            return path
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def serve_forever(self, host='127.0.0.1', port=8765, path=None):
+        address = await self.start(host, port, path)
+        print("Typing service listening on {}".format(address if path else 'http://{}:{}'.format(*address)))
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    # Queue rows for typing, returning their report once their batch is done
+    async def type_rows(self, rows, cleanup=False):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, cleanup, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.batch_delay
+            while n_rows < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else \
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+            try:
+                reports = await loop.run_in_executor(self._executor, self._type_batch, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += n_rows
+            for (_, _, future), report in zip(batch, reports):
+                if not future.done():
+                    future.set_result(report)
+
+    # Runs on the typing thread: one report per request of the batch, all
+    # typed through the shared cache
+    def _type_batch(self, batch):
+        reports = []
+        for rows, cleanup, _ in batch:
+            if cleanup:
+                rows = cleanup_marker_tags(rows)
+            reports.append(ph_typer_many(rows, defs=self.defs, cache=self.cache))
+        return reports
+
+    async def _route(self, method, target, body):
+        path = target.split('?', 1)[0]
+        if path == '/health':
+            if method != 'GET':
+                raise HttpError(405, "Use GET for /health")
+            return {'status': 'ok'}
+        if path == '/stats':
+            if method != 'GET':
+                raise HttpError(405, "Use GET for /stats")
+            return self.stats()
+        if path == '/type':
+            if method != 'POST':
+                raise HttpError(405, "Use POST for /type")
+            rows, cleanup = _parse_type_request(body)
+            self.requests += 1
+            return await self.type_rows(rows, cleanup)
+        raise HttpError(404, "Unknown path {}".format(path))
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader, self.max_body)
+                if request is None:
+                    break
+                method, target, headers, body, error = request
+                try:
+                    if error is not None:
+                        raise error
+                    status, payload = 200, await self._route(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+                keep_alive = error is None and headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _parse_type_request(body):
+    try:
+        data = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HttpError(400, "Invalid JSON: {}".format(e))
+    if isinstance(data, list):
+        data = {'rows': data}
+    if not isinstance(data, dict) or not isinstance(data.get('rows'), list):
+        raise HttpError(400, "Expected {\"rows\": [...]}")
+    if not all(isinstance(r, dict) for r in data['rows']):
+        raise HttpError(400, "Every row must be an object")
+    return data['rows'], bool(data.get('cleanup', False))
+
+
+# Read one HTTP request: (method, target, headers, body, error), or None once
+# the client closed the connection
+async def _read_request(reader, max_body):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        return ('', '', {}, b'', HttpError(400, "Invalid request line"))
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        return (method, target, headers, b'', HttpError(400, "Invalid Content-Length"))
+    if length > max_body:
+        return (method, target, headers, b'', HttpError(413, "Body over {} bytes".format(max_body)))
+    body = await reader.readexactly(length) if length else b''
+    return (method, target, headers, body, None)
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status, _REASONS.get(status, ''), len(body), 'keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + body)
+
+
+# Run a TypingService on its own event loop in a background thread, e.g. to
+# embed it in another process or in tests:
+#     with BackgroundService() as service:
+#         ServiceClient(*service.address).type_rows(rows)
+class BackgroundService(object):
+    def __init__(self, service=None, host='127.0.0.1', port=0, path=None):
+        self.service = service if service is not None else TypingService()
+        self.host = host
+        self.port = port
+        self.path = path
+        self.address = None
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        failure = []
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self.address = self._loop.run_until_complete(self.service.start(self.host, self.port, self.path))
+            except Exception as e:
+                failure.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='typing-service', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.service.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+# Client of a TypingService, over TCP (host, port) or a Unix socket (path).
+# The connection is kept alive between calls.
+class ServiceClient(object):
+    def __init__(self, host='127.0.0.1', port=8765, path=None, timeout=60):
+        if path is not None:
+            self.connection = _UnixHTTPConnection(path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, url, payload=None):
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        self.connection.request(method, url, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = json.loads(response.read().decode('utf-8'))
+        if response.status != 200:
+            raise ValueError("Typing service error {}: {}".format(response.status, data.get('error')))
+        return data
+
+    # The ph_typer_many report of the rows
+    def type_rows(self, rows, cleanup=False):
+        return self._request('POST', '/type', {'rows': list(rows), 'cleanup': cleanup})
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
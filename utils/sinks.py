@@ -0,0 +1,210 @@
+import json
+import os
+from .stream import stream_report
+from .utils import ReportSummary, write_tag_counts_csv
+
+# Output sinks for typed reports.  A sink receives the typed entities one at
+# a time (write_entity, e.g. as the on_entity callback of ph_typer_many) and
+# the general section once at the end (write_general), so reports can be
+# written while typing progresses without holding them in memory.
+#   pretty: report_<name>.json, byte for byte the json.dump(report,
+#           sort_keys=True, indent=2) the reporter has always written
+#   jsonl:  report_<name>.jsonl, one compact JSON entity per line
+#   binary: report_<name>.bgr, see BinarySink
+# jsonl and binary write the general section to report_<name>.general.json.
+
+
+def site_output_dir(output_root, bldg_name):
+    if output_root is None:
+        output_root = os.path.join(os.getcwd(), 'output')
+    output_dir = os.path.join(output_root, bldg_name)
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+
+class _Sink(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # Sinks are callables, so they can be passed as on_entity directly
+    def __call__(self, typed):
+        self.write_entity(typed)
+
+
+class PrettyJsonSink(_Sink):
+    def __init__(self, output_dir, bldg_name):
+        self.path = os.path.join(output_dir, 'report_{}.json'.format(bldg_name))
+        self.f = open(self.path, 'w')
+        self.f.write('{\n  "entities": [')
+        self.n = 0
+        self.general = {}
+
+    def write_entity(self, typed):
+        text = json.dumps(typed, sort_keys=True, indent=2).replace('\n', '\n    ')
+        self.f.write((',\n    ' if self.n else '\n    ') + text)
+        self.n += 1
+
+    def write_general(self, general):
+        self.general = general
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.write('\n  ],\n' if self.n else '],\n')
+        self.f.write('  "general": ' + json.dumps(self.general, sort_keys=True, indent=2).replace('\n', '\n  '))
+        self.f.write('\n}')
+        self.f.close()
+
+
+def _write_general(output_dir, bldg_name, general):
+    with open(os.path.join(output_dir, 'report_{}.general.json'.format(bldg_name)), 'w') as f:
+        json.dump(general, f, sort_keys=True)
+
+
+class JsonLinesSink(_Sink):
+    def __init__(self, output_dir, bldg_name):
+        self.output_dir = output_dir
+        self.bldg_name = bldg_name
+        self.path = os.path.join(output_dir, 'report_{}.jsonl'.format(bldg_name))
+        self.f = open(self.path, 'w')
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def write_entity(self, typed):
+        self.f.write(self.encode(typed) + '\n')
+
+    def write_general(self, general):
+        _write_general(self.output_dir, self.bldg_name, general)
+
+    def close(self):
+        self.f.close()
+
+
+# Read the typed entities back from a report_<name>.jsonl
+def read_jsonl_report(path):
+    with open(path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+BINARY_MAGIC = b'BGREPORT1\n'
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+
+# Compact binary encoding.  Entities sharing a tag signature type the same
+# apart from their id, so each distinct result (without id) is written once
+# as a template frame and every entity as a frame holding only its template
+# number and id:
+#     b'T' varint(length) <compact JSON of the result without id>
+#     b'E' varint(length) varint(template) <utf-8 id>
+#     b'N' varint(length) varint(template)      (entity without an id)
+class BinarySink(_Sink):
+    def __init__(self, output_dir, bldg_name):
+        self.output_dir = output_dir
+        self.bldg_name = bldg_name
+        self.path = os.path.join(output_dir, 'report_{}.bgr'.format(bldg_name))
+        self.f = open(self.path, 'wb')
+        self.f.write(BINARY_MAGIC)
+        self.templates = {}
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def _frame(self, kind, payload):
+        self.f.write(kind + _varint(len(payload)) + payload)
+
+    def write_entity(self, typed):
+        template = self.encode({k: v for k, v in typed.items() if k != 'id'})
+        t = self.templates.get(template)
+        if t is None:
+            t = self.templates[template] = len(self.templates)
+            self._frame(b'T', template.encode('utf-8'))
+        if 'id' in typed:
+            self._frame(b'E', _varint(t) + str(typed['id']).encode('utf-8'))
+        else:
+            self._frame(b'N', _varint(t))
+
+    def write_general(self, general):
+        _write_general(self.output_dir, self.bldg_name, general)
+
+    def close(self):
+        self.f.close()
+
+
+# Read the typed entities back from a report_<name>.bgr
+def read_binary_report(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError("{} is not a binary report".format(path))
+    templates = []
+    pos = len(BINARY_MAGIC)
+    while pos < len(data):
+        kind = data[pos:pos + 1]
+        length, pos = _read_varint(data, pos + 1)
+        payload = data[pos:pos + length]
+        pos += length
+        if kind == b'T':
+            templates.append(payload.decode('utf-8'))
+            continue
+        t, start = _read_varint(payload, 0)
+        typed = {'id': payload[start:].decode('utf-8')} if kind == b'E' else {}
+        typed.update(json.loads(templates[t]))
+        yield typed
+
+
+SINKS = {
+    'pretty': PrettyJsonSink,
+    'jsonl': JsonLinesSink,
+    'binary': BinarySink,
+}
+
+
+def open_sink(fmt, output_dir, bldg_name):
+    if fmt not in SINKS:
+        raise ValueError("Unknown report format {!r}, expected one of {}".format(fmt, sorted(SINKS)))
+    return SINKS[fmt](output_dir, bldg_name)
+
+
+# Type a Haystack JSON site file and write its report as it is typed: the
+# rows are streamed from the file and each typed entity goes straight to
+# the fmt sink, so the site is never held in memory.  Also writes
+# report_<name>.csv.  Returns (summary, general) as for reporter.
+def stream_site_report(file, bldg_name, output_root=None, fmt='jsonl', defs=None):
+    output_dir = site_output_dir(output_root, bldg_name)
+    summary = ReportSummary()
+    total = [0]
+    with open_sink(fmt, output_dir, bldg_name) as sink:
+        def on_entity(typed):
+            total[0] += 1
+            summary.add(typed)
+            sink.write_entity(typed)
+        report = stream_report(file, defs=defs, on_entity=on_entity)
+        sink.write_general(report['general'])
+    write_tag_counts_csv(os.path.join(output_dir, 'report_{}.csv'.format(bldg_name)),
+                         report['general']['count_tags_by_entity'])
+    return summary.summary(total[0]), report['general']
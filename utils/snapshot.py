@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+from .metrics import count, timed
+from .resources import BRICK_DEFS, HAYSTACK_DEFS
+
+# Bump whenever the layout of a compiled snapshot changes, so that stale
+# cache files are recompiled rather than misread
+SNAPSHOT_VERSION = 1
+
+# Environment variable which can be used to redirect where compiled
+# snapshots are stored, e.g. for read-only checkouts
+CACHE_DIR_ENV = "BUILDING_GRAPHS_CACHE"
+
+
+# Compiled snapshots live next to the ttl they were built from unless
+# overridden by the BUILDING_GRAPHS_CACHE environment variable
+def default_cache_dir(path=HAYSTACK_DEFS):
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+
+
+# Hash the contents (not the mtime) of the ttl file so that a snapshot
+# is only reused when the definitions are byte-for-byte identical
+def ttl_content_hash(path=HAYSTACK_DEFS):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Parse the defs ttl once and resolve every vocabulary list used by the
+# typing utilities.  The results are returned exactly as the individual
+# ph_load_* queries return them (root defs are not removed).  An already
+# parsed graph of the same ttl can be passed in to skip the parse.
+def compile_haystack_snapshot(path=HAYSTACK_DEFS, content_hash=None, graph=None):
+    from .queries import (init_haystack_graph, ph_load_all_entities, ph_load_all_equips, ph_load_all_markers,
+                          ph_load_all_phenomenon, ph_load_all_quantities, ph_load_all_vals, ph_load_fc_entities,
+                          ph_load_fc_equips, ph_load_fc_markers, ph_load_fc_phenomenon, ph_load_fc_quantities,
+                          ph_load_pointFunctionTypes, ph_load_subclass_edges)
+    g = graph if graph is not None else init_haystack_graph(path)
+    return {
+        'version': SNAPSHOT_VERSION,
+        'source_hash': content_hash or ttl_content_hash(path),
+        'markers': ph_load_all_markers(g),
+        'fc_markers': ph_load_fc_markers(g),
+        'vals': ph_load_all_vals(g),
+        'entities': ph_load_all_entities(g),
+        'fc_entities': ph_load_fc_entities(g),
+        'equips': ph_load_all_equips(g),
+        'fc_equips': ph_load_fc_equips(g),
+        'phenomena': ph_load_all_phenomenon(g),
+        'fc_phenomena': ph_load_fc_phenomenon(g),
+        'quantities': ph_load_all_quantities(g),
+        'fc_quantities': ph_load_fc_quantities(g),
+        'point_function_types': ph_load_pointFunctionTypes(g),
+        'subclass_edges': ph_load_subclass_edges(g),
+    }
+
+
+def snapshot_file(content_hash, cache_dir, prefix='haystack'):
+    return os.path.join(cache_dir, '{}_{}.json'.format(prefix, content_hash[:16]))
+
+
+# Read a compiled snapshot from disk, returning None if it is missing,
+# unreadable, or was produced from a different ttl / snapshot layout
+def read_snapshot(f_name, content_hash):
+    try:
+        with open(f_name, 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('source_hash') != content_hash:
+        return None
+    return snapshot
+
+
+# Write the snapshot atomically so that concurrent processes never
+# observe a partially written file.  Failure to write (e.g. read-only
+# directory) is not fatal, the snapshot is simply recompiled next time.
+def write_snapshot(snapshot, f_name):
+    tmp = "{}.{}.tmp".format(f_name, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(f_name), exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, f_name)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+# Return the compiled snapshot of the given ttl, reusing the on-disk cache
+# when the ttl content hash matches and compiling it with
+# compile_snapshot(path, content_hash, graph) (then caching it) otherwise.
+# prefix names the cache files of each kind of snapshot.
+def load_snapshot(path, compile_snapshot, prefix, cache_dir=None, use_cache=True, graph=None):
+    with timed('ontology_snapshot'):
+        content_hash = ttl_content_hash(path)
+        if not use_cache:
+            return compile_snapshot(path, content_hash, graph)
+        cache_dir = cache_dir or default_cache_dir(path)
+        f_name = snapshot_file(content_hash, cache_dir, prefix)
+        snapshot = read_snapshot(f_name, content_hash)
+        if snapshot is None:
+            count('snapshot_cache_misses')
+            snapshot = compile_snapshot(path, content_hash, graph)
+            write_snapshot(snapshot, f_name)
+        else:
+            count('snapshot_cache_hits')
+        return snapshot
+
+
+# Return the compiled snapshot for the given defs ttl, see load_snapshot
+def load_haystack_snapshot(path=HAYSTACK_DEFS, cache_dir=None, use_cache=True, graph=None):
+    return load_snapshot(path, compile_haystack_snapshot, 'haystack', cache_dir, use_cache, graph)
+
+
+# Parse the Brick ttl once and resolve its classes, class hierarchy and
+# equivalent classes
+def compile_brick_snapshot(path=BRICK_DEFS, content_hash=None, graph=None):
+    from .queries import (brick_load_classes, brick_load_equivalent_classes, brick_load_subclass_edges,
+                          init_brick_graph)
+    g = graph if graph is not None else init_brick_graph(path)
+    return {
+        'version': SNAPSHOT_VERSION,
+        'source_hash': content_hash or ttl_content_hash(path),
+        'classes': sorted(brick_load_classes(g)),
+        'subclass_edges': brick_load_subclass_edges(g),
+        'equivalent_classes': brick_load_equivalent_classes(g),
+    }
+
+
+# Return the compiled snapshot for the given Brick ttl, see load_snapshot
+def load_brick_snapshot(path=BRICK_DEFS, cache_dir=None, use_cache=True, graph=None):
+    return load_snapshot(path, compile_brick_snapshot, 'brick', cache_dir, use_cache, graph)
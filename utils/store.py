@@ -0,0 +1,251 @@
+import json
+from collections.abc import MutableMapping
+from weakref import WeakValueDictionary
+
+# JSON Haystack encoding of a marker value
+MARKER = "m:"
+
+# Tags whose values are not interned, see TagTable.value
+UNIQUE_TAGS = frozenset(['id', 'dis', 'navName'])
+
+
+# The tag layout shared by every entity with the same tags, in the same
+# order, with the same ones being markers.  Holds the interned tag ids and
+# everything derived from them (names, marker / val sets, the typing
+# signature), so that per entity only the val values need to be stored.
+class Layout(object):
+    __slots__ = ('table', 'tags', 'is_marker', 'names', 'val_positions', 'signature', '__weakref__')
+
+    def __init__(self, table, names, is_marker):
+        self.table = table
+        self.tags = tuple(table.tag_id(k) for k in names)
+        self.is_marker = is_marker
+        self.names = names
+        val_names = [k for k, m in zip(names, is_marker) if not m]
+        self.val_positions = {k: i for i, k in enumerate(val_names)}
+        # Same as tag_signature of the equivalent dict
+        self.signature = (frozenset(k for k, m in zip(names, is_marker) if m), frozenset(val_names))
+
+    # Interned ids of the marker tags
+    @property
+    def markers(self):
+        return tuple(t for t, m in zip(self.tags, self.is_marker) if m)
+
+    # Interned ids of the val tags, parallel to an entity's vals
+    @property
+    def val_tags(self):
+        return tuple(t for t, m in zip(self.tags, self.is_marker) if not m)
+
+    @property
+    def marker_names(self):
+        return self.signature[0]
+
+    @property
+    def val_names(self):
+        return self.signature[1]
+
+
+# Interns tag names to integer ids, tag layouts to shared Layout objects and
+# repeated string values (refs, units, kinds) to a single copy.  One table is
+# shared by all the entities of a Building.  Layouts are only held while
+# some entity uses them, so re-tagging does not leave stale ones behind.
+class TagTable(object):
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self._layouts = WeakValueDictionary()
+        self._values = {}
+
+    def tag_id(self, name):
+        t = self.ids.get(name)
+        if t is None:
+            t = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return t
+
+    def layout(self, keys, is_marker):
+        layout = self._layouts.get((keys, is_marker))
+        if layout is None:
+            layout = Layout(self, keys, is_marker)
+            # Keyed on the layout's own tuples, so the key costs nothing extra
+            self._layouts[(layout.names, layout.is_marker)] = layout
+        return layout
+
+    # Ids and display names are (nearly) always unique, so interning them
+    # would only add a table entry per entity
+    def value(self, tag, v):
+        if tag in UNIQUE_TAGS or not isinstance(v, str):
+            return v
+        return self._values.setdefault(v, v)
+
+    def __len__(self):
+        return len(self._layouts)
+
+    # Encode the tags of a dict (or Mapping) as (layout, vals)
+    def encode(self, entity):
+        keys = tuple(entity)
+        values = tuple(entity[k] for k in keys)
+        is_marker = tuple(v == MARKER for v in values)
+        layout = self.layout(keys, is_marker)
+        vals = tuple(self.value(k, v) for k, v, m in zip(keys, values, is_marker) if not m)
+        return layout, vals
+
+
+# Tables used by entities created without one
+_DEFAULT_TABLE = TagTable()
+
+
+# Compact representation of a single Haystack entity.  The tags are an
+# interned Layout (shared with every entity tagged the same way) and the val
+# values are a tuple parallel to the layout's val tags; markers take no
+# space of their own.  Entity is a MutableMapping over the same keys and
+# values as the JSON row it came from, so it can be used wherever the
+# entity dicts are (find_*, add_marker, remove_tag, ph_typer, ...).
+class Entity(MutableMapping):
+    __slots__ = ('layout', 'vals')
+
+    def __init__(self, entity_dict=None, table=None):
+        if table is None:
+            table = _DEFAULT_TABLE
+        self.layout, self.vals = table.encode(entity_dict or {})
+
+    # The TagTable the entity is interned in
+    @property
+    def table(self):
+        return self.layout.table
+
+    def __getitem__(self, key):
+        i = self.layout.val_positions.get(key)
+        if i is not None:
+            return self.vals[i]
+        if key in self.layout.marker_names:
+            return MARKER
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.layout.val_positions or key in self.layout.marker_names
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def __len__(self):
+        return len(self.layout.tags)
+
+    # Changing a tag re-encodes the entity against its table
+    def __setitem__(self, key, value):
+        entity = dict(self)
+        entity[key] = value
+        self.layout, self.vals = self.table.encode(entity)
+
+    def __delitem__(self, key):
+        entity = dict(self)
+        del entity[key]
+        self.layout, self.vals = self.table.encode(entity)
+
+    # Replace values equal to m_bad with markers, see cleanup_marker_tags
+    def cleanup_marker_tags(self, m_bad="M"):
+        if m_bad in self.vals:
+            self.layout, self.vals = self.table.encode(
+                {k: MARKER if v == m_bad else v for k, v in self.items()})
+        return self
+
+    def __eq__(self, other):
+        if isinstance(other, Entity) and other.table is self.table:
+            return self.layout is other.layout and self.vals == other.vals
+        return MutableMapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.layout, self.vals = _DEFAULT_TABLE.encode(state)
+
+    def __repr__(self):
+        return "Entity({!r})".format(dict(self))
+
+    @property
+    def as_dict(self):
+        return dict(self)
+
+    @property
+    def id(self):
+        return self.get('id')
+
+    @property
+    def dis(self):
+        return self.get('dis', 'No dis available')
+
+    def __str__(self):
+        return self.dis
+
+
+# A whole building of compact Entities sharing one TagTable.  Iterates like
+# the list of entity dicts returned by import_haystack_json, and tag queries
+# are answered once per distinct layout instead of once per entity.
+class Building(object):
+    def __init__(self, rows=(), table=None):
+        self.table = table if table is not None else TagTable()
+        self.entities = [Entity(r, self.table) for r in rows]
+
+    # Load a Haystack JSON file, streaming its rows so that the file is
+    # never held in memory as dicts
+    @classmethod
+    def from_json(cls, file):
+        from .stream import iter_haystack_rows
+        return cls(iter_haystack_rows(file))
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __getitem__(self, i):
+        return self.entities[i]
+
+    def append(self, entity):
+        self.entities.append(Entity(entity, self.table))
+
+    # The entities as JSON Haystack rows, with the same keys, key order and
+    # values they were loaded with
+    def to_rows(self):
+        return [dict(e) for e in self.entities]
+
+    def to_json(self, file):
+        with open(file, 'w') as f:
+            json.dump({'rows': self.to_rows()}, f)
+
+    # Positions of the entities whose layout satisfies predicate, which is
+    # evaluated once per distinct layout
+    def _select(self, predicate):
+        decided = {}
+        selected = []
+        for e in self.entities:
+            keep = decided.get(e.layout)
+            if keep is None:
+                keep = decided[e.layout] = predicate(e.layout)
+            selected.append(keep)
+        return selected
+
+    # Same contract as find_tagset
+    def find_tagset(self, tags):
+        tags = set(tags)
+        selected = self._select(lambda layout: tags.issubset(layout.names))
+        matches = [e for e, keep in zip(self.entities, selected) if keep]
+        non_matches = [e for e, keep in zip(self.entities, selected) if not keep]
+        return (matches, non_matches)
+
+    # Same contract as find_tagset_exclusive
+    def find_tagset_exclusive(self, tags, exclude_tags):
+        tags = set(tags)
+        exclude_tags = set(exclude_tags)
+        selected = self._select(lambda layout: tags.issubset(layout.names) and
+                                not exclude_tags.issubset(layout.names))
+        return [e for e, keep in zip(self.entities, selected) if keep]
+
+    def cleanup_marker_tags(self, m_bad="M"):
+        for e in self.entities:
+            e.cleanup_marker_tags(m_bad)
+        return self
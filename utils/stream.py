@@ -0,0 +1,125 @@
+import json
+from .utils import ph_typer_many, ph_typer
+
+# Characters skipped between JSON tokens
+_WHITESPACE = ' \t\n\r'
+
+
+# Incrementally reads a Haystack JSON export, decoding one value at a time
+# from a bounded text buffer instead of loading the whole document.
+class _JsonStream(object):
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    # Read more of the file, at least doubling the buffered text so that
+    # retrying a large value is not quadratic
+    def _fill(self):
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(self.chunk_size, len(self.buf)))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    # Return the next non-whitespace character without consuming it
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected {!r} at offset {} of Haystack JSON, found {!r}".format(
+                char, self.pos, found))
+        self.pos += 1
+
+    # Decode the next complete JSON value.  A value ending exactly at the end
+    # of the buffer may be truncated (e.g. a number), so more is read first.
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+# Yield the 'rows' of a Haystack JSON file one at a time, without
+# materializing the document.  Only the other top level sections (meta,
+# cols) are decoded whole, and discarded.
+def iter_haystack_rows(file, chunk_size=1 << 16):
+    with open(file, 'r') as f:
+        stream = _JsonStream(f, chunk_size)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key == 'rows':
+                stream.expect('[')
+                if stream.peek() == ']':
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield stream.value()
+                        if stream.peek() == ',':
+                            stream.pos += 1
+                            continue
+                        stream.expect(']')
+                        break
+            else:
+                stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+                continue
+            stream.expect('}')
+            return
+
+
+# Generator equivalent of cleanup_marker_tags
+def iter_cleanup_marker_tags(rows, m_bad="M"):
+    for e in rows:
+        for k, v in e.items():
+            if v == m_bad:
+                e[k] = "m:"
+        yield e
+
+
+# Generator equivalent of ph_typer_many, yielding (entity, typed) pairs and
+# adding each to tally (a ReportTally) if given
+def iter_ph_typer(rows, defs=None, cache=None, tally=None):
+    for e in rows:
+        typed = ph_typer(e, defs=defs, cache=cache)
+        if tally is not None:
+            tally.add(e, typed)
+        yield e, typed
+
+
+# Stream, clean up and type a Haystack JSON file in bounded memory.  Each
+# typed entity is passed to on_entity (e.g. to write it out as it is typed);
+# the returned report only holds the general sections unless keep_entities.
+def stream_report(file, defs=None, cache=None, m_bad="M", on_entity=None, keep_entities=False,
+                  chunk_size=1 << 16):
+    rows = iter_cleanup_marker_tags(iter_haystack_rows(file, chunk_size), m_bad)
+    return ph_typer_many(rows, defs=defs, cache=cache, keep_entities=keep_entities, on_entity=on_entity)
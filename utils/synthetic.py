@@ -0,0 +1,110 @@
+import json
+import random
+
+# Synthetic Haystack buildings for tests and benchmarks.  A building is a
+# site, its floors, equips spread over the floors and points on the equips,
+# with the usual siteRef / floorRef / equipRef / ahuRef references.  Tagsets
+# are drawn from the templates below, which follow the tagging of the
+# brick-examples Haystack exports, with ids and refs in the Haystack JSON
+# 'r:' encoding.
+
+EQUIP_TEMPLATES = [
+    ('ahu', ['ahu', 'equip']),
+    ('vav', ['vav', 'equip']),
+    ('fcu', ['fcu', 'equip']),
+    ('boiler', ['boiler', 'equip']),
+    ('chiller', ['chiller', 'equip']),
+    ('meter', ['elec', 'meter', 'equip']),
+]
+
+POINT_TEMPLATES = [
+    ['discharge', 'air', 'temp', 'sensor', 'point', 'his'],
+    ['zone', 'air', 'temp', 'sensor', 'point', 'his'],
+    ['zone', 'air', 'temp', 'sp', 'point', 'writable'],
+    ['return', 'air', 'temp', 'sensor', 'point', 'his'],
+    ['damper', 'cmd', 'point', 'writable'],
+    ['fan', 'run', 'cmd', 'point', 'his'],
+    ['fan', 'run', 'sensor', 'point', 'his'],
+    ['air', 'flow', 'sensor', 'point', 'his'],
+    ['air', 'flow', 'sp', 'point'],
+    ['hot', 'water', 'valve', 'cmd', 'point'],
+    ['occupied', 'sensor', 'point'],
+    ['elec', 'power', 'sensor', 'point', 'his'],
+]
+
+POINT_VALS = {'kind': 's:Number', 'unit': 's:°F', 'tz': 's:Los_Angeles'}
+
+
+# Yield the rows of a synthetic building of (about) n_entities entities.
+#   custom_ratio: share of entities carrying a custom (non Haystack) marker
+#       and val, which type as invalid markers / vals
+#   points_per_equip: mean points per equip (the equipRef fan-out), the
+#       equip / point mix follows from it
+#   equips_per_floor: floorRef fan-out
+#   vavs_per_ahu: ahuRef fan-out of vavs onto the ahus of their floor
+#   marker: value written for markers; "M" reproduces the exports which
+#       cleanup_marker_tags fixes
+# Rows are generated lazily, so 10^7 entity buildings can be written out
+# without holding them in memory.  The same seed gives the same building.
+def generate_building(n_entities, custom_ratio=0.1, points_per_equip=8, equips_per_floor=20, vavs_per_ahu=10,
+                      marker="M", seed=0, name='synthetic'):
+    rng = random.Random(seed)
+    n_custom = max(1, int(custom_ratio * 20))
+    site_id = 'r:{}.site'.format(name)
+
+    def row(id_, markers, vals):
+        e = {'id': id_}
+        for m in markers:
+            e[m] = marker
+        e.update(vals)
+        if rng.random() < custom_ratio:
+            e['custom{}'.format(rng.randrange(n_custom))] = marker
+            e['customVal'] = 's:x'
+        return e
+
+    yield row(site_id, ['site'], {'dis': 's:{}'.format(name), 'area': 'n:{}'.format(n_entities * 10),
+                                  'tz': POINT_VALS['tz']})
+    n = 1
+    floor = equip = point = 0
+    while n < n_entities:
+        floor_id = 'r:{}.floor{}'.format(name, floor)
+        yield row(floor_id, ['floor'], {'dis': 's:Floor {}'.format(floor), 'siteRef': site_id})
+        n += 1
+        ahus = []
+        for i in range(equips_per_floor):
+            if n >= n_entities:
+                break
+            equip_id = 'r:{}.equip{}'.format(name, equip)
+            equip += 1
+            # One ahu ahead of every vavs_per_ahu equips of the floor
+            if i % (vavs_per_ahu + 1) == 0:
+                kind, markers = EQUIP_TEMPLATES[0]
+                ahus.append(equip_id)
+            else:
+                kind, markers = EQUIP_TEMPLATES[1 + rng.randrange(len(EQUIP_TEMPLATES) - 1)]
+            vals = {'dis': 's:{} {}'.format(kind.upper(), equip), 'navName': 's:{}-{}'.format(kind, equip),
+                    'siteRef': site_id, 'floorRef': floor_id}
+            if kind == 'vav':
+                vals['ahuRef'] = rng.choice(ahus)
+            yield row(equip_id, markers, vals)
+            n += 1
+            for _ in range(max(1, int(rng.expovariate(1.0 / points_per_equip)))):
+                if n >= n_entities:
+                    break
+                vals = {'dis': 's:Point {}'.format(point), 'siteRef': site_id,
+                        'equipRef': equip_id}
+                vals.update(POINT_VALS)
+                yield row('r:{}.point{}'.format(name, point), rng.choice(POINT_TEMPLATES), vals)
+                point += 1
+                n += 1
+        floor += 1
+
+
+# Write rows as a Haystack JSON file, one row at a time
+def write_haystack_json(rows, file):
+    with open(file, 'w') as f:
+        f.write('{"meta": {"ver": "3.0"}, "rows": [')
+        for i, r in enumerate(rows):
+            f.write(',\n' if i else '\n')
+            json.dump(r, f)
+        f.write('\n]}')
@@ -1,36 +1,69 @@
 import json
 import uuid
 import os
-from rdflib import RDFS, RDF, OWL, Namespace, Graph, URIRef
-from .queries import *
-from itertools import permutations
+import time
+from importlib import import_module
+from .defs import HaystackDefs, get_default_defs, set_default_defs
+from .index import TagIndex
+from .store import Building, Entity, TagTable
+from .metrics import Metrics, collect_metrics, profile_to
+from .metrics import profiled as _profiled, resolve_metrics as _resolve_metrics, timed as _timed
 import csv
-
-# Bulk load queries as lists to limit disc calls
-ALL_ENTITIES = ph_load_all_entities()
-ALL_ENTITIES.remove('entity')
-ALL_EQUIPS = ph_load_all_equips()
-ALL_EQUIPS.remove('equip')
-EACH_EQUIP_AS_SET = []
-for e in ALL_EQUIPS:
-    EACH_EQUIP_AS_SET.append(set(e.split('-')))
-
-ALL_VALS = ph_load_all_vals()
-ALL_VALS.remove('val')
-ALL_MARKERS = ph_load_all_markers()
-ALL_MARKERS.remove('marker')
-ALL_PHENOMENON = ph_load_all_phenomenon()
-ALL_PHENOMENON.remove('phenomenon')
-ALL_QUANTITIES = ph_load_all_quantities()
-ALL_QUANTITIES.remove('quantity')
-
-FC_ENTITIES = ph_load_fc_entities()
-FC_EQUIPS = ph_load_fc_equips()
-FC_MARKERS = ph_load_fc_markers()
-FC_PHENOMENON = ph_load_fc_phenomenon()
-FC_QUANTITIES = ph_load_fc_quantities()
-
-POINT_FUNCTION_TYPES = ph_load_pointFunctionTypes()
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import nullcontext
+
+# Module level vocabulary lists kept for backwards compatibility.  These
+# are resolved lazily from the default HaystackDefs on first access rather
+# than at import time; new code should pass a HaystackDefs instead.  Each
+# list is built once and the same object is returned on later accesses (so
+# in-place edits persist), until the default HaystackDefs is swapped.
+_LEGACY_VOCABULARY = {
+    'ALL_ENTITIES': 'entities',
+    'ALL_EQUIPS': 'equips',
+    'ALL_VALS': 'vals',
+    'ALL_MARKERS': 'markers',
+    'ALL_PHENOMENON': 'phenomena',
+    'ALL_QUANTITIES': 'quantities',
+    'FC_ENTITIES': 'fc_entities',
+    'FC_EQUIPS': 'fc_equips',
+    'FC_MARKERS': 'fc_markers',
+    'FC_PHENOMENON': 'fc_phenomena',
+    'FC_QUANTITIES': 'fc_quantities',
+    'POINT_FUNCTION_TYPES': 'point_function_types',
+}
+
+
+_LEGACY_VALUES = {}
+
+
+# The SPARQL helpers of utils/queries.py (and the rdflib names it imports)
+# used to be star imported here.  They are still reachable as utils.utils
+# attributes, but rdflib and the query module are only imported on first
+# access, so typing and reporting from the vocabulary snapshot never pay
+# for them.
+def _queries():
+    return import_module('.queries', __package__)
+
+
+def __getattr__(name):
+    if name == '__all__':
+        return _star_names()
+    if name not in _LEGACY_VOCABULARY and name != 'EACH_EQUIP_AS_SET':
+        if not name.startswith('_'):
+            try:
+                return getattr(_queries(), name)
+            except AttributeError:
+                pass
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    defs = get_default_defs()
+    if name not in _LEGACY_VALUES or _LEGACY_VALUES[name][0] is not defs:
+        if name == 'EACH_EQUIP_AS_SET':
+            value = [set(e) for e in defs.each_equip_as_set]
+        else:
+            value = defs.vocabulary(_LEGACY_VOCABULARY[name])
+        _LEGACY_VALUES[name] = (defs, value)
+    return _LEGACY_VALUES[name][1]
 
 
 # Import one of the Haystack JSON files as a list
@@ -41,6 +74,13 @@ def import_haystack_json(file):
         data = json.load(f)
     return data['rows']
 
+
+# Import one of the Haystack JSON files as a compact Building of Entities,
+# which can be used in place of the list of dictionaries
+def import_haystack_building(file):
+    return Building.from_json(file)
+
+
 def find_sites(entities):
     sites, _ = find_tagset(entities, tags=['site'])
     return (sites, _)
@@ -73,8 +113,13 @@ def find_sps(entities):
 
 # Given a list of separate tags (strings), find the entities with the
 # full set of tags.  Return a two-termed tuple, where the first term
-# are all matches, and the second term is all non-matches
+# are all matches, and the second term is all non-matches.
+# entities may also be a TagIndex or a Building (as may the entities of
+# every find_* helper built on find_tagset), in which case the index / tag
+# layouts are used instead of scanning the entities' tags.
 def find_tagset(entities, tags):
+    if isinstance(entities, (TagIndex, Building)):
+        return entities.find_tagset(tags)
     tags = set(tags)
     matches = [e for e in entities if tags.issubset(e.keys())]
     non_matches = [e for e in entities if not tags.issubset(e.keys())]
@@ -84,12 +129,25 @@ def find_tagset(entities, tags):
 # Mimic the `find_tagset` funciton, however,
 # excluding entities containing ALL of the tags in the exclude_tags list
 def find_tagset_exclusive(entities, tags, exclude_tags):
+    if isinstance(entities, (TagIndex, Building)):
+        return entities.find_tagset_exclusive(tags, exclude_tags)
     exclude_tags = set(exclude_tags)
     matches, non_matches = find_tagset(entities, tags)
     matches_exclude = [e for e in matches if not exclude_tags.issubset(e.keys())]
     return matches_exclude
 
 
+# Find the entities matching a Haystack filter expression, e.g.
+# 'point and sensor and temp and equipRef->ahu' (see utils/filters.py).
+# Returns (matches, non_matches) like find_tagset.  Pass a FilterIndex built
+# over the building to run many queries against one index.
+def find_filter(entities, expr):
+    from .filters import FilterIndex
+    if not isinstance(entities, FilterIndex):
+        entities = FilterIndex(entities)
+    return entities.find(expr)
+
+
 # Find a given string in the navName parameter and return it as a match
 def find_str_in_navName(entities, find):
     matches = [e for e in entities if ('navName' in e.keys() and find.lower() in e['navName'].lower())]
@@ -98,8 +156,11 @@ def find_str_in_navName(entities, find):
 
 
 # Iterate through all entites, adding the tag_to_add
-# as a marker to all entities
-def add_marker(entities, tag_to_add):
+# as a marker to all entities.  Pass the TagIndex built over the building
+# as index to keep it consistent.
+def add_marker(entities, tag_to_add, index=None):
+    if index is not None:
+        return index.add_marker(entities, tag_to_add)
     for e in entities:
         e[tag_to_add] = "m:"
     return entities
@@ -120,6 +181,8 @@ def add_marker_given_tagset(entities, tag_to_add, tags_to_find):
 # the marker tags in the examples were serialized as "M".  This function
 # will replace the m_bad with "m:"
 def cleanup_marker_tags(entities, m_bad="M"):
+    if isinstance(entities, (TagIndex, Building)):
+        return entities.cleanup_marker_tags(m_bad)
     for e in entities:
         for k, v in e.items():
             if v == m_bad:
@@ -130,11 +193,14 @@ def cleanup_marker_tags(entities, m_bad="M"):
 
 
 # Remove the tag from all entities passed in.
-# If the tag is not present, the entity is not affected
-def remove_tag(entities, tag):
+# If the tag is not present, the entity is not affected.
+# Pass the TagIndex built over the building as index to keep it consistent.
+def remove_tag(entities, tag, index=None):
+    if index is not None:
+        return index.remove_tag(entities, tag)
     output = []
     for e in entities:
-        e.pop(tag)
+        e.pop(tag, None)
         output.append(e)
     return output
 
@@ -144,11 +210,11 @@ def remove_tag(entities, tag):
 # all unique marker types are passed back in a single list
 def only_markers(entities):
     types = []
-    if isinstance(entities, list):
+    if isinstance(entities, (list, Building)):
         for e in entities:
             for k, v in e.items():
                 types.append(k) if (v == "m:" and not k in types) else None
-    elif isinstance(entities, dict):
+    elif isinstance(entities, Mapping):
         for k, v in entities.items():
             types.append(k) if (v == "m:" and not k in types) else None
     return types
@@ -159,22 +225,94 @@ def only_markers(entities):
 # all unique val types are passed back in a single list
 def only_vals(entities):
     types = []
-    if isinstance(entities, list):
+    if isinstance(entities, (list, Building)):
         for e in entities:
             for k, v in e.items():
                 types.append(k) if (v != "m:" and k not in types) else None
-    elif isinstance(entities, dict):
+    elif isinstance(entities, Mapping):
         for k, v in entities.items():
             types.append(k) if (v != "m:" and k not in types) else None
     return types
 
 
+# Return the typing signature of an entity: the frozen sets of its marker
+# and val tag names.  Typing only depends on which tags are present (never on
+# the id or the values), so entities sharing a signature type identically.
+# An Entity already carries its signature in its interned layout.
+def tag_signature(entity):
+    if isinstance(entity, Entity):
+        return entity.layout.signature
+    markers = frozenset(k for k, v in entity.items() if v == "m:")
+    vals = frozenset(k for k, v in entity.items() if v != "m:")
+    return (markers, vals)
+
+
+# Memoizes typing results by (defs, tag signature), so that each distinct
+# signature is typed once per run.  Bounded to maxsize signatures, evicting
+# the least recently used, and keeps hit / miss counts for reporting.
+class TypingCache(object):
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hit_rate,
+        }
+
+
 # Given a single entity, attempt to determine the 'type'.  The following logic
 # is used:
 # 1. limit entity tags to only valid haystack markers
 # 2. Determine the entity type
 #     - Raise error if multiple or none of first class entity markers defined
-def ph_typer(entity, valid_entities=FC_ENTITIES, all_entities=ALL_ENTITIES):
+# 3. Determine the subtype, and for equips the lowest subclass
+# The vocabulary is taken from defs, defaulting to the default HaystackDefs.
+# If a TypingCache is given, entities with an already seen tag signature are
+# stamped with the cached result instead of being typed again.
+# valid_entities and all_entities are no longer used, and are only kept so
+# that existing positional calls keep working.
+def ph_typer(entity, valid_entities=None, all_entities=None, *, defs=None, cache=None):
+    if defs is None:
+        defs = get_default_defs()
     to_return = {}
     if not 'id' in entity.keys():
         to_return['status'] = {
@@ -184,24 +322,45 @@ def ph_typer(entity, valid_entities=FC_ENTITIES, all_entities=ALL_ENTITIES):
         return to_return
     to_return['id'] = entity['id']
 
+    entity_markers, entity_vals = tag_signature(entity)
+    if cache is None:
+        to_return.update(ph_type_signature(entity_markers, entity_vals, defs))
+        return to_return
+
+    key = (defs, entity_markers, entity_vals)
+    typed = cache.get(key)
+    if typed is None:
+        typed = ph_type_signature(entity_markers, entity_vals, defs)
+        cache.put(key, typed)
+    # Copy the lists so that entities never share mutable results
+    for k, v in typed.items():
+        to_return[k] = list(v) if isinstance(v, list) else v
+    return to_return
+
+
+# Type a tag signature (see tag_signature), returning everything ph_typer
+# reports except the id
+def ph_type_signature(entity_markers, entity_vals, defs=None):
+    if defs is None:
+        defs = get_default_defs()
+    to_return = {}
+
     # refine all tags on entity to only marker tags
-    entity_markers = only_markers(entity)
     entity_markers = set(entity_markers)
-    entity_valid_markers = entity_markers.intersection(ALL_MARKERS)
-    entity_invalid_markers = entity_markers.difference(ALL_MARKERS)
+    entity_valid_markers = entity_markers.intersection(defs.all_markers)
+    entity_invalid_markers = entity_markers.difference(defs.all_markers)
 
-    entity_vals = only_vals(entity)
     entity_vals = set(entity_vals)
     if len(entity_vals) > 1:
-        entity_valid_vals = entity_vals.intersection(ALL_VALS)
-        entity_invalid_vals = entity_vals.difference(ALL_VALS)
+        entity_valid_vals = entity_vals.intersection(defs.all_vals)
+        entity_invalid_vals = entity_vals.difference(defs.all_vals)
     else:
         entity_valid_vals = []
         entity_invalid_vals = []
 
     # determine the entity type.  Should be exactly one entity type,
     # raise Exception if else.
-    entity_valid_entity = entity_markers.intersection(FC_ENTITIES)
+    entity_valid_entity = entity_markers.intersection(defs.fc_entities)
 
     if len(entity_valid_entity) == 0:
         to_return['valid'] = False
@@ -214,9 +373,14 @@ def ph_typer(entity, valid_entities=FC_ENTITIES, all_entities=ALL_ENTITIES):
         to_return['fc_entity_type'] = list(entity_valid_entity)[0]
 
     if to_return['valid']:
-        non_entity_markers = entity_valid_markers.difference(ALL_ENTITIES)
+        non_entity_markers = entity_valid_markers.difference(defs.all_entities)
         # Given only valid fc entities
-        to_return = ph_subtyper(to_return, entity_markers, non_entity_markers)
+        with _timed('subtyping'):
+            to_return = ph_subtyper(to_return, entity_markers, non_entity_markers, defs)
+        if 'subclasses_in_entity' in to_return:
+            with _timed('lowest_subclass'):
+                to_return['lowest_subclass'] = lowest_subclass(to_return['subclasses_in_entity'],
+                                                               to_return['fc_entity_type'], defs)
     to_return['valid_markers'] = list(entity_valid_markers)
     to_return['invalid_markers'] = list(entity_invalid_markers)
     to_return['valid_vals'] = list(entity_valid_vals)
@@ -226,31 +390,22 @@ def ph_typer(entity, valid_entities=FC_ENTITIES, all_entities=ALL_ENTITIES):
 
 # Given an entity with a valid first class entity type, attempt to determine the subtype
 # TODO: Deal with other first class entity types
-def ph_subtyper(a_dict, entity_markers, non_entity_markers):
+def ph_subtyper(a_dict, entity_markers, non_entity_markers, defs=None):
+    if defs is None:
+        defs = get_default_defs()
     entity_type = a_dict['fc_entity_type']
     # if entity_type == 'device':
 
     if entity_type == 'equip':
-        all_valid_markers = list(entity_markers) + list(non_entity_markers)
-        subclasses_in_entity = []
-        for e in EACH_EQUIP_AS_SET:
-            if e.issubset(all_valid_markers):
-                if len(e) > 1:
-                    e_list = list(e)
-                    e_perms = permutations(e_list, len(e_list))
-                    for c in e_perms:
-                        c2 = '-'.join(c)
-                        subclasses_in_entity.append(c2) if c2 in ALL_EQUIPS else None
-
-                else:
-                    subclasses_in_entity.append(list(e)[0])
+        all_valid_markers = set(entity_markers).union(non_entity_markers)
+        subclasses_in_entity = defs.equip_index.match(all_valid_markers)
         non_entity_markers = list(non_entity_markers)
         a_dict['subclasses_in_entity'] = subclasses_in_entity
         a_dict['non_entity_markers'] = non_entity_markers
     elif entity_type == 'point':
-        point_type = set(non_entity_markers).intersection(POINT_FUNCTION_TYPES)
-        point_phenom = set(non_entity_markers).intersection(ALL_PHENOMENON)
-        point_quantity = set(non_entity_markers).intersection(ALL_QUANTITIES)
+        point_type = set(non_entity_markers).intersection(defs.point_function_types)
+        point_phenom = set(non_entity_markers).intersection(defs.all_phenomenon)
+        point_quantity = set(non_entity_markers).intersection(defs.all_quantities)
         a_dict['point_function'] = list(point_type)
         a_dict['phenomenon'] = list(point_phenom)
         a_dict['quantity'] = list(point_quantity)
@@ -265,15 +420,17 @@ def ph_subtyper(a_dict, entity_markers, non_entity_markers):
 # Given the entities in the building, extend the report['general']
 # to include a list of all markers / vals broken out by whether or
 # not they are valid / invalid
-def all_valid_invalid_markers_and_vals(entities, report):
+def all_valid_invalid_markers_and_vals(entities, report, defs=None):
+    if defs is None:
+        defs = get_default_defs()
     # First
     markers_used = only_markers(entities)
     vals_used = only_vals(entities)
 
-    valid_markers = set(markers_used).intersection(ALL_MARKERS)
-    invalid_markers = set(markers_used).difference(ALL_MARKERS)
-    valid_vals = set(vals_used).intersection(ALL_VALS)
-    invalid_vals = set(vals_used).difference(ALL_VALS)
+    valid_markers = set(markers_used).intersection(defs.all_markers)
+    invalid_markers = set(markers_used).difference(defs.all_markers)
+    valid_vals = set(vals_used).intersection(defs.all_vals)
+    invalid_vals = set(vals_used).difference(defs.all_vals)
 
     report['general']['valid_markers'] = list(valid_markers)
     report['general']['invalid_markers'] = list(invalid_markers)
@@ -282,18 +439,36 @@ def all_valid_invalid_markers_and_vals(entities, report):
     return report
 
 
+# The tag categories of ph_typer results, in report order
+TAG_CATEGORIES = ['valid_markers', 'invalid_markers', 'valid_vals', 'invalid_vals']
+
+# Columns of the flattened count_tags_by_entity, as written to report_<name>.csv
+TAG_COUNT_COLUMNS = ['entity_type', 'tag_category', 'tag', 'count']
+
+
+# Flatten count_tags_by_entity into (entity_type, tag_category, tag, count)
+# rows, in report order
+def tag_count_rows(count_tags_by_entity):
+    for entity_type, categories in count_tags_by_entity.items():
+        for tag_category, tags in categories.items():
+            for tag, n in tags.items():
+                yield (entity_type, tag_category, tag, n)
+
+
 # Given the entities in the building, extend the report['general']
 # to include a counting of tags (vals or markers), broken out by
 # valid / invalid, and counted by the first class entity type which implemented
 # the tag
-def count_tags_by_entity(entities, report):
+def count_tags_by_entity(entities, report, defs=None):
+    if defs is None:
+        defs = get_default_defs()
     # These are the entity keys we will be iterating through
-    to_iter = ['valid_markers', 'invalid_markers', 'valid_vals', 'invalid_vals']
+    to_iter = TAG_CATEGORIES
 
     report['general']['count_tags_by_entity'] = {}
 
     # Break the report down by Haystack first class entities
-    for ent in FC_ENTITIES:
+    for ent in defs.fc_entities:
         if not ent in report['general']['count_tags_by_entity'].keys():
             report['general']['count_tags_by_entity'][ent] = {}
         for i in to_iter:
@@ -324,141 +499,343 @@ def count_tags_by_entity(entities, report):
     return report
 
 
-def ph_reporter_general(entities, report):
+def ph_reporter_general(entities, report, defs=None):
     # First step is to get general information on valid / invalid
     # marker and val tags used in the model
-    report = all_valid_invalid_markers_and_vals(entities, report)
+    report = all_valid_invalid_markers_and_vals(entities, report, defs)
 
     # Second step is to get specific information on which tags
     # are used on each first class entity type, and how many times they are used
-    report = count_tags_by_entity(entities, report)
+    report = count_tags_by_entity(entities, report, defs)
     return report
 
 
-def lowest_subclass(class_list, fc_entity_type):
+# Given the subclasses found on an entity, return the lowest (most specific)
+# subclass of the first class entity type, using the precomputed taxonomy.
+# Candidates outside the entity type's hierarchy are ignored, and ties between
+# equally deep candidates go to the first one in class_list.  class_list is
+# not modified.
+def lowest_subclass(class_list, fc_entity_type, defs=None):
+    if defs is None:
+        defs = get_default_defs()
     if len(class_list) == 1:
         return class_list[0]
-    else:
-        lc = fc_entity_type
-        subclasses = ph_subclass_of_phiot(fc_entity_type)
-        while len(class_list) > 0:
-            for sc in range(0, len(class_list)):
-                if class_list[sc] in subclasses:
-                    lc = class_list.pop(sc)
-                    subclasses = ph_subclass_of_phiot(lc)
-                    break
-
-        return lc
+    return defs.taxonomy.lowest(class_list, fc_entity_type)
 
 # Iterate through list of entities, providing a typer for each
-def ph_typer_many(entities, valid_entities=FC_ENTITIES, all_entities=ALL_ENTITIES):
+# Accumulates report['general'] (see ph_reporter_general) one entity at a
+# time, so that the general sections can be built in a single pass and
+# without holding the building or the typed entities in memory.
+class ReportTally(object):
+    def __init__(self, defs=None):
+        self.defs = defs if defs is not None else get_default_defs()
+        self.markers_used = set()
+        self.vals_used = set()
+        self.count_tags_by_entity = {}
+        for ent in list(self.defs.fc_entities) + ['other']:
+            self.count_tags_by_entity[ent] = {i: {} for i in TAG_CATEGORIES}
+
+    # Add an entity and its ph_typer result.  Entities without an id (which
+    # ph_typer gives a status instead of a type) only count towards the
+    # valid / invalid tags used in the building.
+    def add(self, entity, typed):
+        if isinstance(entity, Entity):
+            self.markers_used.update(entity.layout.signature[0])
+            self.vals_used.update(entity.layout.signature[1])
+        else:
+            for k, v in entity.items():
+                if v == "m:":
+                    self.markers_used.add(k)
+                else:
+                    self.vals_used.add(k)
+        if 'valid' not in typed:
+            return
+        entity_type = typed['fc_entity_type'] if typed['valid'] else 'other'
+        counts = self.count_tags_by_entity[entity_type]
+        for marker_or_vals in TAG_CATEGORIES:
+            category = counts[marker_or_vals]
+            for tag in typed[marker_or_vals]:
+                category[tag] = category.get(tag, 0) + 1
+
+    # Fold in the tally of another part of the building (e.g. a chunk typed
+    # in a worker process).  Merging in building order keeps the tag order
+    # of count_tags_by_entity identical to a single pass.
+    def merge(self, other):
+        self.markers_used.update(other.markers_used)
+        self.vals_used.update(other.vals_used)
+        for entity_type, categories in other.count_tags_by_entity.items():
+            counts = self.count_tags_by_entity.setdefault(entity_type, {i: {} for i in TAG_CATEGORIES})
+            for marker_or_vals, tags in categories.items():
+                category = counts[marker_or_vals]
+                for tag, n in tags.items():
+                    category[tag] = category.get(tag, 0) + n
+        return self
+
+    # The defs are not shipped when pickled (e.g. back from a worker
+    # process), the default HaystackDefs is used on the other side
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['defs'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.defs is None:
+            self.defs = get_default_defs()
+
+    def general(self):
+        all_markers = self.defs.all_markers
+        all_vals = self.defs.all_vals
+        return {
+            'valid_markers': list(self.markers_used.intersection(all_markers)),
+            'invalid_markers': list(self.markers_used.difference(all_markers)),
+            'valid_vals': list(self.vals_used.intersection(all_vals)),
+            'invalid_vals': list(self.vals_used.difference(all_vals)),
+            'count_tags_by_entity': self.count_tags_by_entity,
+        }
+
+
+# Entities are typed through a TypingCache, so that entities sharing a tag
+# signature are only typed once.  A fresh cache is used for each call unless
+# one is passed in (e.g. to share it across buildings); cache=False disables it.
+# entities may be any iterable (e.g. a generator streaming a large export),
+# as it is only iterated once.  Each typed entity is passed to on_entity if
+# given, and with keep_entities=False report['entities'] is left empty so
+# that memory use does not grow with the building.
+# With workers > 1 the entities are typed in chunks by a process pool, see
+# ph_typer_many_parallel; the report is identical to the serial one.
+# With metrics (a Metrics, or True for a new one; see utils/metrics.py) the
+# per stage timings and counters are recorded and attached to the report
+# as report['metrics'].
+# valid_entities and all_entities are kept for backwards compatibility only,
+# see ph_typer
+@_profiled
+def ph_typer_many(entities, valid_entities=None, all_entities=None, *, defs=None, cache=None,
+                  keep_entities=True, on_entity=None, workers=None, metrics=None):
+    if defs is None:
+        defs = get_default_defs()
+    metrics = _resolve_metrics(metrics)
+    if metrics is not None:
+        with collect_metrics(metrics), metrics.stage('ph_typer_many'):
+            report = _ph_typer_many_instrumented(entities, defs, cache, keep_entities, on_entity, workers,
+                                                 metrics)
+        report['metrics'] = metrics.as_dict()
+        return report
+    if workers is not None and workers > 1:
+        from .parallel import ph_typer_many_parallel
+        return ph_typer_many_parallel(entities, workers=workers, defs=defs,
+                                      keep_entities=keep_entities, on_entity=on_entity)
+    if cache is None:
+        cache = TypingCache()
+    elif cache is False:
+        cache = None
     report = {
         'entities': [],
         'general': {}
     }
+    tally = ReportTally(defs)
     for e in entities:
-        report['entities'].append(ph_typer(e, valid_entities, all_entities))
-    for e in range(0, len(report['entities'])):
-        if 'subclasses_in_entity' in report['entities'][e].keys():
-            sc = report['entities'][e]['subclasses_in_entity']
-            fc = report['entities'][e]['fc_entity_type']
-            report['entities'][e]['lowest_subclass'] = lowest_subclass(sc, fc)
-    report = ph_reporter_general(entities, report)
+        typed = ph_typer(e, defs=defs, cache=cache)
+        tally.add(e, typed)
+        if on_entity is not None:
+            on_entity(typed)
+        if keep_entities:
+            report['entities'].append(typed)
+    report['general'] = tally.general()
     return report
 
 
-# Expect a report from ph_typer_many, print out report
-def reporter(report, bldg_name, bldg):
-    valid = 0
-    no_fc_entity = 0
-    mult_fc_entities = 0
-    fc_count = {}
-    subclass_count = {}
+# ph_typer_many, timing the typing, aggregation and on_entity callback of
+# every entity into metrics
+def _ph_typer_many_instrumented(entities, defs, cache, keep_entities, on_entity, workers, metrics):
+    if workers is not None and workers > 1:
+        from .parallel import ph_typer_many_parallel
+        typed_count = [0]
+
+        def counting(typed):
+            typed_count[0] += 1
+            if on_entity is not None:
+                on_entity(typed)
+        with metrics.stage('typing'):
+            report = ph_typer_many_parallel(entities, workers=workers, defs=defs,
+                                            keep_entities=keep_entities, on_entity=counting)
+        metrics.count('entities', typed_count[0])
+        return report
+    if cache is None:
+        cache = TypingCache()
+    elif cache is False:
+        cache = None
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    report = {
+        'entities': [],
+        'general': {}
+    }
+    tally = ReportTally(defs)
+    clock = time.perf_counter
+    typing = aggregation = output = 0.0
+    n = 0
+    for e in entities:
+        start = clock()
+        typed = ph_typer(e, defs=defs, cache=cache)
+        typed_at = clock()
+        tally.add(e, typed)
+        added_at = clock()
+        if on_entity is not None:
+            on_entity(typed)
+        if keep_entities:
+            report['entities'].append(typed)
+        typing += typed_at - start
+        aggregation += added_at - typed_at
+        output += clock() - added_at
+        n += 1
+    start = clock()
+    report['general'] = tally.general()
+    aggregation += clock() - start
+
+    metrics.add_time('typing', typing, n)
+    metrics.add_time('aggregation', aggregation, n)
+    if on_entity is not None:
+        metrics.add_time('on_entity', output, n)
+    metrics.count('entities', n)
+    if cache is not None:
+        metrics.count('typing_cache_hits', cache.hits - hits)
+        metrics.count('typing_cache_misses', cache.misses - misses)
+    return report
 
-    # Count the number of valid entities
-    for r in report['entities']:
+
+# Accumulates the summarize_report counts one typed entity at a time, so
+# that a report can be summarized while it is being streamed out
+class ReportSummary(object):
+    def __init__(self):
+        self.valid = 0
+        self.no_fc_entity = 0
+        self.mult_fc_entities = 0
+        self.fc_count = {}
+        self.subclass_count = {}
+
+    def add(self, r):
+        # Entities without an id are not typed
+        if 'valid' not in r:
+            return
         if r['valid']:
-            valid += 1
+            self.valid += 1
             if 'lowest_subclass' in r.keys():
                 sc = r['lowest_subclass']
-                if sc not in subclass_count.keys():
-                    subclass_count[sc] = 1
-                else:
-                    subclass_count[sc] += 1
+                self.subclass_count[sc] = self.subclass_count.get(sc, 0) + 1
             fc = r['fc_entity_type']
-            if fc not in fc_count.keys():
-                fc_count[fc] = 1
-            else:
-                fc_count[fc] += 1
+            self.fc_count[fc] = self.fc_count.get(fc, 0) + 1
+        elif r['description'] == 'No first class entity type provided':
+            self.no_fc_entity += 1
         else:
-            if r['description'] == 'No first class entity type provided':
-                no_fc_entity += 1
-            else:
-                mult_fc_entities += 1
+            self.mult_fc_entities += 1
+
+    def summary(self, total):
+        return {
+            'total': total,
+            'valid': self.valid,
+            'no_fc_entity': self.no_fc_entity,
+            'mult_fc_entities': self.mult_fc_entities,
+            'fc_count': self.fc_count,
+            'subclass_count': self.subclass_count,
+        }
+
 
+# Summarize a report from ph_typer_many: the number of valid entities,
+# entities with no / multiple first class entity types, and counts by
+# first class entity type and by lowest subclass.  bldg is the list of
+# entities the report was built from.
+def summarize_report(report, bldg):
+    summary = ReportSummary()
+    for r in report['entities']:
+        summary.add(r)
+    return summary.summary(len(bldg))
+
+
+def print_summary(summary, bldg_name, sites=()):
+    fc_count = summary['fc_count']
     print("Report for {}".format(bldg_name))
-    print("Total number of entities: {}".format(len(bldg)))
-    print("Number of valid entities: {}".format(valid))
-    print("Number of entities w/no first class entity defined: {}".format(no_fc_entity))
-    print("Number of entities w/multiple first class entities defined: {}".format(mult_fc_entities))
-    print("Count of classes by lowest subclass found: {}".format(subclass_count))
+    print("Total number of entities: {}".format(summary['total']))
+    print("Number of valid entities: {}".format(summary['valid']))
+    print("Number of entities w/no first class entity defined: {}".format(summary['no_fc_entity']))
+    print("Number of entities w/multiple first class entities defined: {}".format(summary['mult_fc_entities']))
+    print("Count of classes by lowest subclass found: {}".format(summary['subclass_count']))
     print("Count of first class entities: {}".format(fc_count))
-    if 'site' in fc_count.keys():
-        sites, _ = find_sites(bldg)
-        for s in sites:
-            print("Site info: {}".format(s))
-
-    # print(json.dumps(report['general'], sort_keys=True, indent=2))
-    output_dir = os.path.join(os.getcwd(), 'output', bldg_name)
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
-    summary_json = os.path.join(output_dir, 'report_{}.json'.format(bldg_name))
-    summary_csv = os.path.join(output_dir, 'report_{}.csv'.format(bldg_name))
-    with open(summary_json, 'w') as f:
-        json.dump(report, f, sort_keys=True, indent=2)
-
-    with open(summary_csv, 'w') as f:
-        headers = ['entity_type', 'tag_category', 'tag', 'count']
+    for s in sites:
+        print("Site info: {}".format(s))
+
+
+# Write count_tags_by_entity as report_<bldg_name>.csv
+def write_tag_counts_csv(f_name, count_tags_by_entity):
+    with open(f_name, 'w') as f:
         csv_writer = csv.writer(f)
-        csv_writer.writerow(headers)
-        for entity_type in report['general']['count_tags_by_entity'].keys():
-            for tag_category in report['general']['count_tags_by_entity'][entity_type].keys():
-                for tag, val in report['general']['count_tags_by_entity'][entity_type][tag_category].items():
-                    csv_writer.writerow([entity_type, tag_category, tag, val])
-
-# TODO: Add how BRICK points 'found' given equip.
-# Given an equip dict, and a dict of entities, find the points
-# belonging to the respective equipment
+        csv_writer.writerow(TAG_COUNT_COLUMNS)
+        csv_writer.writerows(tag_count_rows(count_tags_by_entity))
+
+
+# Expect a report from ph_typer_many, print out report and write the
+# report files to <output_root>/<bldg_name> (output_root defaults to
+# ./output): the report through the fmt output sink (see utils/sinks.py,
+# 'pretty' is the report_<bldg_name>.json of old) and report_<bldg_name>.csv.
+# Returns the summarize_report summary.  With metrics (as for ph_typer_many)
+# the summary and writing stages are added to report['metrics'].
+@_profiled
+def reporter(report, bldg_name, bldg, output_root=None, verbose=True, fmt='pretty', metrics=None):
+    from .sinks import open_sink, site_output_dir
+    shared = _resolve_metrics(metrics)
+    local = Metrics() if shared is not None else None
+    with collect_metrics(local) if local is not None else nullcontext():
+        with _timed('summary'):
+            summary = summarize_report(report, bldg)
+
+        if verbose:
+            sites = find_sites(bldg)[0] if 'site' in summary['fc_count'] else ()
+            print_summary(summary, bldg_name, sites)
+
+        output_dir = site_output_dir(output_root, bldg_name)
+        with _timed('write_report'):
+            with open_sink(fmt, output_dir, bldg_name) as sink:
+                for r in report['entities']:
+                    sink.write_entity(r)
+                sink.write_general(report['general'])
+        with _timed('write_csv'):
+            write_tag_counts_csv(os.path.join(output_dir, 'report_{}.csv'.format(bldg_name)),
+                                 report['general']['count_tags_by_entity'])
+    if local is not None:
+        shared.merge(local)
+        report['metrics'] = Metrics.from_dict(report.get('metrics')).merge(local).as_dict()
+    return summary
+
+# Given an equip, and the entities of a building, find the points
+# belonging to the respective equipment.
+# haystack: equip is the equip's entity dict and the points are the entities
+#     whose equipRef is the equip (entities without an equipRef are skipped).
+#     Pass a RefGraph built over the building as entities to look the points
+#     up in its index instead of scanning every entity.
+# brick: equip is the equip's URI and entities an rdflib Graph of the
+#     building; points are linked to the equip by bf:isPointOf or bf:hasPoint.
 def find_equip_points(equip, entities, ontology_lang='haystack'):
     if ontology_lang == 'haystack':
-        equip_id = equip['id']
-        points = [p for p in entities if p['equipRef'] == equip_id]
+        from .refs import RefGraph, ref_id
+        if isinstance(entities, RefGraph):
+            if ref_id(equip.get('id')) not in entities.positions:
+                return []
+            return entities.referrers(equip, 'equipRef')
+        equip_id = ref_id(equip.get('id'))
+        points = [p for p in entities if ref_id(p.get('equipRef')) == equip_id]
         return points
     elif ontology_lang == 'brick':
-        # do stuff
-        a = 1
+        from .queries import BF
+        points = set(entities.subjects(BF.isPointOf, equip))
+        points.update(entities.objects(equip, BF.hasPoint))
+        return sorted(points)
     else:
         return False
 
 
-# TODO: Entity class definition...how to?
-class Entity(object):
-    def __init__(self, entity_dict):
-        self.as_dict = entity_dict
-        self.id = entity_dict['id'] if 'id' in entity_dict else str(uuid.uuid4())
-        self.dis = entity_dict['dis'] if 'dis' in entity_dict else 'No dis available'
-        # self.root_entity = self.generate_root_entity()
-
-    def __str__(self):
-        return self.dis
-
-    # def generate_root_entity(self):
-    # Method to find 'largest' entity type definition, i.e. one of:
-    #     - device
-    #     - equip
-    #     - network
-    #     - point
-    #     - protocol
-    #     - site
-    #     - space
-    #     - weatherStation
+# Star imports (used by the examples and scripts) export every public name,
+# including the lazily resolved legacy vocabulary lists and the SPARQL
+# helpers, so only they import rdflib
+def _star_names():
+    names = [n for n in list(globals()) if not n.startswith('_')] + \
+        list(_LEGACY_VOCABULARY) + ['EACH_EQUIP_AS_SET']
+    return names + [n for n in dir(_queries()) if not n.startswith('_') and n not in names]
@@ -0,0 +1,222 @@
+import gc
+import numpy as np
+from .defs import get_default_defs
+from .utils import TAG_CATEGORIES, ph_subtyper, lowest_subclass
+
+# Number of set bits in every possible byte, used to popcount packed rows
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+# Interns the tag names of a building into column ids and encodes the
+# entities as two packed bit matrices (one bit per column): one for marker
+# tags and one for val tags.  Entities with the same tag layout (keys and
+# which of them are markers) share a matrix row; entity_rows maps each
+# entity to its row, so the per entity work is a single dict lookup.
+class TagMatrix(object):
+    def __init__(self, entities):
+        self.columns = {}
+        self.ids = []
+        layouts = {}
+        entity_rows = []
+        is_marker = "m:".__eq__
+        for e in entities:
+            self.ids.append(e.get('id'))
+            layout = (tuple(e), tuple(map(is_marker, e.values())))
+            r = layouts.get(layout)
+            if r is None:
+                r = layouts[layout] = len(layouts)
+            entity_rows.append(r)
+        self.entity_rows = np.asarray(entity_rows, dtype=np.int64)
+
+        m_rows, m_cols, v_rows, v_cols = [], [], [], []
+        columns = self.columns
+        for r, (keys, markers) in enumerate(layouts):
+            for k, m in zip(keys, markers):
+                c = columns.get(k)
+                if c is None:
+                    c = columns[k] = len(columns)
+                if m:
+                    m_rows.append(r)
+                    m_cols.append(c)
+                else:
+                    v_rows.append(r)
+                    v_cols.append(c)
+        self.tags = list(columns)
+        self.n_rows = len(layouts)
+        self.n_bytes = max(1, (len(columns) + 7) // 8)
+        self.markers = self._pack(m_rows, m_cols)
+        self.vals = self._pack(v_rows, v_cols)
+
+    # Each (row, column) pair sets a distinct bit, so summing the bit
+    # values per byte is the same as or-ing them together
+    def _pack(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        flat = rows * self.n_bytes + (cols >> 3)
+        bits = np.left_shift(1, 7 - (cols & 7))
+        packed = np.bincount(flat, weights=bits, minlength=self.n_rows * self.n_bytes)
+        return packed.astype(np.uint8).reshape(self.n_rows, self.n_bytes)
+
+    # Packed column mask of the tags in the given vocabulary
+    def mask(self, vocabulary):
+        bits = np.zeros(self.n_bytes * 8, dtype=bool)
+        for tag, c in self.columns.items():
+            if tag in vocabulary:
+                bits[c] = True
+        return np.packbits(bits)
+
+    # Column names of the set bits in a packed row
+    def names(self, packed_row):
+        bits = np.unpackbits(packed_row)[:len(self.tags)]
+        return [self.tags[c] for c in np.flatnonzero(bits)]
+
+
+# Vectorized equivalent of ph_typer_many.  Entities are encoded as bit
+# matrices, the valid / invalid splits, first class entity counts and
+# multiple first class detection are computed as whole matrix operations,
+# and each distinct tag signature (unique matrix row) is then resolved to a
+# ph_typer result once.  The returned report matches ph_typer_many.
+# Entities without an id are reported with the same status as ph_typer, and
+# are left out of count_tags_by_entity.
+def ph_typer_many_vectorized(entities, defs=None):
+    if defs is None:
+        defs = get_default_defs()
+    matrix = TagMatrix(entities)
+    report = {
+        'entities': [],
+        'general': {}
+    }
+    if matrix.n_rows == 0:
+        _general(matrix, report, defs, None, None, None)
+        return report
+
+    valid_m_mask = matrix.mask(defs.all_markers)
+    valid_v_mask = matrix.mask(defs.all_vals)
+    fc_mask = matrix.mask(defs.fc_entities)
+
+    # One row per distinct signature (layouts with the same tags in a
+    # different key order collapse here), inverse maps entities back to it
+    combined = np.hstack([matrix.markers, matrix.vals])
+    row_view = np.ascontiguousarray(combined).view(np.dtype((np.void, combined.shape[1]))).ravel()
+    _, first, layout_inverse = np.unique(row_view, return_index=True, return_inverse=True)
+    inverse = layout_inverse.ravel()[matrix.entity_rows]
+    u_markers = matrix.markers[first]
+    u_vals = matrix.vals[first]
+
+    fc_count = POPCOUNT[u_markers & fc_mask].sum(axis=1)
+    val_count = POPCOUNT[u_vals].sum(axis=1)
+    valid_markers = u_markers & valid_m_mask
+    invalid_markers = u_markers & ~valid_m_mask
+    # ph_typer only splits vals when an entity has more than one
+    has_vals = (val_count > 1)[:, None]
+    valid_vals = np.where(has_vals, u_vals & valid_v_mask, 0).astype(np.uint8)
+    invalid_vals = np.where(has_vals, u_vals & ~valid_v_mask, 0).astype(np.uint8)
+
+    typed = []
+    for u in range(len(first)):
+        typed.append(_typed_signature(matrix, defs, u_markers[u], fc_count[u], fc_mask, {
+            'valid_markers': valid_markers[u],
+            'invalid_markers': invalid_markers[u],
+            'valid_vals': valid_vals[u],
+            'invalid_vals': invalid_vals[u],
+        }))
+
+    # Stamp each entity with its signature's result, copying the lists so
+    # that entities never share mutable results.  Millions of small
+    # containers are allocated here and none of them can form a cycle, so
+    # the cyclic garbage collector is paused rather than rescanning them.
+    list_keys = [[k for k, v in t.items() if isinstance(v, list)] for t in typed]
+    entities_out = report['entities']
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _stamp(entities_out, matrix.ids, inverse.tolist(), typed, list_keys)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    _general(matrix, report, defs, inverse, typed,
+             [valid_markers, invalid_markers, valid_vals, invalid_vals])
+    return report
+
+
+def _stamp(entities_out, ids, inverse, typed, list_keys):
+    for entity_id, u in zip(ids, inverse):
+        if entity_id is None:
+            entities_out.append({
+                'status': {
+                    'valid': False,
+                    'description': 'Entity does not have an id'
+                }
+            })
+            continue
+        to_return = {'id': entity_id}
+        to_return.update(typed[u])
+        for k in list_keys[u]:
+            to_return[k] = to_return[k][:]
+        entities_out.append(to_return)
+
+
+# Build the ph_typer result (without id) of one distinct signature from
+# its precomputed packed rows
+def _typed_signature(matrix, defs, markers_row, fc_count, fc_mask, categories):
+    to_return = {}
+    if fc_count == 0:
+        to_return['valid'] = False
+        to_return['description'] = "No first class entity type provided"
+    elif fc_count > 1:
+        to_return['valid'] = False
+        to_return['description'] = "Mutliple first class entity types provided: {}".format(
+            set(matrix.names(markers_row & fc_mask)))
+    else:
+        to_return['valid'] = True
+        to_return['fc_entity_type'] = matrix.names(markers_row & fc_mask)[0]
+    lists = {k: matrix.names(v) for k, v in categories.items()}
+
+    if to_return['valid']:
+        entity_markers = set(matrix.names(markers_row))
+        non_entity_markers = set(lists['valid_markers']).difference(defs.all_entities)
+        to_return = ph_subtyper(to_return, entity_markers, non_entity_markers, defs)
+        if 'subclasses_in_entity' in to_return:
+            to_return['lowest_subclass'] = lowest_subclass(to_return['subclasses_in_entity'],
+                                                           to_return['fc_entity_type'], defs)
+    to_return.update(lists)
+    return to_return
+
+
+# Fill report['general'] (the same sections as ph_reporter_general) from the
+# matrices: tags used anywhere are column-wise ors, and the per first class
+# entity type counts are a (types x signatures) @ (signatures x tags) product
+def _general(matrix, report, defs, inverse, typed, categories):
+    used_markers = set(matrix.names(np.bitwise_or.reduce(matrix.markers, axis=0))) \
+        if matrix.n_rows else set()
+    used_vals = set(matrix.names(np.bitwise_or.reduce(matrix.vals, axis=0))) \
+        if matrix.n_rows else set()
+    report['general']['valid_markers'] = list(used_markers.intersection(defs.all_markers))
+    report['general']['invalid_markers'] = list(used_markers.difference(defs.all_markers))
+    report['general']['valid_vals'] = list(used_vals.intersection(defs.all_vals))
+    report['general']['invalid_vals'] = list(used_vals.difference(defs.all_vals))
+
+    entity_types = list(defs.fc_entities) + ['other']
+    counts = {t: {c: {} for c in TAG_CATEGORIES} for t in entity_types}
+    report['general']['count_tags_by_entity'] = counts
+    if inverse is None:
+        return report
+
+    # Number of (id carrying) entities of each signature, per entity type
+    has_id = np.fromiter((i is not None for i in matrix.ids), dtype=bool, count=len(matrix.ids))
+    per_signature = np.bincount(inverse[has_id], minlength=len(typed))
+    type_index = {t: i for i, t in enumerate(entity_types)}
+    weights = np.zeros((len(entity_types), len(typed)), dtype=np.int64)
+    for u, t in enumerate(typed):
+        entity_type = t['fc_entity_type'] if t['valid'] else 'other'
+        weights[type_index[entity_type], u] = per_signature[u]
+
+    n_tags = len(matrix.tags)
+    for category, packed in zip(TAG_CATEGORIES, categories):
+        bits = np.unpackbits(packed, axis=1)[:, :n_tags].astype(np.int64)
+        totals = weights @ bits
+        for t, row in zip(entity_types, totals):
+            for c in np.flatnonzero(row):
+                counts[t][category][matrix.tags[c]] = int(row[c])
+    return report